@@ -1,8 +1,11 @@
 import json
 import dataclasses
+import hashlib
 import os
+import sys
 from dataclasses import dataclass
-from datetime import timedelta
+from datetime import datetime, timedelta
+import time
 from random import sample
 
 import git
@@ -10,6 +13,13 @@ import javalang as jl
 from git import GitCommandError
 import re
 
+# metrics.py is in the repository root, it only needs the standard library
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import metrics
+# also when this script is loaded by path from another directory
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import java_scanner
+
 
 
 REPO_BASE = "szzy_repos/"
@@ -17,6 +27,12 @@ COMMITS_BASE = "repo-info/"
 SZZ_OUT_BASE = "szz-in/"
 OUT_BASE = "out/"
 
+# Texts that are written once in the output and referenced by hash from the pairs
+POOLED_FIELDS = ("old_method_content", "new_method_content", "old_comment", "new_comment")
+# scanner: java_scanner.py, javalang for the files it is unsure about. javalang: every file.
+PARSERS = ("scanner", "javalang")
+PARSER = os.getenv("GEN_OUT_PARSER", "scanner")
+
 
 @dataclass
 class CommitPair:
@@ -33,11 +49,90 @@ class CommitPair:
     _id: str
 
 
-def _my_get_string(content, node: jl.tree.MethodDeclaration):
+@dataclass(frozen=True)
+class CommitInfo:
+    hexsha: str
+    committed_datetime: datetime
+    parents: tuple
+    tree: str
+
+
+class RepoContext:
+    # One git.Repo per repository and process, with the metadata of every commit reachable from
+    # HEAD read in a single git log pass. Lookups that the table answers are counted as avoided
+    # git calls.
+    def __init__(self, repo_path):
+        self.repo = git.Repo(repo_path)
+        self.avoided = 0
+        self.commits = {}
+        # newest first, the order of repo.iter_commits(rev='HEAD')
+        self.order = []
+        with metrics.timer("gen_out_git_seconds"):
+            log = self.repo.git.log("--format=%H %cI %T %P", "HEAD")
+        for line in log.splitlines():
+            hexsha, date, tree, *parents = line.split(" ")
+            info = CommitInfo(hexsha, datetime.fromisoformat(date), tuple(parents), tree)
+            self.commits[hexsha] = info
+            self.order.append(info)
+
+    def _avoid(self, n=1):
+        self.avoided += n
+        metrics.inc("gen_out_git_calls_avoided", n)
+
+    def commit(self, rev):
+        info = self.commits.get(rev)
+        if info is not None:
+            self._avoid()
+            return info
+        # not reachable from HEAD or not a full hash
+        with metrics.timer("gen_out_git_seconds"):
+            c = self.repo.commit(rev)
+        info = CommitInfo(c.hexsha, c.committed_datetime, tuple(p.hexsha for p in c.parents), c.tree.hexsha)
+        self.commits[rev] = info
+        return info
+
+    def commits_between(self, start, end):
+        # commits from HEAD committed strictly between start and end, newest first
+        self._avoid()
+        return [c for c in self.order if start < c.committed_datetime < end]
+
+
+_contexts = {}
+
+
+def repo_context(repo_path):
+    key = os.path.abspath(repo_path)
+    if key in _contexts:
+        _contexts[key]._avoid()
+    else:
+        _contexts[key] = RepoContext(repo_path)
+    return _contexts[key]
+
+
+def parse_methods(content, parser=None):
+    # Method declarations of a file in source order, javalang nodes or java_scanner spans.
+    # Raises when javalang cannot parse the file.
+    parser = parser or PARSER
+    if parser not in PARSERS:
+        raise ValueError(f"parser must be one of {', '.join(PARSERS)}")
+    if parser == "scanner":
+        spans = java_scanner.scan(content)
+        if spans is not None:
+            metrics.inc("gen_out_scanned_files")
+            return spans
+        metrics.inc("gen_out_scanner_fallbacks")
+    return [node for _, node in jl.parse.parse(content).filter(jl.tree.MethodDeclaration)]
+
+
+def _my_get_string(content, node: jl.tree.MethodDeclaration | java_scanner.MethodSpan):
     start = node.position
     start_pos = start.line - 1
     lines = content.splitlines(True)
-    if node.body is None:
+    if isinstance(node, java_scanner.MethodSpan):
+        has_body, last = node.has_body, node.last_statement
+    else:
+        has_body, last = node.body is not None, node.body[-1].position if node.body else None
+    if not has_body:
         code = lines[start_pos]
         end_pos = start_pos
         while ';' not in code:
@@ -45,11 +140,10 @@ def _my_get_string(content, node: jl.tree.MethodDeclaration):
             code = code + lines[end_pos]
         return code
 
-    if not node.body:
+    if last is None:
         end_pos = start_pos
     else:
-        last_elem = node.body[-1]
-        end_pos = last_elem.position.line - 1
+        end_pos = last.line - 1
 
     if end_pos == start_pos:
         end_pos += 1
@@ -136,18 +230,25 @@ def __get_comment_if_any(start, content):
 
 
 def compare_commits(repo_path, old_commit, new_commit, bug_introducing):
-    repo = git.Repo(repo_path)
+    ctx = repo_context(repo_path)
+    repo = ctx.repo
     
     # Getting some general info
     global project_name
-    old_commit_date = str(repo.commit(old_commit).committed_datetime)
-    new_commit_date = str(repo.commit(new_commit).committed_datetime)
+    old_info, new_info = ctx.commit(old_commit), ctx.commit(new_commit)
+    old_commit_date = str(old_info.committed_datetime)
+    new_commit_date = str(new_info.committed_datetime)
     
     # accessing a global id counter
     global _id
 
-    # Getting git diff of the two files
-    diff = repo.git.diff(old_commit, new_commit)
+    # Getting git diff of the two files, nothing changed when both commits have the same tree
+    if old_info.tree == new_info.tree:
+        ctx._avoid()
+        diff = ""
+    else:
+        with metrics.timer("gen_out_git_seconds"):
+            diff = repo.git.diff(old_commit, new_commit)
     file_names = [(line.split(" b/")[0].split(" a/")[-1].strip(), line.split(" b/")[-1].strip()) for line in
                   diff.splitlines() if line.startswith("diff --git")]
 
@@ -162,27 +263,33 @@ def compare_commits(repo_path, old_commit, new_commit, bug_introducing):
         "file_parse_erros": [],
         "method_parse_errors": []
     }
+    metrics.inc("gen_out_files", len(file_names))
     pairs = []
     for file_name in file_names:
         try:
-            content_old = repo.git.show(f"{old_commit}:{file_name}")
-            content_new = repo.git.show(f"{new_commit}:{file_name}")
+            with metrics.timer("gen_out_git_seconds"):
+                content_old = repo.git.show(f"{old_commit}:{file_name}")
+                content_new = repo.git.show(f"{new_commit}:{file_name}")
         except GitCommandError as e:
             # print(e, file=sys.stderr)
+            metrics.inc("gen_out_git_errors")
             continue
         try:
-            tree_old = jl.parse.parse(content_old)
-            tree_new = jl.parse.parse(content_new)
+            with metrics.timer("gen_out_parse_seconds"):
+                tree_old = parse_methods(content_old)
+                tree_new = parse_methods(content_new)
         except Exception as e:
             print(f"Error Parsing file {file_name} skipping")
+            metrics.inc("gen_out_file_parse_errors")
             info["file_parse_erros"].append({
                 "filename": file_name,
                 "error": str(e)
             })
             continue
 
+        extract_start = time.perf_counter()
         methods_old, comments_old, methods_new, comments_new = {}, {}, {}, {}
-        for _, node in tree_old.filter(jl.tree.MethodDeclaration):
+        for node in tree_old:
             try:
                 methods_old[node.name] = _my_get_string(content_old, node)
                 comments_old[node.name] = __get_comment_if_any(
@@ -197,7 +304,7 @@ def compare_commits(repo_path, old_commit, new_commit, bug_introducing):
                 })
                 continue
 
-        for _, node in tree_new.filter(jl.tree.MethodDeclaration):
+        for node in tree_new:
             try:
                 methods_new[node.name] = _my_get_string(content_new, node)
                 comments_new[node.name] = __get_comment_if_any(
@@ -211,6 +318,8 @@ def compare_commits(repo_path, old_commit, new_commit, bug_introducing):
                 })
                 continue
 
+        metrics.observe("gen_out_extract_seconds", time.perf_counter() - extract_start)
+
         method_names_old = set(methods_old.keys())
         method_names_new = set(methods_new.keys())
 
@@ -223,22 +332,18 @@ def compare_commits(repo_path, old_commit, new_commit, bug_introducing):
             _id += 1
             pairs.append(p)
 
+    metrics.inc("gen_out_pairs", len(pairs))
+    metrics.inc("gen_out_method_parse_errors", len(info["method_parse_errors"]))
     return pairs, info
 
 
+@metrics.timed("gen_out_commit_window_seconds")
 def get_commits_before(repo_path, target_commit, window):
-    repo = git.Repo(repo_path)
-    target_commit = repo.commit(target_commit)
+    ctx = repo_context(repo_path)
+    target_commit = ctx.commit(target_commit)
     window_start = target_commit.committed_datetime - timedelta(days=window)
-
-    commits_before = []
     window_end = target_commit.committed_datetime
-
-    for commit in repo.iter_commits(rev='HEAD'):
-        if window_start < commit.committed_datetime < window_end:
-            commits_before.append(commit)
-
-    return commits_before
+    return ctx.commits_between(window_start, window_end)
 
 
 def extract_javadoc_explanation(input_string):
@@ -283,20 +388,41 @@ def remove_special_characters(input_string):
 
 
 
-def main():
-    file_id = os.getenv("SLURM_ARRAY_TASK_ID", None)
-    assert file_id is not None
-    with open(SZZ_OUT_BASE+f"{file_id}.json", 'r') as f:
+def content_key(text):
+    # Must match content_key in string_pool.py
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+def pool_pairs(pairs):
+    strings = {}
+    dicts = []
+    raw_size = 0
+    for p in pairs:
+        d = dataclasses.asdict(p)
+        for f in POOLED_FIELDS:
+            raw_size += len(d[f])
+            key = content_key(d[f])
+            strings[key] = d[f]
+            d[f] = key
+        dicts.append(d)
+    unique_size = sum(len(x) for x in strings.values())
+    print(f"string pool: {len(dicts) * len(POOLED_FIELDS)} texts, {len(strings)} unique, "
+          f"{raw_size} -> {unique_size} chars")
+    return {"strings": strings, "pairs": dicts}
+
+
+def load_targets(szz_file, base=""):
+    # Samples the same number of bug introducing and normal target commits of a project.
+    # base is the SZZ-2-CPs directory when running from somewhere else.
+    with open(szz_file, 'r') as f:
         data = json.load(f)
 
-    global project_name
     project_name = data[0]["repo_name"]
 
-    with open(COMMITS_BASE+f"{project_name}.txt", 'r') as f:
+    with open(os.path.join(base, COMMITS_BASE, f"{project_name}.txt"), 'r') as f:
         # Read all lines and remove any leading/trailing whitespace
         commits = [line.strip() for line in f.readlines()]
 
-    print(f"Working on project {project_name}")
     BIC = [d['inducing_commit_hash'][0]
            for d in data if d['inducing_commit_hash']]
     normal_commits = [c for c in commits if c not in BIC]
@@ -309,45 +435,75 @@ def main():
     sampled = [(x, 0) for x in sampled]
     bic_sampled = [(x, 1) for x in bic_sampled]
 
-    commit_ambari = bic_sampled + sampled
-    print("Commit samples created", len(commit_ambari))
+    return project_name, bic_sampled + sampled
 
-    repo_path = REPO_BASE+project_name+"/"
 
-    res = [] # type: list[CommitPair]
-    global _id
-    _id = 0
-    final_reports = []
-    for i, target_commit in enumerate(commit_ambari):
-        print(f"Working on {i}/{len(commit_ambari)} commit", flush=True)
-        commits = get_commits_before(repo_path, target_commit[0], 14)
+def is_clean(cp):
+    return (remove_special_characters(cp.old_method_content) != remove_special_characters(cp.new_method_content)  # methods differ
+            and extract_javadoc_explanation(cp.old_comment) != ""  # old comment has non-empty java doc
+            and extract_javadoc_explanation(cp.new_comment) != "")  # new comment has non-empty java doc
+
 
-        for commit in commits:
-            pairs, info = compare_commits(repo_path, commit.hexsha, target_commit[0], target_commit[1])
-            res.extend(pairs)
-            final_reports.append(info)
+def extract_target(repo_path, target_commit, window=14):
+    # Pairs of one (target commit, bug introducing) sample with every commit in the window before it
+    pairs, reports = [], []
+    for commit in get_commits_before(repo_path, target_commit[0], window):
+        p, info = compare_commits(repo_path, commit.hexsha, target_commit[0], target_commit[1])
+        pairs.extend(p)
+        reports.append(info)
+    return pairs, reports
 
+
+def write_outputs(project_name, res, final_reports, base=""):
     # saving raw data
-    with open(OUT_BASE+project_name+".json", "w+") as resout:
-        dicts = [dataclasses.asdict(x) for x in res]
-        json.dump(dicts, resout)
+    with open(os.path.join(base, OUT_BASE, project_name+".json"), "w+") as resout:
+        json.dump(pool_pairs(res), resout)
 
-    with open(OUT_BASE+"infos/"+project_name+".json", "w+") as infout:
+    with open(os.path.join(base, OUT_BASE, "infos", project_name+".json"), "w+") as infout:
         json.dump(final_reports, infout)
 
     # cleanning data
 
-    cleanned_data = []
-    for cp in res:
-        if remove_special_characters(cp.old_method_content) != remove_special_characters(cp.new_method_content): # methods differ
-            if extract_javadoc_explanation(cp.old_comment) != "" : # old comment has non-empty java doc
-                if extract_javadoc_explanation(cp.new_comment) != "" : # new comment has non-empty java doc
-                    cleanned_data.append(cp)
+    cleanned_data = [cp for cp in res if is_clean(cp)]
+    metrics.inc("gen_out_pairs_kept", len(cleanned_data))
+    metrics.inc("gen_out_pairs_dropped", len(res) - len(cleanned_data))
     
     print(f"cleanned_data: {len(cleanned_data)}, original_data: {len(res)}. Removed {len(res) - len(cleanned_data)}")
-    with open(OUT_BASE+"cleaned/"+project_name+".json", 'w+') as cout:
-        dicts = [dataclasses.asdict(x) for x in cleanned_data]
-        json.dump(dicts, cout)
+    cleaned_path = os.path.join(base, OUT_BASE, "cleaned", project_name+".json")
+    with open(cleaned_path, 'w+') as cout:
+        json.dump(pool_pairs(cleanned_data), cout)
+    return cleaned_path
+
+
+def run(szz_file, base="", window=14):
+    # Extracts and cleans the commit pairs of the project of szz_file, returns the path of the cleaned output.
+    global project_name
+    project_name, commit_ambari = load_targets(szz_file, base=base)
+    print(f"Working on project {project_name}")
+    print("Commit samples created", len(commit_ambari))
+
+    repo_path = os.path.join(base, REPO_BASE, project_name) + "/"
+    ctx = repo_context(repo_path)
+
+    res = [] # type: list[CommitPair]
+    global _id
+    _id = 0
+    final_reports = []
+    for i, target_commit in enumerate(commit_ambari):
+        print(f"Working on {i}/{len(commit_ambari)} commit", flush=True)
+        pairs, reports = extract_target(repo_path, target_commit, window)
+        res.extend(pairs)
+        final_reports.extend(reports)
+
+    print(f"git calls avoided: {ctx.avoided}")
+    return write_outputs(project_name, res, final_reports, base=base)
+
+
+def main():
+    file_id = os.getenv("SLURM_ARRAY_TASK_ID", None)
+    assert file_id is not None
+    run(SZZ_OUT_BASE+f"{file_id}.json")
+    metrics.export(f"gen-out-{file_id}")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,340 @@
+import re
+from typing import NamedTuple
+
+# Finds the method declarations of a Java file from its tokens, without building a syntax tree.
+# scan() returns None when it is unsure about a file, gen-out.py then parses it with javalang.
+
+_TOKEN = re.compile(r'''
+    (?P<ws>\s+)
+  | (?P<comment>//[^\n]*|/\*.*?\*/)
+  | (?P<text>"""(?:\\.|(?!""").)*?""")
+  | (?P<string>"(?:\\.|[^"\\\n])*")
+  | (?P<char>'(?:\\.|[^'\\\n])+')
+  | (?P<ident>[^\W\d][\w$]*|\$[\w$]*)
+  | (?P<number>\d[\w.]*|\.\d[\w.]*)
+  | (?P<op>\.\.\.|::|->|[{}()\[\];,.@=<>?:!~+\-*/&|^%])
+''', re.VERBOSE | re.DOTALL)
+MODIFIERS = {"public", "protected", "private", "static", "final", "abstract", "native", "synchronized",
+             "transient", "volatile", "strictfp", "default", "sealed"}
+TYPE_KEYWORDS = {"class", "interface", "enum"}
+# tokens a statement block follows
+_BLOCK_AFTER = {")", "else", "try", "finally", "do", ";", "{", "}", ":"}
+
+
+class Position(NamedTuple):
+    line: int
+
+
+class MethodSpan(NamedTuple):
+    name: str
+    # line of the first token after the modifiers and annotations, like javalang's position
+    position: Position
+    has_body: bool
+    # position of the last statement of the body, None for an empty body
+    last_statement: Position | None
+
+
+class _Unsure(Exception):
+    pass
+
+
+class _Scanner:
+    def __init__(self, content: str):
+        self.values: list[str] = []
+        self.kinds: list[str] = []
+        self.lines: list[int] = []
+        self.spans: list[list] = []
+        self._tokenize(content)
+
+    def _tokenize(self, content: str):
+        line, pos = 1, 0
+        for m in _TOKEN.finditer(content):
+            if m.start() != pos:
+                raise _Unsure(f"unknown token at line {line}")
+            pos = m.end()
+            kind, value = m.lastgroup, m.group()
+            if kind not in ("ws", "comment"):
+                self.values.append(value)
+                self.kinds.append(kind)
+                self.lines.append(line)
+            # javalang counts lines by \n too
+            line += value.count("\n")
+        if pos != len(content):
+            raise _Unsure(f"unknown token at line {line}")
+        self.values.append("")
+        self.kinds.append("eof")
+        self.lines.append(line)
+
+    def _skip_balanced(self, i: int, opening: str, closing: str) -> int:
+        # i is at the opening token, returns the index after the matching closing one
+        depth = 0
+        while True:
+            v = self.values[i]
+            if v == opening:
+                depth += 1
+            elif v == closing:
+                depth -= 1
+                if depth == 0:
+                    return i + 1
+            elif self.kinds[i] == "eof":
+                raise _Unsure(f"unbalanced {opening}")
+            i += 1
+
+    def _skip_annotation(self, i: int) -> int:
+        # @Name, @a.b.Name or @Name(...), the parentheses may hold {...} arrays
+        i = i + 1
+        while self.kinds[i] == "ident" and self.values[i + 1] == "." and self.kinds[i + 2] == "ident":
+            i += 2
+        if self.kinds[i] != "ident":
+            raise _Unsure(f"annotation without a name at line {self.lines[i]}")
+        i += 1
+        if self.values[i] == "(":
+            i = self._skip_balanced(i, "(", ")")
+        return i
+
+    def _is_type_declaration(self, i: int) -> bool:
+        v = self.values[i]
+        if v in TYPE_KEYWORDS:
+            return self.values[i - 1] != "." if i > 0 else True
+        # record is only a keyword in front of a declaration
+        return (v == "record" and self.kinds[i + 1] == "ident" and self.values[i + 2] in ("(", "<")
+                and self.values[i - 1] != ".")
+
+    def _type_declaration(self, i: int) -> int:
+        # i is at class/interface/enum/record or the @ of @interface, returns the index after the body
+        kind = "annotation" if self.values[i] == "@" else self.values[i]
+        while self.values[i] != "{":
+            if self.values[i] == "(":
+                # record components
+                i = self._skip_balanced(i, "(", ")")
+            elif self.values[i] == "@" and self.values[i + 1] != "interface":
+                i = self._skip_annotation(i)
+            elif self.values[i] in (";", "}") or self.kinds[i] == "eof":
+                raise _Unsure(f"type declaration without a body at line {self.lines[i]}")
+            else:
+                i += 1
+        return self._class_body(i + 1, kind)
+
+    def _class_body(self, i: int, kind: str) -> int:
+        # i is after the {, returns the index after the matching }
+        if kind == "enum":
+            i = self._enum_constants(i)
+            if self.values[i - 1] == "}":
+                return i
+        header: list[int] = []
+        while True:
+            v = self.values[i]
+            if self.kinds[i] == "eof":
+                raise _Unsure("class body without a closing brace")
+            if v == "}":
+                if header:
+                    raise _Unsure(f"incomplete member at line {self.lines[i]}")
+                return i + 1
+            if v == ";":
+                header = []
+                i += 1
+            elif v == "@" and self.values[i + 1] == "interface":
+                i = self._type_declaration(i)
+                header = []
+            elif v == "@":
+                i = self._skip_annotation(i)
+            elif self._is_type_declaration(i):
+                i = self._type_declaration(i)
+                header = []
+            elif v == "=":
+                # field initializer
+                i = self._code(i + 1, ";")
+                header = []
+            elif v == "{":
+                # initializer block or compact record constructor
+                i = self._code(i + 1, "}")
+                header = []
+            elif v == "(":
+                i = self._method(i, header, kind)
+                header = []
+            else:
+                header.append(i)
+                i += 1
+
+    def _enum_constants(self, i: int) -> int:
+        # returns the index after the ; that ends the constants, or after the } of an enum without members
+        while True:
+            v = self.values[i]
+            if v == ";":
+                return i + 1
+            if v == "}":
+                return i + 1
+            if v == "@":
+                i = self._skip_annotation(i)
+            elif v == "(":
+                i = self._code(i + 1, ")")
+            elif v == "{":
+                i = self._class_body(i + 1, "class")
+            elif self.kinds[i] == "ident" or v == ",":
+                i += 1
+            else:
+                raise _Unsure(f"unexpected {v!r} in enum constants at line {self.lines[i]}")
+
+    def _method(self, i: int, header: list[int], kind: str) -> int:
+        # i is at the ( of a method or constructor, returns the index after its body or ;
+        if not header or self.kinds[header[-1]] != "ident":
+            raise _Unsure(f"unexpected ( at line {self.lines[i]}")
+        rest = [h for h in header[:-1] if self.values[h] not in MODIFIERS]
+        # the return type, after the type parameters of a generic method or constructor
+        returns = rest
+        if rest and self.values[rest[0]] == "<":
+            depth = 0
+            for k, h in enumerate(rest):
+                depth += {"<": 1, ">": -1}.get(self.values[h], 0)
+                if depth == 0:
+                    returns = rest[k + 1:]
+                    break
+        # constructors have no return type, annotation elements are not methods for javalang
+        span = None
+        if returns and kind != "annotation":
+            # name, line, has a body, line of the last statement
+            span = [self.values[header[-1]], self.lines[rest[0]], False, None]
+            self.spans.append(span)
+        i = self._skip_balanced(i, "(", ")")
+        while self.values[i] not in ("{", ";"):
+            v = self.values[i]
+            if v == "default" and kind == "annotation":
+                return self._code(i + 1, ";")
+            if v == "@":
+                i = self._skip_annotation(i)
+            elif v in ("[", "]", "throws", ",", ".", "<", ">", "?", "&") or self.kinds[i] == "ident":
+                i += 1
+            else:
+                raise _Unsure(f"unexpected {v!r} after the parameters at line {self.lines[i]}")
+        if self.values[i] == ";":
+            return i + 1
+        last = [None]
+        end = self._code(i + 1, "}", last)
+        if span is not None:
+            span[2] = True
+            span[3] = None if last[0] is None else self._statement_line(last[0])
+        return end
+
+    def _statement_line(self, i: int) -> int:
+        # javalang's position of a statement is its first token, after the modifiers and
+        # annotations of a local variable
+        while self.values[i] == "final" or self.values[i] == "@":
+            i = i + 1 if self.values[i] == "final" else self._skip_annotation(i)
+        if self.values[i] == "synchronized" and self.values[i + 1] == "(":
+            return self.lines[i]
+        if self.values[i] in MODIFIERS or self._is_type_declaration(i):
+            raise _Unsure(f"local type declaration at line {self.lines[i]}")
+        return self.lines[i]
+
+    def _is_anonymous_class(self, i: int, opening: dict[int, int]) -> bool:
+        # i is at a { after ), true for new Type(...) { and new Type<...>(...) {
+        if self.values[i - 1] != ")" or i - 1 not in opening:
+            return False
+        j = opening[i - 1] - 1
+        if self.values[j] == ">":
+            depth = 0
+            while j > 0:
+                if self.values[j] == ">":
+                    depth += 1
+                elif self.values[j] == "<":
+                    depth -= 1
+                    if depth == 0:
+                        break
+                j -= 1
+            j -= 1
+        if self.kinds[j] != "ident":
+            return False
+        while self.values[j - 1] == "." and self.kinds[j - 2] == "ident":
+            j -= 2
+        # an annotated type, e.g. new @A Type() {
+        while self.kinds[j - 1] == "ident" and self.values[j - 2] == "@":
+            j -= 2
+        return self.values[j - 1] == "new"
+
+    def _code(self, i: int, closing: str, last: list | None = None) -> int:
+        # Statements or an expression up to closing, ; } or ), returns the index after it.
+        # Only the classes declared inside matter: anonymous, local and in lambdas. For a method
+        # body, last[0] is set to the first token of its last statement.
+        parens: list[int] = []
+        opening: dict[int, int] = {}
+        # first token of the current statement of a method body
+        start = None
+        while True:
+            v = self.values[i]
+            if self.kinds[i] == "eof":
+                raise _Unsure(f"missing {closing}")
+            if last is not None and start is None and v != "}":
+                start = last[0] = i
+            if v == "(":
+                parens.append(i)
+                i += 1
+            elif v == ")":
+                if not parens:
+                    if closing == ")":
+                        return i + 1
+                    raise _Unsure(f"unbalanced ) at line {self.lines[i]}")
+                opening[i] = parens.pop()
+                i += 1
+            elif v == "{":
+                if self._is_anonymous_class(i, opening):
+                    i = self._class_body(i + 1, "class")
+                else:
+                    # the block of if, for, try, ... or a block on its own, not a lambda or array initializer
+                    statement_block = not parens and (i == start or self.values[i - 1] in _BLOCK_AFTER)
+                    i = self._code(i + 1, "}")
+                    if (last is not None and statement_block and self.values[start] != "do"
+                            and self.values[i] not in ("else", "catch", "finally")):
+                        start = None
+            elif v == "}":
+                if closing == "}" and not parens:
+                    return i + 1
+                raise _Unsure(f"unexpected }} at line {self.lines[i]}")
+            elif v == ";" and not parens:
+                if closing == ";":
+                    return i + 1
+                i += 1
+                # if (a) b(); else ... and do ... while (c); are one statement
+                if last is not None and self.values[i] != "else" and (
+                        self.values[start] != "do" or "while" in self.values[start:i]):
+                    start = None
+            elif v == "@" and self.values[i + 1] == "interface":
+                i = self._type_declaration(i)
+                start = None
+            elif self.kinds[i] == "ident" and self._is_type_declaration(i):
+                i = self._type_declaration(i)
+                start = None
+            else:
+                i += 1
+
+    def compilation_unit(self):
+        i = 0
+        while self.kinds[i] != "eof":
+            v = self.values[i]
+            if v in ("package", "import"):
+                while self.values[i] != ";":
+                    if self.kinds[i] == "eof":
+                        raise _Unsure(f"{v} without ;")
+                    i += 1
+                i += 1
+            elif v == ";" or v in MODIFIERS:
+                i += 1
+            elif v == "@" and self.values[i + 1] == "interface":
+                i = self._type_declaration(i)
+            elif v == "@":
+                i = self._skip_annotation(i)
+            elif self._is_type_declaration(i):
+                i = self._type_declaration(i)
+            else:
+                # e.g. module-info.java
+                raise _Unsure(f"unexpected {v!r} at line {self.lines[i]}")
+
+
+def scan(content: str) -> list[MethodSpan] | None:
+    # Method declarations in source order, None when unsure
+    try:
+        scanner = _Scanner(content)
+        scanner.compilation_unit()
+    except _Unsure:
+        return None
+    return [MethodSpan(name, Position(line), has_body, None if last is None else Position(last))
+            for name, line, has_body, last in scanner.spans]
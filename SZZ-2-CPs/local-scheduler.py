@@ -0,0 +1,117 @@
+import os
+import glob
+import json
+import argparse
+import dataclasses
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# gen-out.py is loaded by path because of the dash in its name
+_spec = importlib.util.spec_from_file_location(
+    "gen_out", os.path.join(os.path.dirname(os.path.abspath(__file__)), "gen-out.py"))
+gen_out = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(gen_out)
+
+WINDOW = 14
+# javalang keeps both parse trees of a file in memory, large files need a lot of it
+MEMORY_PER_WORKER = 2 * 2**30
+
+
+def available_memory():
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+
+def pool_size(memory_per_worker=MEMORY_PER_WORKER):
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    return max(1, min(cpus, available_memory() // memory_per_worker))
+
+
+def find_szz_files(repos=None):
+    # repo name -> szz-in file, every szz-in file when no repos are given
+    files = {}
+    for f in sorted(glob.glob(os.path.join(gen_out.SZZ_OUT_BASE, "*.json"))):
+        with open(f, 'r') as fin:
+            files[json.load(fin)[0]["repo_name"]] = f
+    if not repos:
+        return files
+    missing = [r for r in repos if r not in files]
+    if missing:
+        raise ValueError(f"no szz output for {', '.join(missing)}")
+    return {r: files[r] for r in repos}
+
+
+def run_task(project_name, target_commit, window):
+    # One (repo, target commit) task. The ids are given when the outputs of the repo are written.
+    gen_out.project_name = project_name
+    gen_out._id = 0
+    # the metrics of this task only, they are merged in the main process
+    gen_out.metrics.reset()
+    pairs, reports = gen_out.extract_target(gen_out.REPO_BASE+project_name+"/", target_commit, window)
+    # plain dicts, the CommitPair class of a module loaded by path does not pickle
+    return [dataclasses.asdict(p) for p in pairs], reports, gen_out.metrics.snapshot()
+
+
+def write_repo(project_name, task_results):
+    # Same files and ids as gen-out.py: pairs in the order of the sampled targets, numbered from 0
+    res, final_reports = [], []
+    for pairs, reports, task_metrics in task_results:
+        gen_out.metrics.merge(task_metrics)
+        for d in pairs:
+            d["_id"] = f"{project_name}_{len(res)}"
+            res.append(gen_out.CommitPair(**d))
+        final_reports.extend(reports)
+    print(f"Writing project {project_name}: {len(res)} pairs", flush=True)
+    gen_out.write_outputs(project_name, res, final_reports)
+
+
+def main(repos=None, workers=None, window=WINDOW):
+    targets = {}
+    for f in find_szz_files(repos).values():
+        project_name, commit_ambari = gen_out.load_targets(f)
+        targets[project_name] = commit_ambari
+        print(f"{project_name}: {len(commit_ambari)} target commits")
+
+    workers = workers or pool_size()
+    results = {p: [None] * len(t) for p, t in targets.items()}
+    remaining = {p: len(t) for p, t in targets.items()}
+    failed = set()
+    print(f"{sum(remaining.values())} tasks of {len(targets)} repos on {workers} workers", flush=True)
+
+    for p in [p for p, n in remaining.items() if n == 0]:
+        write_repo(p, results.pop(p))
+
+    # The tasks of every repo share one queue, a worker that finishes takes the next task of any
+    # repo, so a small repo does not leave its workers idle.
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run_task, p, t, window): (p, i)
+                   for p, ts in targets.items() for i, t in enumerate(ts)}
+        for future in as_completed(futures):
+            p, i = futures[future]
+            try:
+                results[p][i] = future.result()
+            except Exception as e:
+                print(f"{p}: target {targets[p][i][0]} failed: {e}", flush=True)
+                failed.add(p)
+            remaining[p] -= 1
+            if remaining[p] == 0:
+                task_results = results.pop(p)
+                if p in failed:
+                    print(f"Skipping project {p}, some of its targets failed", flush=True)
+                else:
+                    write_repo(p, task_results)
+    return failed
+
+
+if __name__ == '__main__':
+    # python local-scheduler.py [repo ...] runs every repo of szz-in/ without SLURM
+    parser = argparse.ArgumentParser()
+    parser.add_argument("repos", nargs="*")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--window", type=int, default=WINDOW)
+    args = parser.parse_args()
+    main(args.repos, args.workers, args.window)
+    gen_out.metrics.export("local-scheduler")
@@ -0,0 +1,170 @@
+import pickle as pkl
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import timedelta
+from os import path
+import numpy as np
+from models import ParsedRecord, RepoName, PAST_OUTDATED, OUTDATED, NORMAL
+
+# Names of the status codes of ParsedRecord, in the order the tables are printed.
+STATUS_NAMES = ["past_outdated", "outdated", "normal", "uncategorized"]
+# Count columns of every table: 14DaysBI, 14DaysNBI, 7DaysBI, 7DaysNBI
+COUNT_COLUMNS = 4
+DAY = timedelta(days=1).total_seconds()
+SHORT_WINDOW = 7 * DAY
+
+HEADER = f"| {'Name':^30} | {'14DaysBI':^10} | {'14DaysNBI':^10} | {'7DaysBI':^10} | {'7DaysNBI':^10} |"
+
+
+@dataclass
+class RepoColumns:
+    repo: str
+    status: np.ndarray
+    bug_introducing: np.ndarray
+    # new_commit_date - old_commit_date
+    delta_seconds: np.ndarray
+    # index into commits, which are in order of first appearance
+    commit: np.ndarray
+    commits: list[str]
+
+    def __len__(self):
+        return len(self.status)
+
+
+def classify(repo_name: str, parsed_records: list[ParsedRecord]) -> RepoColumns:
+    n = len(parsed_records)
+    status = np.empty(n, dtype=np.int8)
+    bug_introducing = np.empty(n, dtype=bool)
+    delta_seconds = np.empty(n, dtype=np.float64)
+    commit = np.empty(n, dtype=np.int32)
+    commit_codes: dict[str, int] = {}
+    for i, r in enumerate(parsed_records):
+        cp = r.record.commit_pair
+        # classified once by ParsedRecord
+        status[i] = r.status_code
+        bug_introducing[i] = cp.bug_introducing
+        delta_seconds[i] = (cp.new_commit_date - cp.old_commit_date).total_seconds()
+        commit[i] = commit_codes.setdefault(cp.new_commit_hash, len(commit_codes))
+    return RepoColumns(repo_name, status, bug_introducing, delta_seconds, commit, list(commit_codes))
+
+
+def load_columns(repo_name: RepoName, use_cache=True) -> RepoColumns:
+    # The columns are cached next to the cleaned records and rebuilt when those change.
+    records_path = f"data/out/cleaned/{repo_name}.pkl"
+    cache_path = f"data/out/cleaned/{repo_name}.columns.npz"
+    if use_cache and path.exists(cache_path) and path.getmtime(cache_path) >= path.getmtime(records_path):
+        with np.load(cache_path) as data:
+            return RepoColumns(repo_name, data["status"], data["bug_introducing"], data["delta_seconds"],
+                               data["commit"], data["commits"].tolist())
+
+    with open(records_path, "rb") as fin:
+        parsed_records: list[ParsedRecord] = pkl.load(fin)
+    cols = classify(repo_name, parsed_records)
+    if use_cache:
+        np.savez(cache_path, status=cols.status, bug_introducing=cols.bug_introducing,
+                 delta_seconds=cols.delta_seconds, commit=cols.commit, commits=np.array(cols.commits, dtype=str))
+    return cols
+
+
+def load_all(repo_names: list[RepoName], max_workers: int | None = None) -> list[RepoColumns]:
+    # Every repo is loaded and classified once, in its own process.
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(load_columns, repo_names))
+
+
+def _count_columns(cols: RepoColumns, mask: np.ndarray | None = None) -> np.ndarray:
+    # (records, 4) one-hot matrix of the count columns, summing it gives a table row
+    bi = cols.bug_introducing
+    short = cols.delta_seconds <= SHORT_WINDOW
+    counts = np.stack([bi, ~bi, bi & short, ~bi & short], axis=1).astype(np.int64)
+    return counts if mask is None else counts[mask]
+
+
+def status_table(cols: RepoColumns) -> np.ndarray:
+    # (statuses, 4) counts, add the rows for the total and the tables of repos to merge them
+    table = np.zeros((len(STATUS_NAMES), COUNT_COLUMNS), dtype=np.int64)
+    np.add.at(table, cols.status, _count_columns(cols))
+    return table
+
+
+def commit_table(cols: RepoColumns, mask: np.ndarray | None = None) -> np.ndarray:
+    # (commits, statuses, 4) counts of the records selected by mask
+    table = np.zeros((len(cols.commits), len(STATUS_NAMES), COUNT_COLUMNS), dtype=np.int64)
+    if mask is None:
+        np.add.at(table, (cols.commit, cols.status), _count_columns(cols))
+    else:
+        np.add.at(table, (cols.commit[mask], cols.status[mask]), _count_columns(cols, mask))
+    return table
+
+
+def merge_tables(tables: list[np.ndarray]) -> np.ndarray:
+    return np.sum(tables, axis=0)
+
+
+def print_row(name: str, counts: np.ndarray, separator: str = ""):
+    count14bi, count14nbi, count7bi, count7nbi = counts
+    print(
+        f"| {name:^30} | {count14bi:^10} | {count14nbi:^10} | {count7bi:^10} | {count7nbi:^10} |")
+    print(separator)
+
+
+def print_status_table(name: str, table: np.ndarray, separator: str = ""):
+    # rows of compare.analyze, uncategorized records only count in the total
+    for status in (PAST_OUTDATED, OUTDATED, NORMAL):
+        print_row(f"{name}:{STATUS_NAMES[status]}", table[status], separator)
+    print_row(f"{name}:total", table.sum(axis=0), separator)
+
+
+def print_commit_table(cols: RepoColumns, separator: str = ""):
+    # rows of compare.statistics: bug introducing commits first, each in order of first appearance
+    for bug_introducing in (True, False):
+        mask = cols.bug_introducing == bug_introducing
+        table = commit_table(cols, mask)
+        commits, first = np.unique(cols.commit[mask], return_index=True)
+        for c in commits[np.argsort(first)]:
+            for status, name in enumerate(STATUS_NAMES):
+                counts = table[c, status]
+                if not counts.any():
+                    continue
+                print_row(f"{cols.repo}:{name}:{cols.commits[c][:5]}", counts, separator)
+
+
+@dataclass
+class WindowIndex:
+    # Sorted day deltas of every (status, bug_introducing) class, a count for any
+    # window is then a binary search.
+    repo: str
+    deltas: dict[tuple[int, bool], np.ndarray]
+
+    @staticmethod
+    def from_columns(cols: RepoColumns) -> 'WindowIndex':
+        days = cols.delta_seconds / DAY
+        return WindowIndex(cols.repo, {(status, bi): np.sort(days[(cols.status == status) & (cols.bug_introducing == bi)])
+                                       for status in range(len(STATUS_NAMES)) for bi in (True, False)})
+
+    @classmethod
+    def merge(cls, indexes: list['WindowIndex'], name: str = "all") -> 'WindowIndex':
+        return cls(name, {k: np.sort(np.concatenate([x.deltas[k] for x in indexes])) for k in indexes[0].deltas})
+
+    def counts(self, windows: list[float]) -> np.ndarray:
+        # (windows, statuses, [BI, NBI]) records with new_commit_date - old_commit_date <= window days
+        windows = np.asarray(windows, dtype=np.float64)
+        result = np.zeros((len(windows), len(STATUS_NAMES), 2), dtype=np.int64)
+        for (status, bi), deltas in self.deltas.items():
+            result[:, status, 0 if bi else 1] = np.searchsorted(deltas, windows, side="right")
+        return result
+
+
+def window_sweep(indexes: list[WindowIndex], windows: list[float]) -> dict[str, np.ndarray]:
+    return {x.repo: x.counts(windows) for x in indexes}
+
+
+def export_sweep_csv(file_path: str, sweep: dict[str, np.ndarray], windows: list[float]):
+    with open(file_path, "w") as fout:
+        fout.write("repo,window_days,status,bi,nbi\n")
+        for repo, counts in sweep.items():
+            for w, row in zip(windows, counts):
+                for status, name in enumerate(STATUS_NAMES):
+                    fout.write(f"{repo},{w:g},{name},{row[status, 0]},{row[status, 1]}\n")
+                total = row.sum(axis=0)
+                fout.write(f"{repo},{w:g},total,{total[0]},{total[1]}\n")
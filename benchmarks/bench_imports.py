@@ -0,0 +1,61 @@
+# Import time of the modules in a fresh interpreter, and whether they load the OpenAI SDK.
+# Run from the repository root: python -m benchmarks.bench_imports [--rev HEAD~1]
+# --rev also measures the modules at another git revision, checked out in a temporary worktree.
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+from os import path
+
+REPEAT = 5
+MODULES = ["models", "utils", "analytics", "cleaning", "evaluation", "record_store", "gpt_api"]
+# prints seconds, loaded modules and whether openai is one of them as json
+PROBE = ("import sys, time, json; t = time.perf_counter(); import {module}; "
+         "print(json.dumps([time.perf_counter() - t, len(sys.modules), 'openai' in sys.modules]))")
+
+
+def measure_import(module: str, cwd: str = ".", repeat: int = REPEAT) -> tuple[float, int, bool] | None:
+    # best of repeat fresh interpreters, None when the module does not exist or fails to import
+    runs = []
+    for _ in range(repeat):
+        res = subprocess.run([sys.executable, "-c", PROBE.format(module=module)], cwd=cwd,
+                             capture_output=True, text=True)
+        if res.returncode != 0:
+            return None
+        runs.append(json.loads(res.stdout.splitlines()[-1]))
+    return min(runs)
+
+
+def measure_rev(rev: str, modules: list[str], repeat: int = REPEAT) -> dict[str, tuple | None]:
+    with tempfile.TemporaryDirectory() as tmp:
+        worktree = path.join(tmp, "tree")
+        subprocess.run(["git", "worktree", "add", "--detach", worktree, rev], check=True, capture_output=True)
+        try:
+            return {m: measure_import(m, worktree, repeat) for m in modules}
+        finally:
+            subprocess.run(["git", "worktree", "remove", "--force", worktree], check=True, capture_output=True)
+
+
+def print_row(module: str, label: str, res: tuple | None):
+    if res is None:
+        print(f"| {module:^15} | {label:^10} | {'-':^10} | {'-':^8} | {'-':^6} |")
+    else:
+        print(f"| {module:^15} | {label:^10} | {res[0] * 1000:^10.1f} | {res[1]:^8} | {'yes' if res[2] else 'no':^6} |")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    parser.add_argument("--rev", default=None)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    args = parser.parse_args()
+
+    before = measure_rev(args.rev, args.modules, args.repeat) if args.rev else {}
+    header = f"| {'Module':^15} | {'Tree':^10} | {'Import ms':^10} | {'Modules':^8} | {'OpenAI':^6} |"
+    print(header)
+    print("-" * len(header))
+    for m in args.modules:
+        if args.rev:
+            print_row(m, args.rev[:10], before[m])
+        print_row(m, "current", measure_import(m, repeat=args.repeat))
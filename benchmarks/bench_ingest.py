@@ -0,0 +1,57 @@
+# Compares the old json.load + per-pair validation conversion with the streaming ingest path.
+# Run from the repository root: python -m benchmarks.bench_ingest storm
+import sys
+import json
+import time
+import tempfile
+import pickle as pkl
+from os import path
+from utils import CommitPair, Record, RepoName, DATA_PATH, INPUTS_DIR
+from ingest import ingest
+
+REPEAT = 3
+
+
+def legacy_convert(repo_name: RepoName) -> list[Record]:
+    # convert_commit_pair_2_records before the ingest path, without saving
+    with open(path.join(DATA_PATH, INPUTS_DIR, f"{repo_name}.json"), 'r') as fin:
+        tmp = json.load(fin)
+        for dp in tmp:
+            dp["id"] = dp["_id"]
+        cps = [CommitPair(**x) for x in tmp]
+    return [Record(repo=repo_name, commit_pair=cp) for cp in cps]
+
+
+def convert_and_save(convert, out_path: str) -> list[Record]:
+    records = convert()
+    with open(out_path, 'wb') as fout:
+        pkl.dump(records, fout)
+    return records
+
+
+def bench_repo(repo_name: RepoName) -> dict[str, float]:
+    out_path = path.join(tempfile.gettempdir(), f"bench-ingest-{repo_name}.pkl")
+    runs = {
+        "legacy": lambda: legacy_convert(repo_name),
+        "ingest": lambda: ingest(repo_name, auto_save=False),
+        "legacy+pkl": lambda: convert_and_save(lambda: legacy_convert(repo_name), out_path),
+        "ingest+pkl": lambda: convert_and_save(lambda: ingest(repo_name, auto_save=False), out_path),
+    }
+    results = {}
+    for name, run in runs.items():
+        # best of REPEAT
+        results[name] = float("inf")
+        for _ in range(REPEAT):
+            t = time.perf_counter()
+            count = len(run())
+            results[name] = min(results[name], time.perf_counter() - t)
+        print(f"| {repo_name:^15} | {name:^12} | {count:^10} | {results[name]:^10.2f} | {count / results[name]:^12.0f} |")
+    return results
+
+
+if __name__ == "__main__":
+    header = f"| {'Repo':^15} | {'Path':^12} | {'Pairs':^10} | {'Seconds':^10} | {'Pairs/s':^12} |"
+    print(header)
+    print("-" * len(header))
+    for rn in sys.argv[1:]:
+        bench_repo(rn)
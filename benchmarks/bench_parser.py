@@ -0,0 +1,146 @@
+# Checks that gen-out.py extracts the same methods and comments with java_scanner.py as with javalang,
+# and compares the time both take. Files come from git repositories at some revisions, from .java files
+# or directories, or from a generated repository when nothing is given. The CASES are always added.
+# Run from the repository root: python -m benchmarks.bench_parser SZZ-2-CPs/szzy_repos/storm --revisions 5
+import os
+import json
+import time
+import argparse
+import tempfile
+from os import path
+import git
+from pipeline import load_gen_out
+from benchmarks.synthetic_repo import RepoSpec, make_repo
+
+# files whose methods differ are listed up to this many
+SHOW_DIFFERENCES = 20
+# declarations the scanner got wrong before, checked on every run
+CASES = {
+    "generic_constructor.java": """package cases;
+
+public class B2<E> {
+    /** not a method for javalang */
+    public <T> B2(T t) {
+        this.e = null;
+    }
+
+    /** generic method */
+    public <T extends Comparable<T>> T max(T a, T b) {
+        return a;
+    }
+
+    <K, V extends java.util.Map<K, java.util.List<K>>> void nested(V v) {
+        v.clear();
+    }
+
+    private E e;
+}
+""",
+}
+
+
+def repo_files(repo_path: str, revisions: int) -> list[tuple[str, str]]:
+    # (rev:path, content) of the .java files at the last revisions of HEAD, each blob once
+    repo = git.Repo(repo_path)
+    seen, files = set(), []
+    for commit in repo.iter_commits("HEAD", max_count=revisions):
+        for blob in commit.tree.traverse():
+            if blob.type != "blob" or not blob.path.endswith(".java") or blob.hexsha in seen:
+                continue
+            seen.add(blob.hexsha)
+            files.append((f"{commit.hexsha[:10]}:{blob.path}", blob.data_stream.read().decode("utf-8", "replace")))
+    return files
+
+
+def disk_files(target: str) -> list[tuple[str, str]]:
+    paths = [target] if path.isfile(target) else [path.join(d, f) for d, _, names in os.walk(target)
+                                                  for f in names if f.endswith(".java")]
+    files = []
+    for p in sorted(paths):
+        with open(p, "r", encoding="utf-8", errors="replace") as fin:
+            files.append((p, fin.read()))
+    return files
+
+
+def extract(gen_out, content: str, parser: str) -> dict[str, tuple[str, str]] | None:
+    # name -> (code, comment) as compare_commits collects them, None when the file does not parse
+    get_comment = getattr(gen_out, "__get_comment_if_any")
+    try:
+        nodes = gen_out.parse_methods(content, parser)
+    except Exception:
+        return None
+    methods = {}
+    for node in nodes:
+        try:
+            methods[node.name] = (gen_out._my_get_string(content, node), get_comment(node.position, content))
+        except Exception:
+            continue
+    return methods
+
+
+def compare_parsers(files: list[tuple[str, str]]) -> dict:
+    gen_out = load_gen_out()
+    report = {"files": len(files), "megabytes": sum(len(c.encode()) for _, c in files) / 2**20,
+              "scanned": 0, "agree": 0, "recovered": 0, "methods": 0, "method_differences": 0,
+              "differences": [], "seconds": {}}
+    for parser in gen_out.PARSERS:
+        t = time.perf_counter()
+        for _, content in files:
+            extract(gen_out, content, parser)
+        report["seconds"][parser] = time.perf_counter() - t
+
+    for name, content in files:
+        scanned = gen_out.java_scanner.scan(content) is not None
+        report["scanned"] += scanned
+        expected, actual = extract(gen_out, content, "javalang"), extract(gen_out, content, "scanner")
+        if expected is None:
+            # javalang failed, so did the scanner fallback unless the scanner was sure
+            report["recovered"] += actual is not None
+            report["agree"] += actual is None
+            continue
+        report["methods"] += len(expected)
+        if actual == expected:
+            report["agree"] += 1
+            continue
+        actual = actual or {}
+        differing = sorted(k for k in expected.keys() | actual.keys() if expected.get(k) != actual.get(k))
+        report["method_differences"] += len(differing)
+        report["differences"].append({"file": name, "methods": differing})
+    return report
+
+
+def print_report(report: dict):
+    print(f"{report['files']} files, {report['megabytes']:.2f} MB, {report['methods']} methods")
+    print(f"scanned {report['scanned']} files, javalang parsed the other {report['files'] - report['scanned']}")
+    print(f"same methods in {report['agree']} files, {report['method_differences']} methods differ in "
+          f"{len(report['differences'])} files, {report['recovered']} files only the scanner parsed")
+    for d in report["differences"][:SHOW_DIFFERENCES]:
+        print(f"  {d['file']}: {', '.join(d['methods'])}")
+    header = f"| {'Parser':^10} | {'Seconds':^10} | {'Files/s':^10} | {'MB/s':^8} |"
+    print(header)
+    print("-" * len(header))
+    for parser, seconds in report["seconds"].items():
+        print(f"| {parser:^10} | {seconds:^10.2f} | {report['files'] / seconds:^10.0f} | "
+              f"{report['megabytes'] / seconds:^8.2f} |")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("targets", nargs="*", help="git repositories, .java files or directories")
+    parser.add_argument("--revisions", type=int, default=1, help="commits of HEAD to take the files of a repository from")
+    parser.add_argument("--out", default=None, help="also save the report as json")
+    args = parser.parse_args()
+
+    files = [(f"case:{name}", content) for name, content in CASES.items()]
+    with tempfile.TemporaryDirectory() as tmp:
+        if not args.targets:
+            make_repo(path.join(tmp, "synth"), RepoSpec(commits=20))
+            args.targets = [path.join(tmp, "synth")]
+        for target in args.targets:
+            is_repo = path.isdir(path.join(target, ".git"))
+            files += repo_files(target, args.revisions) if is_repo else disk_files(target)
+    report = compare_parsers(files)
+    print_report(report)
+    if args.out:
+        with open(args.out, "w") as fout:
+            json.dump(report, fout, indent=2)
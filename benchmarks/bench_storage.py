@@ -0,0 +1,83 @@
+# Compares the storage formats for records: size, write throughput and load latency.
+# Run from the repository root: python -m benchmarks.bench_storage storm cxf
+import sys
+import time
+import random
+import tempfile
+import pickle as pkl
+from os import path
+from utils import RepoName, load_records
+from compressed_store import write_compressed, CompressedRecords
+from record_store import RecordStore
+
+RANDOM_READS = 100
+
+
+def bench_repo(repo_name: RepoName) -> dict[str, dict]:
+    records = load_records(repo_name, allow_partial=False)
+    sample_ids = random.Random(0).sample([r.commit_pair.id for r in records], min(RANDOM_READS, len(records)))
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        # pickle
+        pkl_path = path.join(tmp, "records.pkl")
+        t = time.perf_counter()
+        with open(pkl_path, 'wb') as fout:
+            pkl.dump(records, fout)
+        write = time.perf_counter() - t
+        t = time.perf_counter()
+        with open(pkl_path, 'rb') as fin:
+            loaded = pkl.load(fin)
+        load = time.perf_counter() - t
+        # a single record still needs the whole file
+        t = time.perf_counter()
+        with open(pkl_path, 'rb') as fin:
+            loaded = {r.commit_pair.id: r for r in pkl.load(fin)}
+        [loaded[x] for x in sample_ids]
+        random_read = time.perf_counter() - t
+        results["pkl"] = {"size": path.getsize(pkl_path), "write": write, "load": load, "random_read": random_read}
+
+        # zstd with a per-repo dictionary
+        zrec_path = path.join(tmp, "records.zrec")
+        t = time.perf_counter()
+        write_compressed(records, zrec_path)
+        write = time.perf_counter() - t
+        t = time.perf_counter()
+        compressed = CompressedRecords(zrec_path)
+        list(compressed)
+        load = time.perf_counter() - t
+        t = time.perf_counter()
+        compressed = CompressedRecords(zrec_path)
+        [compressed.get(x) for x in sample_ids]
+        random_read = time.perf_counter() - t
+        compressed.close()
+        results["zstd"] = {"size": path.getsize(zrec_path), "write": write, "load": load, "random_read": random_read}
+
+        # sqlite with pooled strings
+        db_path = path.join(tmp, "records.sqlite")
+        with RecordStore(db_path) as store:
+            t = time.perf_counter()
+            store.write(records, repo_name=repo_name)
+            write = time.perf_counter() - t
+            t = time.perf_counter()
+            store.query(repo=repo_name)
+            load = time.perf_counter() - t
+            t = time.perf_counter()
+            store.query(repo=repo_name, ids=sample_ids)
+            random_read = time.perf_counter() - t
+            store.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        results["sqlite"] = {"size": path.getsize(db_path), "write": write, "load": load, "random_read": random_read}
+
+    for fmt, res in results.items():
+        res["records"] = len(records)
+        print(f"| {repo_name:^15} | {fmt:^8} | {res['size'] / 2**20:^10.2f} | {len(records) / res['write']:^12.0f} | "
+              f"{res['load'] * 1000:^10.1f} | {res['random_read'] * 1000:^12.1f} |")
+    return results
+
+
+if __name__ == "__main__":
+    header = (f"| {'Repo':^15} | {'Format':^8} | {'Size MB':^10} | {'Write rec/s':^12} | "
+              f"{'Load ms':^10} | {f'{RANDOM_READS} reads ms':^12} |")
+    print(header)
+    print("-" * len(header))
+    for rn in sys.argv[1:]:
+        bench_repo(rn)
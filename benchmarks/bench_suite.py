@@ -0,0 +1,212 @@
+# Times every step from gen-out to analytics on a generated repository and saves the results as json,
+# so that runs before and after a change can be compared on the same history.
+# Run from the repository root: python -m benchmarks.bench_suite --commits 200 --files 40
+# Compare two runs: python -m benchmarks.bench_suite --compare data/out/benchmarks/a.json data/out/benchmarks/b.json
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+import pickle as pkl
+from dataclasses import asdict
+from datetime import datetime
+from os import path, makedirs
+import git
+from analytics import WindowIndex, classify, commit_table, status_table
+from cleaning import parse_response
+from compressed_store import write_compressed, CompressedRecords
+from pipeline import load_gen_out, to_record
+from record_store import RecordStore
+from utils import GptResponse, ParsedRecord, Record, RecordResult, DATA_PATH, OUTPUTS_DIR
+from benchmarks.synthetic_repo import RepoSpec, make_repo, spec_arguments, spec_from_args
+
+REPEAT = 5
+WINDOW = 14
+TARGETS = 20
+PAIRS = 20
+RECORDS = 5000
+PROJECT = "synth"
+BENCHMARKS_DIR = "benchmarks"
+WINDOWS = list(range(1, 15))
+# the three shapes cleaning.parse_response handles
+RESPONSES = ['{{"old2new": {}, "new2new": {}}}',
+             'Here is the answer:\n```json\n{{"old2new": {}, "new2new": {}}}\n```',
+             'old2new: {}, new2new: {}']
+
+
+def measure(fn, repeat: int = REPEAT) -> tuple[float, float]:
+    # best and median seconds of repeat runs
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t)
+    return min(times), statistics.median(times)
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def synthetic_records(pairs: list, n: int, seed: int) -> list[Record]:
+    # n answered records cycling over the extracted pairs
+    rng = random.Random(seed)
+    records = []
+    for i in range(n):
+        r = to_record(pairs[i % len(pairs)], PROJECT)
+        r.commit_pair.id = f"{PROJECT}_{i}"
+        text = rng.choice(RESPONSES).format(*(rng.choice(["true", "false"]) for _ in range(2)))
+        r.gpt_response = GptResponse(created=0, response=text, finish_reason="stop", usage={"total_tokens": 0},
+                                     id=str(i), model="synthetic")
+        records.append(r)
+    return records
+
+
+def run_suite(repo_path: str, hashes: list[str], spec: RepoSpec, repeat: int = REPEAT,
+              n_records: int = RECORDS) -> dict[str, dict]:
+    # benchmark -> items, best and median seconds, items/s of the best run
+    gen_out = load_gen_out()
+    gen_out.project_name = PROJECT
+    gen_out._id = 0
+    get_comment = getattr(gen_out, "__get_comment_if_any")
+    rng = random.Random(spec.seed)
+    repo = git.Repo(repo_path)
+    results = {}
+
+    def bench(name: str, items: int, fn):
+        best, median = measure(fn, repeat)
+        results[name] = {"items": items, "best": best, "median": median, "items_per_second": items / best if best else None}
+        print(f"| {name:^20} | {items:^8} | {best * 1000:^10.2f} | {median * 1000:^10.2f} | "
+              f"{results[name]['items_per_second'] or 0:^12.0f} |", flush=True)
+
+    # commits with a window before them
+    targets = rng.sample(hashes[len(hashes) // 10 + 1:], min(TARGETS, len(hashes) - len(hashes) // 10 - 1))
+    bench("commit_window", len(targets), lambda: [gen_out.get_commits_before(repo_path, t, WINDOW) for t in targets])
+    pairs = [(c.hexsha, t) for t in targets for c in gen_out.get_commits_before(repo_path, t, WINDOW)]
+    pairs = rng.sample(pairs, min(PAIRS, len(pairs)))
+    bench("diff", len(pairs), lambda: [repo.git.diff(old, new) for old, new in pairs])
+
+    # every file at the last commit
+    files = [x for x in repo.git.ls_tree("-r", "--name-only", hashes[-1]).splitlines() if x.endswith(".java")]
+    contents = [repo.git.show(f"{hashes[-1]}:{f}") for f in files]
+    # both parsers of gen-out, the methods of the one it uses (GEN_OUT_PARSER) go on to remove_comments
+    for parser in gen_out.PARSERS:
+        bench(f"parse_{parser}", len(contents), lambda: [gen_out.parse_methods(x, parser) for x in contents])
+        nodes = [(content, node) for content in contents for node in gen_out.parse_methods(content, parser)]
+
+        def extract():
+            return [(gen_out._my_get_string(content, node), get_comment(node.position, content)) for content, node in nodes]
+        bench(f"extract_{parser}", len(nodes), extract)
+        if parser == gen_out.PARSER:
+            methods = extract()
+    bench("remove_comments", len(methods), lambda: [gen_out.remove_comments(m) for m, _ in methods])
+
+    def compare():
+        gen_out._id = 0
+        return [p for old, new in pairs for p in gen_out.compare_commits(repo_path, old, new, False)[0]]
+    commit_pairs = compare()
+    bench("compare_commits", len(pairs), compare)
+    if not commit_pairs:
+        raise ValueError("no method pairs were extracted, use more commits or churn")
+    bench("is_clean", len(commit_pairs), lambda: [gen_out.is_clean(p) for p in commit_pairs])
+
+    records = synthetic_records(commit_pairs, n_records, spec.seed)
+    bench("parse_response", len(records), lambda: [parse_response(r.gpt_response.response) for r in records])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pkl_path = path.join(tmp, "records.pkl")
+
+        def save_pkl():
+            with open(pkl_path, 'wb') as fout:
+                pkl.dump(records, fout)
+
+        def load_pkl():
+            with open(pkl_path, 'rb') as fin:
+                return pkl.load(fin)
+        bench("save_pkl", len(records), save_pkl)
+        bench("load_pkl", len(records), load_pkl)
+
+        zrec_path = path.join(tmp, "records.zrec")
+
+        def load_zstd():
+            compressed = CompressedRecords(zrec_path)
+            list(compressed)
+            compressed.close()
+        bench("save_zstd", len(records), lambda: write_compressed(records, zrec_path))
+        bench("load_zstd", len(records), load_zstd)
+
+        with RecordStore(path.join(tmp, "records.sqlite")) as store:
+            bench("save_sqlite", len(records), lambda: store.write(records, repo_name=PROJECT))
+            bench("load_sqlite", len(records), lambda: store.query(repo=PROJECT))
+
+    parsed = []
+    for r in records:
+        answers, _ = parse_response(r.gpt_response.response)
+        parsed.append(ParsedRecord(r, RecordResult(*answers)))
+    bench("classify", len(parsed), lambda: classify(PROJECT, parsed))
+    cols = classify(PROJECT, parsed)
+    bench("tables", len(cols), lambda: (status_table(cols), commit_table(cols)))
+    bench("window_sweep", len(cols), lambda: WindowIndex.from_columns(cols).counts(WINDOWS))
+    return results
+
+
+def save_results(results: dict[str, dict], spec: RepoSpec, repeat: int, out_path: str | None = None,
+                 parser: str | None = None) -> str:
+    out_path = out_path or path.join(DATA_PATH, OUTPUTS_DIR, BENCHMARKS_DIR,
+                                     f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    makedirs(path.dirname(out_path) or ".", exist_ok=True)
+    with open(out_path, "w") as fout:
+        json.dump({"time": str(datetime.now()), "git_revision": git_revision(), "python": sys.version,
+                   "platform": platform.platform(), "spec": asdict(spec), "repeat": repeat, "parser": parser,
+                   "results": results}, fout, indent=2)
+    return out_path
+
+
+def compare_results(old_path: str, new_path: str):
+    # best times of two saved runs, a ratio below 1 means the new run is faster
+    with open(old_path, "r") as fin:
+        old = json.load(fin)
+    with open(new_path, "r") as fin:
+        new = json.load(fin)
+    if old["spec"] != new["spec"]:
+        print(f"warning: the runs used different repositories: {old['spec']} and {new['spec']}")
+    header = f"| {'Benchmark':^20} | {'Old ms':^10} | {'New ms':^10} | {'Ratio':^8} |"
+    print(f"{old_path} ({old['git_revision']}) -> {new_path} ({new['git_revision']})")
+    print(header)
+    print("-" * len(header))
+    for name, res in new["results"].items():
+        if name not in old["results"]:
+            continue
+        before, after = old["results"][name]["best"], res["best"]
+        print(f"| {name:^20} | {before * 1000:^10.2f} | {after * 1000:^10.2f} | {after / before:^8.2f} |")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    spec_arguments(parser)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--records", type=int, default=RECORDS)
+    parser.add_argument("--out", default=None)
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), default=None)
+    args = parser.parse_args()
+    if args.compare:
+        compare_results(*args.compare)
+        sys.exit()
+
+    spec = spec_from_args(args)
+    with tempfile.TemporaryDirectory() as tmp:
+        t = time.perf_counter()
+        hashes = make_repo(path.join(tmp, PROJECT), spec)
+        print(f"generated {len(hashes)} commits in {time.perf_counter() - t:.1f}s")
+        header = f"| {'Benchmark':^20} | {'Items':^8} | {'Best ms':^10} | {'Median ms':^10} | {'Items/s':^12} |"
+        print(header)
+        print("-" * len(header))
+        results = run_suite(path.join(tmp, PROJECT), hashes, spec, args.repeat, args.records)
+    print(f"saved {save_results(results, spec, args.repeat, args.out, load_gen_out().PARSER)}")
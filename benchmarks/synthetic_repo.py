@@ -0,0 +1,185 @@
+# Builds local git repositories of generated Java code for the benchmarks, the same seed gives the same history.
+# Run from the repository root: python -m benchmarks.synthetic_repo /tmp/synth --commits 200 --files 40
+import os
+import json
+import random
+import argparse
+import subprocess
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta, timezone
+
+START_DATE = datetime(2020, 1, 1, tzinfo=timezone.utc)
+PACKAGE = "org.example.synth"
+TYPES = ["int", "long", "String", "boolean", "double"]
+WORDS = ["value", "count", "index", "buffer", "result", "state", "limit", "offset", "name", "total", "entry",
+         "cache", "config", "request", "response", "handler", "item", "node", "key", "size"]
+
+
+@dataclass
+class RepoSpec:
+    commits: int = 100
+    files: int = 20
+    methods_per_file: int = 12
+    # statements in a method body
+    method_lines: int = 8
+    # share of methods with a Javadoc, the others have a line comment or nothing
+    javadoc_density: float = 0.7
+    # share of the methods of a touched file that a commit changes
+    churn: float = 0.2
+    files_per_commit: int = 3
+    # a commit changes the Javadoc of a changed method with this probability
+    comment_churn: float = 0.3
+    hours_between_commits: float = 12
+    seed: int = 0
+
+
+@dataclass
+class _Method:
+    name: str
+    params: list[tuple[str, str]]
+    returns: str
+    statements: list[str]
+    comment: str
+
+
+def _word(rng: random.Random) -> str:
+    return rng.choice(WORDS)
+
+
+def _statement(rng: random.Random, i: int) -> str:
+    kind = rng.random()
+    var = f"{_word(rng)}{i}"
+    if kind < 0.4:
+        return f"int {var} = {rng.randint(0, 1000)} * {rng.randint(1, 9)};"
+    if kind < 0.6:
+        # a // inside a string literal, remove_comments must keep it
+        return f'String {var} = "http://{_word(rng)}.example.org/{rng.randint(0, 99)}";'
+    if kind < 0.8:
+        return (f"if ({rng.randint(0, 100)} > {rng.randint(0, 100)}) {{\n"
+                f"            System.out.println(\"{_word(rng)} {{}}\"); // {_word(rng)}\n        }}")
+    return f"for (int {var} = 0; {var} < {rng.randint(1, 50)}; {var}++) {{\n            total += {var};\n        }}"
+
+
+def _comment(rng: random.Random, spec: RepoSpec, m: _Method) -> str:
+    kind = rng.random()
+    if kind < spec.javadoc_density:
+        lines = ["/**", f" * {' '.join(_word(rng) for _ in range(rng.randint(4, 12))).capitalize()}."]
+        lines += [f" * @param {p} the {_word(rng)}" for _, p in m.params]
+        if m.returns != "void":
+            lines.append(f" * @return the {_word(rng)}")
+        return "\n    ".join(lines + [" */"])
+    if kind < spec.javadoc_density + (1 - spec.javadoc_density) / 2:
+        return f"// {' '.join(_word(rng) for _ in range(rng.randint(3, 8)))}"
+    return ""
+
+
+def _new_method(rng: random.Random, spec: RepoSpec, name: str) -> _Method:
+    params = [(rng.choice(TYPES), f"{_word(rng)}{i}") for i in range(rng.randint(0, 3))]
+    m = _Method(name, params, rng.choice(["void", "int"]),
+                [_statement(rng, i) for i in range(max(2, spec.method_lines))], "")
+    m.comment = _comment(rng, spec, m)
+    return m
+
+
+def _change_method(rng: random.Random, spec: RepoSpec, m: _Method):
+    i = rng.randrange(len(m.statements))
+    kind = rng.random()
+    if kind < 0.5 or len(m.statements) <= 2:
+        m.statements[i] = _statement(rng, i)
+    elif kind < 0.75:
+        m.statements.insert(i, _statement(rng, len(m.statements)))
+    else:
+        m.statements.pop(i)
+    if rng.random() < spec.comment_churn:
+        m.comment = _comment(rng, spec, m)
+
+
+def _render(class_name: str, methods: list[_Method]) -> str:
+    out = [f"package {PACKAGE};", "", f"public class {class_name} {{", "    private int total;", ""]
+    for m in methods:
+        if m.comment:
+            out.append(f"    {m.comment}")
+        params = ", ".join(f"{t} {p}" for t, p in m.params)
+        out.append(f"    public {m.returns} {m.name}({params}) {{")
+        out += [f"        {s}" for s in m.statements]
+        if m.returns != "void":
+            out.append("        return total;")
+        out += ["    }", ""]
+    out.append("}")
+    return "\n".join(out) + "\n"
+
+
+def _git(repo_path: str, *args: str, date: datetime | None = None) -> str:
+    env = {**os.environ, "GIT_AUTHOR_NAME": "synth", "GIT_AUTHOR_EMAIL": "synth@example.org",
+           "GIT_COMMITTER_NAME": "synth", "GIT_COMMITTER_EMAIL": "synth@example.org"}
+    if date is not None:
+        env["GIT_AUTHOR_DATE"] = env["GIT_COMMITTER_DATE"] = date.isoformat()
+    return subprocess.run(["git", "-C", repo_path, *args], env=env, check=True,
+                          capture_output=True, text=True).stdout.strip()
+
+
+def make_repo(repo_path: str, spec: RepoSpec) -> list[str]:
+    # Returns the commit hashes, oldest first. The first commit adds every file, every later one
+    # changes spec.churn of the methods of spec.files_per_commit files.
+    if os.path.exists(os.path.join(repo_path, ".git")):
+        raise ValueError(f"{repo_path} is already a git repository")
+    rng = random.Random(spec.seed)
+    os.makedirs(repo_path, exist_ok=True)
+    _git(repo_path, "init", "-q")
+    src = os.path.join(repo_path, "src", *PACKAGE.split("."))
+    os.makedirs(src, exist_ok=True)
+
+    classes = {f"Synth{i}": [_new_method(rng, spec, f"method{j}") for j in range(spec.methods_per_file)]
+               for i in range(spec.files)}
+    hashes = []
+    for c in range(spec.commits):
+        touched = list(classes) if c == 0 else rng.sample(list(classes), min(spec.files_per_commit, len(classes)))
+        for class_name in touched:
+            if c > 0:
+                for m in classes[class_name]:
+                    if rng.random() < spec.churn:
+                        _change_method(rng, spec, m)
+            with open(os.path.join(src, f"{class_name}.java"), "w") as fout:
+                fout.write(_render(class_name, classes[class_name]))
+        date = START_DATE + timedelta(hours=spec.hours_between_commits * c)
+        _git(repo_path, "add", "-A")
+        _git(repo_path, "commit", "-q", "--allow-empty", "-m", f"commit {c}", date=date)
+        hashes.append(_git(repo_path, "rev-parse", "HEAD"))
+    return hashes
+
+
+def make_szz_inputs(base: str, project_name: str, hashes: list[str], bic_share: float = 0.3, seed: int = 0) -> str:
+    # repo-info/<project>.txt and szz-in/<project>.json as gen-out.py reads them from base, the
+    # repository itself is expected in base/szzy_repos/<project>. Returns the szz-in file.
+    rng = random.Random(seed)
+    # the first commits have no window before them
+    candidates = hashes[len(hashes) // 10 + 1:]
+    bic = rng.sample(candidates, int(len(candidates) * bic_share))
+    os.makedirs(os.path.join(base, "repo-info"), exist_ok=True)
+    os.makedirs(os.path.join(base, "szz-in"), exist_ok=True)
+    with open(os.path.join(base, "repo-info", f"{project_name}.txt"), "w") as fout:
+        fout.write("\n".join(candidates) + "\n")
+    szz_file = os.path.join(base, "szz-in", f"{project_name}.json")
+    with open(szz_file, "w") as fout:
+        json.dump([{"repo_name": project_name, "inducing_commit_hash": [x]} for x in bic], fout)
+    return szz_file
+
+
+def spec_arguments(parser: argparse.ArgumentParser):
+    # one --option per RepoSpec field
+    for k, v in asdict(RepoSpec()).items():
+        parser.add_argument(f"--{k.replace('_', '-')}", type=type(v), default=v)
+
+
+def spec_from_args(args: argparse.Namespace) -> RepoSpec:
+    return RepoSpec(**{k: getattr(args, k) for k in asdict(RepoSpec())})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Builds a git repository of generated Java code.")
+    parser.add_argument("path")
+    spec_arguments(parser)
+    args = parser.parse_args()
+    spec = spec_from_args(args)
+    hashes = make_repo(args.path, spec)
+    print(f"{args.path}: {len(hashes)} commits, {spec.files} files, {spec.files * spec.methods_per_file} methods")
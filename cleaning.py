@@ -0,0 +1,218 @@
+import re
+import json
+import pickle as pkl
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from os import path, replace
+from typing import Literal
+from models import Record, RecordResult, ParsedRecord, RepoName, StatusIndex, StorageBackend
+from utils import DATA_PATH, OUTPUTS_DIR, load_records, read_records, status_index_path
+
+# old2new/new2new from chat-gpt-api.py, consistency from gt-concurrent.py
+Schema = Literal["old2new", "consistency"]
+SCHEMA_KEYS = {"old2new": ("old2new", "new2new"), "consistency": ("consistency",)}
+TRUE_KEYWORDS = ["true", "yes", "consistent"]
+FALSE_KEYWORDS = ["false", "no", "inconsistent"]
+CLEANED_DIR = "cleaned"
+# finished responses the schema of a repo is picked from when it is not given
+SCHEMA_VOTES = 50
+
+# the outermost {...} of a response with text around it, e.g. a markdown code block
+_OBJECT = re.compile(r"\{.*\}", re.DOTALL)
+# "key": value in a response that is not valid json, quotes optional. The key starts after a quote
+# or a non-word character, so reason-old2new or inconsistency is not taken for it.
+_KEY_VALUE = r'(?<![\w-])"?{key}"?\s*[:=]\s*"?([a-z]+)'
+# a json string, a key: value inside one is part of another answer
+_STRING = re.compile(r'"(?:\\.|[^"\\\n])*"')
+
+
+class ParseError(ValueError):
+    pass
+
+
+def to_bool(value) -> bool:
+    if type(value) is bool:
+        return value
+    if isinstance(value, str):
+        value = value.strip().lower()
+        if value in TRUE_KEYWORDS:
+            return True
+        if value in FALSE_KEYWORDS:
+            return False
+    raise ParseError(f"not a boolean answer: {value!r}")
+
+
+def _answers(obj, keys: tuple[str, ...]) -> tuple[bool, ...]:
+    if not isinstance(obj, dict):
+        raise ParseError("the response is not a json object")
+    # keys are case insensitive, the old parser lowercased the whole response
+    obj = {k.lower(): v for k, v in obj.items()}
+    missing = [k for k in keys if k not in obj]
+    if missing:
+        raise ParseError(f"missing {', '.join(missing)}")
+    return tuple(to_bool(obj[k]) for k in keys)
+
+
+def detect_schema(response: str) -> Schema | None:
+    # old2new first, its reasons may talk about consistency
+    lowered = response.lower()
+    for schema in ("old2new", "consistency"):
+        if schema in lowered:
+            return schema
+    return None
+
+
+def pick_schema(records: list[Record]) -> Schema:
+    # The schema most of the first SCHEMA_VOTES finished responses use, old2new when none has
+    # finished. A repo is answered with one prompt, the other responses do not follow it.
+    votes = Counter()
+    for r in records:
+        if r.gpt_response and r.gpt_response.finish_reason == "stop":
+            schema = detect_schema(r.gpt_response.response)
+            if schema is not None:
+                votes[schema] += 1
+        if votes.total() >= SCHEMA_VOTES:
+            break
+    return votes.most_common(1)[0][0] if votes else "old2new"
+
+
+def parse_response(response: str, schema: Schema | None = None) -> tuple[tuple[bool, ...], str]:
+    # Returns the answers in the order of SCHEMA_KEYS and the parse path that worked:
+    # json, embedded_json (json with text around it) or regex.
+    keys = SCHEMA_KEYS[schema or detect_schema(response) or "consistency"]
+    try:
+        return _answers(json.loads(response), keys), "json"
+    except ValueError:
+        pass
+    m = _OBJECT.search(response)
+    if m is not None and m.group() != response:
+        try:
+            return _answers(json.loads(m.group()), keys), "embedded_json"
+        except ValueError:
+            pass
+    lowered = response.lower()
+    strings = [m.span() for m in _STRING.finditer(lowered)]
+    answers = []
+    for k in keys:
+        # the first key that is not inside a string value, "old2new" itself is a string
+        m = next((m for m in re.finditer(_KEY_VALUE.format(key=k), lowered)
+                  if not any(start <= m.start() < end and lowered[start:end] != f'"{k}"' for start, end in strings)),
+                 None)
+        if m is None:
+            raise ParseError(f"no {k} in the response")
+        answers.append(to_bool(m.group(1)))
+    return tuple(answers), "regex"
+
+
+def consistency_answer(response: str) -> bool | None:
+    try:
+        return parse_response(response, "consistency")[0][0]
+    except ParseError:
+        return None
+
+
+@dataclass
+class CleanReport:
+    repo: str
+    schema: Schema
+    total: int = 0
+    parsed: int = 0
+    quarantined: int = 0
+    # json, embedded_json, regex, or the reason a record was quarantined
+    paths: Counter = field(default_factory=Counter)
+
+
+def cleaned_path(repo_name: str, suffix: str = "pkl") -> str:
+    return path.join(DATA_PATH, OUTPUTS_DIR, CLEANED_DIR, f"{repo_name}.{suffix}")
+
+
+def schema_paths(repo_name: str, schema: Schema) -> list[str]:
+    # the files clean_repo writes for a schema, the quarantine last
+    if schema == "old2new":
+        return [cleaned_path(repo_name), status_index_path(repo_name), cleaned_path(repo_name, "old2new.quarantine.jsonl")]
+    return [cleaned_path(repo_name, "consistency.jsonl"), cleaned_path(repo_name, "consistency.quarantine.jsonl")]
+
+
+def _write_lines(lines: list[dict], file_path: str):
+    with open(file_path + ".tmp", "w") as fout:
+        for x in lines:
+            fout.write(json.dumps(x) + "\n")
+    replace(file_path + ".tmp", file_path)
+
+
+def _write_pickle(obj, file_path: str):
+    with open(file_path + ".tmp", "wb") as fout:
+        pkl.dump(obj, fout)
+    replace(file_path + ".tmp", file_path)
+
+
+def clean_repo(repo_name: RepoName, schema: Schema | None = None, backend: StorageBackend = "pkl",
+               records_path: str | None = None) -> CleanReport:
+    # Records are parsed in one pass without asking anything. The schema is picked once per repo,
+    # see pick_schema, and a response in another schema is quarantined like one that cannot be
+    # parsed or has no finished response, in <repo>.<schema>.quarantine.jsonl for review.
+    # old2new answers are saved as ParsedRecords like the interactive cleaning does, consistency
+    # answers as {"id", "consistency"} lines in <repo>.consistency.jsonl. Only the files of the
+    # schema are replaced, the cleaning of the other one is kept.
+    # records_path reads a pkl or zstd file instead of the records of the repo, e.g. infer's output.
+    records = (read_records(records_path, backend) if records_path
+               else load_records(repo_name, allow_partial=False, backend=backend))
+    report = CleanReport(repo_name, schema or pick_schema(records))
+    parsed_records: list[ParsedRecord] = []
+    consistency: list[dict] = []
+    quarantine: list[dict] = []
+    for r in records:
+        report.total += 1
+        reason, error = None, None
+        if not r.gpt_response:
+            reason = "no_response"
+        elif r.gpt_response.finish_reason != "stop":
+            reason = f"finish_reason:{r.gpt_response.finish_reason}"
+        else:
+            try:
+                answers, parse_path = parse_response(r.gpt_response.response, report.schema)
+            except ParseError as e:
+                reason = "unparseable"
+                error = str(e)
+
+        if reason is not None:
+            report.quarantined += 1
+            report.paths[reason] += 1
+            quarantine.append({"id": r.commit_pair.id, "reason": reason, "error": error,
+                               "response": r.gpt_response.response if r.gpt_response else None})
+            continue
+
+        report.parsed += 1
+        report.paths[parse_path] += 1
+        if report.schema == "old2new":
+            parsed_records.append(ParsedRecord(r, RecordResult(*answers)))
+        else:
+            consistency.append({"id": r.commit_pair.id, "consistency": answers[0]})
+
+    *answers_paths, quarantine_path = schema_paths(repo_name, report.schema)
+    if report.schema == "old2new":
+        # the index after the records, load_status_index rebuilds an index older than them
+        _write_pickle(parsed_records, answers_paths[0])
+        _write_pickle(StatusIndex.build(parsed_records), answers_paths[1])
+    else:
+        _write_lines(consistency, answers_paths[0])
+    _write_lines(quarantine, quarantine_path)
+    return report
+
+
+def clean_repos(repo_names: list[RepoName], schema: Schema | None = None, backend: StorageBackend = "pkl",
+                max_workers: int | None = None) -> list[CleanReport]:
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(clean_repo, repo_names, [schema] * len(repo_names), [backend] * len(repo_names)))
+
+
+def print_reports(reports: list[CleanReport]):
+    paths = sorted({p for r in reports for p in r.paths}, key=lambda p: (":" in p, p))
+    header = f"| {'Repo':^15} | {'Schema':^11} | {'Total':^8} | {'Parsed':^8} | {'Quarantined':^11} | " + \
+        " | ".join(f"{p:^12}" for p in paths) + " |"
+    print(header)
+    print("-" * len(header))
+    for r in reports:
+        print(f"| {r.repo:^15} | {r.schema:^11} | {r.total:^8} | {r.parsed:^8} | {r.quarantined:^11} | " +
+              " | ".join(f"{r.paths[p]:^12}" for p in paths) + " |")
@@ -1,96 +1,36 @@
 # %%
 from utils import *
-import pickle as pkl
+from analytics import HEADER, RepoColumns, load_all, load_columns, status_table, print_status_table, print_commit_table
 
 
-def analyze(repo_name: RepoName, separator: str = ""):
-    # load data and check for invalid outputs
-    with open(f"data/out/cleaned/{repo_name}.pkl", "rb") as fin:
-        parsed_records: list[ParsedRecord] = pkl.load(fin)
+def analyze(repo_name: RepoName, separator: str = "", cols: RepoColumns | None = None):
+    # load data and classify every record in one pass
+    if cols is None:
+        cols = load_columns(repo_name)
 
-    # analysis
-    past_outdated: list[ParsedRecord] = []
-    outdated: list[ParsedRecord] = []
-    normal: list[ParsedRecord] = []
-    for r in parsed_records:
-        oc = r.record.commit_pair.old_comment
-        nc = r.record.commit_pair.new_comment
-        if oc != nc and r.result.old2new is False and r.result.new2new is False:
-            past_outdated.append(r)
-        elif r.result.old2new is True and r.result.new2new is False:
-            outdated.append(r)
-        elif (r.result.old2new is True and r.result.new2new is True) or (r.result.old2new is False and r.result.new2new is True):
-            normal.append(r)
     # printing the result
-
-    for name, segment in zip(["past_outdated", "outdated", "normal"], [past_outdated, outdated, normal]):
-        print_info(f"{repo_name}:{name}", segment, separator)
-
-    print_info(f"{repo_name}:total", parsed_records, separator=separator)
+    print_status_table(repo_name, status_table(cols), separator)
 # %%
 
 
-def statistics(repo_name: RepoName, separator: str = ""):
-    with open(f"data/out/cleaned/{repo_name}.pkl", "rb") as fin:
-        parsed_records: list[ParsedRecord] = pkl.load(fin)
-
-    bi_commit_dict: dict[str, dict] = {}
-    nbi_commit_dict: dict[str, dict] = {}
-    past_outdated: list[ParsedRecord] = []
-    outdated: list[ParsedRecord] = []
-    normal: list[ParsedRecord] = []
-    for r in parsed_records:
-        oc = r.record.commit_pair.old_comment
-        nc = r.record.commit_pair.new_comment
-        status = "uncategorized"
-        if oc != nc and r.result.old2new is False and r.result.new2new is False:
-            past_outdated.append(r)
-            status = "past_outdated"
-        elif r.result.old2new is True and r.result.new2new is False:
-            outdated.append(r)
-            status = "outdated"
-        elif (r.result.old2new is True and r.result.new2new is True) or (r.result.old2new is False and r.result.new2new is True):
-            normal.append(r)
-            status = "normal"
+def statistics(repo_name: RepoName, separator: str = "", cols: RepoColumns | None = None):
+    if cols is None:
+        cols = load_columns(repo_name)
 
-        if r.record.commit_pair.bug_introducing:
-            if (log := bi_commit_dict.get(r.record.commit_pair.new_commit_hash, None)):
-                if status in log:
-                    log[status].append(r)
-                else:
-                    log[status] = [r]
-            else:
-                bi_commit_dict[r.record.commit_pair.new_commit_hash] = {
-                    status: [r]}
-        else:
-            if (log := nbi_commit_dict.get(r.record.commit_pair.new_commit_hash, None)):
-                if status in log:
-                    log[status].append(r)
-                else:
-                    log[status] = [r]
-            else:
-                nbi_commit_dict[r.record.commit_pair.new_commit_hash] = {
-                    status: [r]}
-
-    for report in [bi_commit_dict, nbi_commit_dict]:
-        for commit, log in report.items():
-            for name, segment in zip(["past_outdated", "outdated", "normal", "uncategorized"], [log.get("past_outdated", None), log.get("outdated", None), log.get("normal", None), log.get("uncategorized", None)]):
-                if not segment:
-                    continue
-
-                print_info(f"{repo_name}:{name}:{commit[:5]}", segment, separator)
+    print_commit_table(cols, separator)
 
 
 # %%
 
-
-header = f"| {'Name':^30} | {'14DaysBI':^10} | {'14DaysNBI':^10} | {'7DaysBI':^10} | {'7DaysNBI':^10} |"
-separator = "-" * len(header)
-print(separator)
-print(header)
-print(separator)
-repo_names: list[RepoName] = ["archiva", "aries",
-                              "cxf", "jena", "mesos", "storm", "karaf"]
-for rn in repo_names:
-    statistics(rn, separator)
+if __name__ == "__main__":
+    header = HEADER
+    separator = "-" * len(header)
+    print(separator)
+    print(header)
+    print(separator)
+    repo_names: list[RepoName] = ["archiva", "aries",
+                                  "cxf", "jena", "mesos", "storm", "karaf"]
+    # every repo is loaded once, in parallel
+    for cols in load_all(repo_names):
+        statistics(cols.repo, separator, cols=cols)
 # %%
@@ -0,0 +1,106 @@
+import mmap
+import struct
+import pickle as pkl
+from array import array
+from os import path, replace
+from typing import Iterator
+import zstandard as zstd
+from utils import Record, DATA_PATH, OUTPUTS_DIR
+
+COMPRESSED_SUFFIX = "zrec"
+MAGIC = b"ZREC0001"
+# magic, index offset, index length, dictionary length
+HEADER = struct.Struct("<8sQQQ")
+LEVEL = 9
+DICT_SIZE = 112 * 1024
+# Training needs enough samples, smaller repos are compressed without a dictionary.
+MIN_TRAINING_SAMPLES = 64
+MAX_TRAINING_SAMPLES = 5000
+
+
+def compressed_path(repo_name: str) -> str:
+    return path.join(DATA_PATH, OUTPUTS_DIR, f"{repo_name}.{COMPRESSED_SUFFIX}")
+
+
+def train_dictionary(frames: list[bytes]) -> bytes:
+    if len(frames) < MIN_TRAINING_SAMPLES:
+        return b""
+    step = max(1, len(frames) // MAX_TRAINING_SAMPLES)
+    try:
+        return zstd.train_dictionary(DICT_SIZE, frames[::step], level=LEVEL).as_bytes()
+    except zstd.ZstdError:
+        # happens when the samples are too small or too uniform to learn from
+        return b""
+
+
+def write_compressed(records: list[Record], file_path: str):
+    # Every record is its own zstd frame so that any record can be read without the others.
+    # The dictionary is trained on the serialized records of this repo, which are mostly
+    # Java method bodies and Javadoc.
+    raw = [pkl.dumps(r, protocol=pkl.HIGHEST_PROTOCOL) for r in records]
+    dict_data = train_dictionary(raw)
+    cctx = zstd.ZstdCompressor(level=LEVEL, dict_data=zstd.ZstdCompressionDict(dict_data) if dict_data else None)
+
+    offsets = array('Q', [0])
+    with open(file_path + ".tmp", 'wb') as fout:
+        fout.write(HEADER.pack(MAGIC, 0, 0, 0))
+        fout.write(dict_data)
+        base = fout.tell()
+        for data in raw:
+            frame = cctx.compress(data)
+            fout.write(frame)
+            offsets.append(offsets[-1] + len(frame))
+        index = pkl.dumps({"base": base, "offsets": offsets, "ids": [r.commit_pair.id for r in records]},
+                          protocol=pkl.HIGHEST_PROTOCOL)
+        index_offset = fout.tell()
+        fout.write(index)
+        fout.seek(0)
+        fout.write(HEADER.pack(MAGIC, index_offset, len(index), len(dict_data)))
+    replace(file_path + ".tmp", file_path)
+
+
+class CompressedRecords:
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self._fin = open(file_path, 'rb')
+        self._mm = mmap.mmap(self._fin.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, index_offset, index_len, dict_len = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{file_path} is not a compressed record file")
+        index = pkl.loads(self._mm[index_offset:index_offset + index_len])
+        self._base: int = index["base"]
+        self._offsets: array = index["offsets"]
+        self.ids: list[str] = index["ids"]
+        self._positions: dict[str, int] | None = None
+        dict_data = self._mm[HEADER.size:HEADER.size + dict_len]
+        self._dctx = zstd.ZstdDecompressor(dict_data=zstd.ZstdCompressionDict(dict_data) if dict_data else None)
+
+    @classmethod
+    def open(cls, repo_name: str) -> 'CompressedRecords':
+        return cls(compressed_path(repo_name))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index: int) -> Record:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("record index out of range")
+        start = self._base + self._offsets[index]
+        end = self._base + self._offsets[index + 1]
+        return pkl.loads(self._dctx.decompress(self._mm[start:end]))
+
+    def get(self, record_id: str) -> Record:
+        if self._positions is None:
+            self._positions = {x: i for i, x in enumerate(self.ids)}
+        return self[self._positions[record_id]]
+
+    def __iter__(self) -> Iterator[Record]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def close(self):
+        self._mm.close()
+        self._fin.close()
+
@@ -0,0 +1,226 @@
+import json
+import argparse
+from dataclasses import dataclass, field, asdict
+from functools import cache
+from hashlib import blake2b
+from os import path, makedirs, replace
+from typing import Iterable, Iterator
+from models import CommitPair, Record, RepoName, StorageBackend
+from utils import DATA_PATH, OUTPUTS_DIR, load_records
+
+DATASETS_DIR = "datasets"
+# the upload limit of a fine-tuning file
+SHARD_BYTES = 512 * 2**20
+# lines are written in batches
+WRITE_BATCH = 1000
+# token estimate when tiktoken is not installed
+CHARS_PER_TOKEN = 4
+TOKENIZER = "cl100k_base"
+# gt-concurrent.py sends the prompts with this indent, the training examples must match it
+PROMPT_INDENT = 2
+CONSISTENCY_INSTRUCTIONS = "Determine if the old comment remains consostent for the new code, focusing on the method's described functionality. A record is 'consistent' if the old comment still appropriately describes the method's functionality in the new code, ignoring syntactic changes that do not alter the described behavior. Direct contradictions, such as changes in method names, variables, or operations that fundamentally alter what's described, render a record 'inconsistent'. Assess whether any changes, including method signature adjustments or efficiency improvements, materially affect the method's described behavior. Use 'true' for consistent records and 'false' for inconsistent ones in your JSON response"
+CONSISTENCY_NOTE = "Consider the impact of changes on the method's overall purpose and functionality. For example, replacing a direct equality check with a null-safe version (using 'Objects.equals') does not change the fundamental operation or its description. However, changing a method from returning the 'first' element to returning the 'last' element in a collection, or vice versa, significantly alters the described behavior and thus affects consistency."
+
+
+@dataclass
+class Shard:
+    path: str
+    examples: int = 0
+    bytes: int = 0
+    tokens: int = 0
+
+
+@dataclass
+class DatasetReport:
+    name: str
+    # indent of the prompt json, None for compact prompts
+    indent: int | None
+    requested: int = 0
+    written: int = 0
+    duplicates: int = 0
+    missing: list[str] = field(default_factory=list)
+    shards: list[Shard] = field(default_factory=list)
+
+
+def load_labels(csv_path: str) -> dict[str, int]:
+    # id,label lines of the readable samples, label 1 is inconsistent
+    labels = {}
+    with open(csv_path, 'r') as fin:
+        for line in fin:
+            record_id, label = line.strip("\n").split(',')
+            labels[record_id] = int(label)
+    return labels
+
+
+def fetch_records(repo_name: RepoName, ids: Iterable[str], backend: StorageBackend = "pkl") -> Iterator[Record]:
+    # Only the requested records are deserialized, in store order. The sqlite backend selects them
+    # by its id index, zstd by the id index of the file and pkl through the memory-mapped lazy copy,
+    # whose ids are read without the method bodies.
+    ids = set(ids)
+    if backend == "sqlite":
+        from record_store import RecordStore
+        with RecordStore() as store:
+            yield from store.iter_query(repo=repo_name, ids=ids)
+    elif backend == "zstd":
+        from compressed_store import CompressedRecords
+        compressed = CompressedRecords.open(repo_name)
+        try:
+            for i in sorted(i for i, x in enumerate(compressed.ids) if x in ids):
+                yield compressed[i]
+        finally:
+            compressed.close()
+    else:
+        records = load_records(repo_name, allow_partial=False, backend=backend, lazy=True)
+        try:
+            for r in records:
+                if r.commit_pair.id in ids:
+                    yield r.materialize()
+        finally:
+            records.close()
+
+
+def _dumps(obj, indent: int | None) -> str:
+    # without an indent the separators have no spaces either
+    return json.dumps(obj, indent=indent, separators=None if indent is not None else (",", ":"))
+
+
+def consistency_prompt(cp: CommitPair, indent: int | None = PROMPT_INDENT) -> str:
+    # the prompt of the fine-tuned model, gt-concurrent.py sends it too
+    prompt = {
+        "instructions": CONSISTENCY_INSTRUCTIONS,
+        "note": CONSISTENCY_NOTE,
+        "task": {
+            "old_method_content": cp.old_method_content,
+            "new_method_content": cp.new_method_content,
+            "old_comment": cp.old_comment,
+            "new_comment": cp.new_comment
+        },
+        "response_template": {
+            "consistency": "<true/false>"
+        }
+    }
+    return _dumps(prompt, indent)
+
+
+def training_example(record: Record, consistent: bool, indent: int | None = PROMPT_INDENT) -> dict:
+    return {"messages": [
+        {"role": "system", "content": consistency_prompt(record.commit_pair, indent)},
+        {"role": "assistant", "content": _dumps({"consistency": consistent}, indent)}
+    ]}
+
+
+@cache
+def _encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(TOKENIZER)
+    except ImportError:
+        return None
+
+
+def count_tokens(example: dict) -> int:
+    # message contents only, estimated from the length without tiktoken
+    encoding = _encoding()
+    texts = [m["content"] for m in example["messages"]]
+    if encoding is None:
+        return sum(len(x) for x in texts) // CHARS_PER_TOKEN
+    return sum(len(encoding.encode(x)) for x in texts)
+
+
+def shard_path(name: str, index: int) -> str:
+    return path.join(DATA_PATH, OUTPUTS_DIR, DATASETS_DIR, f"{name}-{index:05}.jsonl")
+
+
+class _ShardWriter:
+    # Starts a new shard when the next line would go over shard_bytes.
+    def __init__(self, report: DatasetReport, shard_bytes: int):
+        self.report = report
+        self.shard_bytes = shard_bytes
+        self.buffer: list[str] = []
+        self.fout = None
+
+    def _open(self):
+        shard = Shard(shard_path(self.report.name, len(self.report.shards)))
+        self.report.shards.append(shard)
+        self.fout = open(shard.path + ".tmp", 'w')
+
+    def _flush(self):
+        self.fout.writelines(self.buffer)
+        self.buffer = []
+
+    def close(self):
+        if self.fout is None:
+            return
+        self._flush()
+        self.fout.close()
+        replace(self.report.shards[-1].path + ".tmp", self.report.shards[-1].path)
+        self.fout = None
+
+    def write(self, line: str, tokens: int):
+        size = len(line.encode())
+        if self.fout is not None and self.report.shards[-1].bytes + size > self.shard_bytes:
+            self.close()
+        if self.fout is None:
+            self._open()
+        shard = self.report.shards[-1]
+        shard.examples += 1
+        shard.bytes += size
+        shard.tokens += tokens
+        self.buffer.append(line)
+        if len(self.buffer) >= WRITE_BATCH:
+            self._flush()
+
+
+def build_dataset(repo_name: RepoName, labels: dict[str, int], name: str, backend: StorageBackend = "pkl",
+                  shard_bytes: int = SHARD_BYTES, indent: int | None = PROMPT_INDENT) -> DatasetReport:
+    # Writes data/out/datasets/<name>-<n>.jsonl shards of {"messages": [prompt, answer]} lines for
+    # the labelled ids and <name>.json with the counts. Examples with the same prompt and answer
+    # are written once.
+    report = DatasetReport(name, indent, requested=len(labels))
+    makedirs(path.join(DATA_PATH, OUTPUTS_DIR, DATASETS_DIR), exist_ok=True)
+    seen_ids: set[str] = set()
+    seen_examples: set[bytes] = set()
+    writer = _ShardWriter(report, shard_bytes)
+    try:
+        for r in fetch_records(repo_name, labels, backend):
+            seen_ids.add(r.commit_pair.id)
+            example = training_example(r, not bool(labels[r.commit_pair.id]), indent)
+            line = json.dumps(example, separators=(",", ":")) + "\n"
+            key = blake2b(line.encode(), digest_size=16).digest()
+            if key in seen_examples:
+                report.duplicates += 1
+                continue
+            seen_examples.add(key)
+            writer.write(line, count_tokens(example))
+            report.written += 1
+    finally:
+        writer.close()
+    report.missing = sorted(set(labels) - seen_ids)
+    with open(path.join(DATA_PATH, OUTPUTS_DIR, DATASETS_DIR, f"{name}.json"), 'w') as fout:
+        json.dump(asdict(report), fout, indent=2)
+    return report
+
+
+def print_report(report: DatasetReport):
+    print(f"{report.name}: {report.requested} ids, {report.written} examples, "
+          f"{report.duplicates} duplicates, {len(report.missing)} missing")
+    header = f"| {'Shard':^40} | {'Examples':^8} | {'MB':^8} | {'Tokens':^10} |"
+    print(header)
+    print("-" * len(header))
+    for s in report.shards:
+        print(f"| {path.basename(s.path):^40} | {s.examples:^8} | {s.bytes / 2**20:^8.2f} | {s.tokens:^10} |")
+
+
+if __name__ == "__main__":
+    # python dataset.py valid "data/temp/readableSamples/fine_tune - train.csv" --name finetune-train
+    parser = argparse.ArgumentParser(description="Builds fine-tuning shards for the labelled ids of a csv.")
+    parser.add_argument("repo")
+    parser.add_argument("labels", help="csv of id,label lines")
+    parser.add_argument("--name", required=True)
+    parser.add_argument("--backend", choices=["pkl", "sqlite", "zstd"], default="pkl")
+    parser.add_argument("--shard-mb", type=float, default=SHARD_BYTES / 2**20)
+    parser.add_argument("--indent", type=int, default=PROMPT_INDENT, help="the default matches gt-concurrent.py")
+    parser.add_argument("--compact", action="store_true", help="compact prompts, they no longer match gt-concurrent.py")
+    args = parser.parse_args()
+    print_report(build_dataset(args.repo, load_labels(args.labels), args.name, args.backend,
+                               int(args.shard_mb * 2**20), None if args.compact else args.indent))
@@ -0,0 +1,123 @@
+import sys
+import pickle as pkl
+from dataclasses import dataclass
+import numpy as np
+from models import Record
+from utils import load_gt_answers
+from cleaning import consistency_answer
+
+# The positive class is "inconsistent": ground truth labels are 1 for inconsistent records and
+# the fine-tuned model answers {"consistency": <true/false>}, see finetune.py.
+METRICS = ["accuracy", "precision", "recall", "f1"]
+N_BOOTSTRAP = 5000
+# resamples drawn at once, bounds the memory of the (resamples, records) index matrix
+BOOTSTRAP_CHUNK = 500
+
+
+@dataclass
+class EvalSet:
+    ids: np.ndarray
+    repos: np.ndarray
+    y_true: np.ndarray
+    # one row per run
+    y_pred: np.ndarray
+    runs: list[str]
+
+
+def load_predictions(run_path: str) -> dict[str, bool]:
+    # id -> predicted inconsistent, records without a usable answer are left out
+    with open(run_path, "rb") as fin:
+        records: list[Record] = pkl.load(fin)
+    predictions = {}
+    for r in records:
+        if r.gpt_response is None:
+            continue
+        consistent = consistency_answer(r.gpt_response.response)
+        if consistent is not None:
+            predictions[r.commit_pair.id] = not consistent
+    return predictions
+
+
+def join(runs: dict[str, dict[str, bool]], gt: dict[str, bool]) -> EvalSet:
+    # Only ids answered by every run are kept, so that the runs are compared on the same records.
+    common = set(gt)
+    for predictions in runs.values():
+        common &= predictions.keys()
+    ids = np.array(sorted(common), dtype=str)
+    return EvalSet(ids=ids,
+                   repos=np.array([x.rsplit("_", 1)[0] for x in ids], dtype=str),
+                   y_true=np.array([gt[x] for x in ids], dtype=bool),
+                   y_pred=np.array([[p[x] for x in ids] for p in runs.values()], dtype=bool).reshape(len(runs), len(ids)),
+                   runs=list(runs))
+
+
+def confusion(y_true: np.ndarray, y_pred: np.ndarray) -> np.ndarray:
+    # [..., (tn, fp, fn, tp)] over the last axis, works for a batch of resamples too
+    return np.stack([(~y_true & ~y_pred).sum(-1), (~y_true & y_pred).sum(-1),
+                     (y_true & ~y_pred).sum(-1), (y_true & y_pred).sum(-1)], axis=-1)
+
+
+def scores(matrix: np.ndarray) -> np.ndarray:
+    # [..., (accuracy, precision, recall, f1)] from confusion matrices, 0 where undefined
+    tn, fp, fn, tp = np.moveaxis(matrix.astype(np.float64), -1, 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        accuracy = (tp + tn) / (tn + fp + fn + tp)
+        precision = np.nan_to_num(tp / (tp + fp))
+        recall = np.nan_to_num(tp / (tp + fn))
+        f1 = np.nan_to_num(2 * precision * recall / (precision + recall))
+    return np.stack([accuracy, precision, recall, f1], axis=-1)
+
+
+def bootstrap(y_true: np.ndarray, y_pred: np.ndarray, n: int = N_BOOTSTRAP, seed: int = 0) -> np.ndarray:
+    # (runs, n, metrics). Every run uses the same resamples, so differences between runs are paired.
+    rng = np.random.default_rng(seed)
+    size = len(y_true)
+    result = np.empty((len(y_pred), n, len(METRICS)))
+    for start in range(0, n, BOOTSTRAP_CHUNK):
+        stop = min(n, start + BOOTSTRAP_CHUNK)
+        idx = rng.integers(0, size, size=(stop - start, size))
+        result[:, start:stop] = scores(confusion(y_true[idx], y_pred[:, idx]))
+    return result
+
+
+def interval(samples: np.ndarray, alpha: float = 0.05, axis: int = -2) -> tuple[np.ndarray, np.ndarray]:
+    return np.quantile(samples, alpha / 2, axis=axis), np.quantile(samples, 1 - alpha / 2, axis=axis)
+
+
+def evaluate(data: EvalSet, n: int = N_BOOTSTRAP, seed: int = 0, alpha: float = 0.05) -> dict[str, dict]:
+    # metrics, confidence intervals and confusion matrix for every run, overall and per repo
+    report = {}
+    for repo in ["all", *np.unique(data.repos)]:
+        mask = slice(None) if repo == "all" else data.repos == repo
+        y_true, y_pred = data.y_true[mask], data.y_pred[:, mask]
+        if len(y_true) == 0:
+            continue
+        matrix = confusion(y_true, y_pred)
+        samples = bootstrap(y_true, y_pred, n=n, seed=seed)
+        low, high = interval(samples, alpha)
+        # F1 difference to the first run, on the same resamples
+        f1_low, f1_high = interval(samples[..., 3] - samples[:1, :, 3], alpha, axis=-1) if len(data.runs) > 1 else (None, None)
+        report[repo] = {run: {"n": int(len(y_true)), "confusion": matrix[i].tolist(),
+                              **{m: float(v) for m, v in zip(METRICS, scores(matrix[i]))},
+                              **{f"{m}_ci": (float(low[i, j]), float(high[i, j])) for j, m in enumerate(METRICS)},
+                              "f1_diff_ci": (float(f1_low[i]), float(f1_high[i])) if f1_low is not None else None}
+                        for i, run in enumerate(data.runs)}
+    return report
+
+
+def compare_runs(run_paths: dict[str, str], vgt_only=True, n: int = N_BOOTSTRAP, seed: int = 0) -> dict[str, dict]:
+    data = join({name: load_predictions(p) for name, p in run_paths.items()}, load_gt_answers(vgt_only))
+    report = evaluate(data, n=n, seed=seed)
+    print(f"| {'Repo':^15} | {'Run':^20} | {'N':^6} | " + " | ".join(f"{m:^21}" for m in METRICS) + f" | {'dF1 vs first':^17} |")
+    for repo, runs in report.items():
+        for run, res in runs.items():
+            cells = " | ".join(f"{res[m]:.3f} [{res[m + '_ci'][0]:.3f},{res[m + '_ci'][1]:.3f}]" for m in METRICS)
+            diff = res["f1_diff_ci"]
+            diff = f"[{diff[0]:+.3f},{diff[1]:+.3f}]" if diff else ""
+            print(f"| {repo:^15} | {run:^20} | {res['n']:^6} | {cells} | {diff:^17} |")
+    return report
+
+
+if __name__ == "__main__":
+    # python evaluation.py ft50S=data/out/gt--fintuned50S.pkl other=data/out/gt--other.pkl
+    compare_runs(dict(x.split("=", 1) for x in sys.argv[1:]))
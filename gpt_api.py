@@ -0,0 +1,96 @@
+import os
+import logging
+import backoff
+import metrics
+from models import Record, CommitPair, GptResponse, GptMessage
+
+from functools import cache
+from typing import TYPE_CHECKING
+from openai import OpenAI, APIError
+
+if TYPE_CHECKING:
+    from openai.types.chat.chat_completion import ChatCompletion
+
+logging.getLogger('backoff').addHandler(logging.StreamHandler())
+
+# GPT 4 suggestion:
+IMPROVED_SYSTEM_MESSAGE = """You will be provided a 4-element input comprising of "old_comment", "old_code", "new_comment", "new_code". Each encapsulated within XML tags (e.g., <old_comment>...</old_comment>). The "old_code" and "new_code" will contain Java code, and "old_comment" and "new_comment" will include comments describing the code. 
+
+Your task includes:
+
+1. Analyze if the "new_comment" appropriately describes the "old_code". 
+
+2. Determine if the "new_comment" accurately explains the "new_code".
+
+Give your responses according to the following JSON structure:
+{
+"old2new": <Does "new_comment" explain "old_code"?>,
+"new2new": <Does "new_comment" describe "new_code"?>,
+"reason-old2new": <Justify your "old2new" response>,
+"reason-new2new": <Justify your "new2new" response>
+}
+"""
+
+
+MODEL = "gpt-3.5-turbo-1106"
+MAX_ATTEMPTS = 4
+
+
+@cache
+def get_client():
+    # created on the first request, importing this module does not need OPENAI_KEY
+    return OpenAI(api_key=os.getenv("OPENAI_KEY", ""))
+
+
+def get_gpt_message(commit_pair: CommitPair, system_message=IMPROVED_SYSTEM_MESSAGE) -> GptMessage:
+    user_message = (f"<old_comment>{commit_pair.old_comment}</old_comment>\n"
+                    f"<old_code>{commit_pair.old_method_content}</old_code>\n"
+                    f"<new_comment>{commit_pair.new_comment}</new_comment>\n"
+                    f"<new_code>{commit_pair.new_method_content}</new_code>")
+    return [
+        {
+            "role": "system",
+            "content": system_message
+        },
+        {
+            "role": "user",
+            "content": user_message
+        },
+    ]
+
+
+@backoff.on_exception(backoff.expo, APIError, max_value=60, on_backoff=lambda details: metrics.inc("gpt_backoff_retries"))
+def get_completion_with_backoff(message: GptMessage, model=MODEL):
+    with metrics.timer("gpt_request_seconds"):
+        response = get_client().chat.completions.create(
+            model=model,
+            messages=message,
+            response_format={
+                "type": "json_object"},
+            max_tokens=1000
+        )
+    return response
+
+
+def ask_gpt(r: Record, model=MODEL, system_message=IMPROVED_SYSTEM_MESSAGE) -> 'ChatCompletion':
+    r.prompt = get_gpt_message(r.commit_pair, system_message=system_message)
+    return get_completion_with_backoff(r.prompt, model=model)
+
+
+def answer_record(r: Record, ask=ask_gpt) -> bool:
+    # Sets the response of the record, False when every attempt failed.
+    response: 'ChatCompletion' = None
+    while not response and r.attempts < MAX_ATTEMPTS:
+        try:
+            response = ask(r)
+        except:
+            r.attempts += 1
+            metrics.inc("gpt_failed_attempts")
+    if not response:
+        metrics.inc("gpt_failed_records")
+        return False
+    r.gpt_response = GptResponse.from_ChatCompletion(response)
+    metrics.inc("gpt_answered_records")
+    metrics.inc("gpt_prompt_tokens", r.gpt_response.usage.get("prompt_tokens", 0))
+    metrics.inc("gpt_completion_tokens", r.gpt_response.usage.get("completion_tokens", 0))
+    return True
@@ -9,6 +9,7 @@ import os
 from openai import OpenAI, RateLimitError
 from openai.types.chat.chat_completion import ChatCompletion
 from utils import *
+from dataset import PROMPT_INDENT, consistency_prompt
 
 client = OpenAI(api_key=os.getenv("OPENAI_KEY", ""))
 
@@ -23,25 +24,11 @@ MODEL = "ft:gpt-3.5-turbo-1106:sepe:shiva-50s-2:9GJ3v0UT"
 
 
 def get_gpt_prompt(record: Record) -> GptMessage:
-    cp = record.commit_pair
-    prompt = {
-        "instructions": "Determine if the old comment remains consostent for the new code, focusing on the method's described functionality. A record is 'consistent' if the old comment still appropriately describes the method's functionality in the new code, ignoring syntactic changes that do not alter the described behavior. Direct contradictions, such as changes in method names, variables, or operations that fundamentally alter what's described, render a record 'inconsistent'. Assess whether any changes, including method signature adjustments or efficiency improvements, materially affect the method's described behavior. Use 'true' for consistent records and 'false' for inconsistent ones in your JSON response",
-        "note": "Consider the impact of changes on the method's overall purpose and functionality. For example, replacing a direct equality check with a null-safe version (using 'Objects.equals') does not change the fundamental operation or its description. However, changing a method from returning the 'first' element to returning the 'last' element in a collection, or vice versa, significantly alters the described behavior and thus affects consistency.",
-
-        "task": {
-            "old_method_content": cp.old_method_content,
-            "new_method_content": cp.new_method_content,
-            "old_comment": cp.old_comment,
-            "new_comment": cp.new_comment
-        },
-        "response_template": {
-            "consistency": "<true/false>"
-        }
-    }
+    # the same prompt the fine-tuning examples of dataset.py are built with
     return [
         {
             "role": "system",
-            "content": json.dumps(prompt, indent=2)
+            "content": consistency_prompt(record.commit_pair, PROMPT_INDENT)
         },
     ]
 
@@ -80,7 +67,7 @@ def process_record(record:Record):
 
 # %%
 name = "gt"
-records = load_records(name, allow_partial=False)
+records = load_records(name, allow_partial=False, lazy=True)
 
 print(name, len(records))
 #%%
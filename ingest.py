@@ -0,0 +1,145 @@
+import re
+from os import path
+from typing import IO, Iterator
+from pydantic import TypeAdapter
+from pydantic_core import from_json
+from utils import CommitPair, Record, RepoName, DATA_PATH, INPUTS_DIR, OUTPUTS_DIR, save_records
+from string_pool import POOLED_FIELDS, StringPool
+
+CHUNK_SIZE = 1 << 22
+BATCH_SIZE = 10000
+
+CommitPairList = TypeAdapter(list[CommitPair])
+
+# Start of the first object of the pairs array and its first key.
+_FIRST_KEY = re.compile(rb'\s*\{\s*"((?:[^"\\]|\\.)*)"')
+# Start of the pairs array in the pooled output, right after the strings dict.
+_POOLED_PAIRS = re.compile(rb'\}\s*,\s*"pairs"\s*:\s*\[')
+
+
+def _boundary(first_key: bytes) -> re.Pattern:
+    # `}, {"<first key>":` can only be the gap between two pairs: inside a json string
+    # the quote would be escaped, and a string ending there would leave a bare key behind.
+    return re.compile(rb'\}\s*,\s*(?=\{\s*"' + re.escape(first_key) + rb'"\s*:)')
+
+
+def _iter_array_pieces(fin: IO[bytes], buf: bytes) -> Iterator[bytes]:
+    # buf starts right after the opening bracket of the pairs array. Yields the array
+    # cut at pair boundaries, so that every piece is parsed by pydantic-core on its own.
+    m = _FIRST_KEY.match(buf)
+    while m is None and buf.strip()[:1] != b"]":
+        chunk = fin.read(CHUNK_SIZE)
+        if not chunk:
+            raise ValueError("unexpected end of json input")
+        buf += chunk
+        m = _FIRST_KEY.match(buf)
+    if m is None:
+        return
+    boundary = _boundary(m.group(1))
+    scanned = 0
+    while chunk := fin.read(CHUNK_SIZE):
+        buf += chunk
+        last = None
+        # the tail of the previous scan may hold the start of a boundary
+        for last in boundary.finditer(buf, max(0, scanned - 256)):
+            pass
+        scanned = len(buf)
+        if last is not None:
+            yield buf[:last.start() + 1]
+            buf = buf[last.end():]
+            scanned = len(buf)
+    # closing bracket of the array, and of the pooled object
+    buf = buf.rstrip()
+    if buf.endswith(b"}") and buf[:-1].rstrip().endswith(b"]"):
+        buf = buf[:-1].rstrip()
+    if not buf.endswith(b"]"):
+        raise ValueError("unexpected end of json input")
+    yield buf[:-1]
+
+
+def iter_commit_pair_dicts(file_path: str) -> Iterator[dict]:
+    # Reads both the plain list output of gen-out and the pooled {"strings", "pairs"} one.
+    with open(file_path, 'rb') as fin:
+        buf = fin.read(CHUNK_SIZE).lstrip()
+        strings = None
+        if buf.startswith(b"{"):
+            # gen-out writes the strings first, they are needed to resolve every pair
+            scanned = 0
+            while not (m := _POOLED_PAIRS.search(buf, max(0, scanned - 64))):
+                scanned = len(buf)
+                chunk = fin.read(CHUNK_SIZE)
+                if not chunk:
+                    raise ValueError("pooled json input has no pairs")
+                buf += chunk
+            strings = from_json(buf[:m.start() + 1] + b"}")["strings"]
+            buf = buf[m.end():]
+        elif buf.startswith(b"["):
+            buf = buf[1:]
+        else:
+            raise ValueError(f"{file_path} is not a gen-out output")
+
+        # Equal texts share one str. Pooled inputs already give back the same objects,
+        # pydantic keeps them, and pickle then stores each text once.
+        pool = StringPool() if strings is None else None
+        for piece in _iter_array_pieces(fin, buf):
+            for dp in from_json(b"[" + piece + b"]"):
+                # HOTFIX: json files have the field _id CommitPair expects id
+                dp["id"] = dp.pop("_id", dp.get("id"))
+                for f in POOLED_FIELDS:
+                    dp[f] = strings[dp[f]] if pool is None else pool.intern(dp[f])
+                yield dp
+
+
+def iter_batches(items: Iterator, batch_size: int = BATCH_SIZE) -> Iterator[list]:
+    batch = []
+    for x in items:
+        batch.append(x)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def build_records(batch: list[dict], repo_name: RepoName) -> list[Record]:
+    # One pydantic-core call validates the whole batch.
+    return [Record(repo=repo_name, commit_pair=cp) for cp in CommitPairList.validate_python(batch)]
+
+
+def iter_record_batches(repo_name: RepoName, batch_size: int = BATCH_SIZE,
+                        file_path: str | None = None) -> Iterator[list[Record]]:
+    if file_path is None:
+        file_path = path.join(DATA_PATH, INPUTS_DIR, f"{repo_name}.json")
+    for batch in iter_batches(iter_commit_pair_dicts(file_path), batch_size):
+        yield build_records(batch, repo_name)
+
+
+def ingest(repo_name: RepoName, auto_save=True, save_as: str = "pkl", batch_size: int = BATCH_SIZE,
+           keep_records=True, file_path: str | None = None) -> list[Record] | int:
+    # With keep_records=False the sqlite and jsonl outputs are written batch by batch
+    # without keeping the records in memory, and the number of records is returned.
+    batches = iter_record_batches(repo_name, batch_size=batch_size, file_path=file_path)
+    records: list[Record] = []
+    if keep_records:
+        batches = (records.extend(batch) or batch for batch in batches)
+
+    if not auto_save:
+        count = sum(len(batch) for batch in batches)
+    elif save_as == "sqlite":
+        from record_store import RecordStore
+        with RecordStore() as store:
+            count = store.write_batches(batches, repo_name)
+    elif save_as == "jsonl":
+        count = 0
+        with open(path.join(DATA_PATH, OUTPUTS_DIR, f"{repo_name}.jsonl"), 'w') as fout:
+            for batch in batches:
+                fout.writelines(r.model_dump_json() + "\n" for r in batch)
+                count += len(batch)
+    elif save_as in ("pkl", "zstd"):
+        # a single file, needs every record
+        records = [r for batch in batches for r in batch]
+        count = len(records)
+        save_records(records, repo_name=repo_name, invalidate_partial=False, backend=save_as)
+    else:
+        raise ValueError("save_as must be either pkl, jsonl, sqlite or zstd.")
+    return records if keep_records else count
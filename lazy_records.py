@@ -0,0 +1,197 @@
+import copyreg
+import mmap
+import pickle as pkl
+from array import array
+from hashlib import blake2b
+from os import path, mkdir, replace
+from typing import Any, Iterator
+from pydantic import BaseModel
+from utils import Record, CommitPair, DATA_PATH, OUTPUTS_DIR
+
+LAZY_DIR = "lazy"
+
+# Fields that live in the memory-mapped blob file, in the order they are written for each record.
+BLOB_FIELDS = ("old_method_content", "new_method_content",
+               "old_comment", "new_comment", "prompt", "gpt_response")
+# Small fields that stay in memory.
+CP_META_FIELDS = ("old_commit_hash", "new_commit_hash", "file_path",
+                  "bug_introducing", "old_commit_date", "new_commit_date", "id")
+PICKLED_FIELDS = ("prompt", "gpt_response")
+# Layout of the in-memory metadata tuple of each record.
+META_REPO = 0
+META_CP = 1
+META_HAS_RESPONSE = META_CP + len(CP_META_FIELDS)
+META_ATTEMPTS = META_HAS_RESPONSE + 1
+META_OCD_LABEL = META_ATTEMPTS + 1
+
+
+def lazy_paths(repo_name: str) -> tuple[str, str]:
+    base = path.join(DATA_PATH, OUTPUTS_DIR, LAZY_DIR, repo_name)
+    return f"{base}.meta.pkl", f"{base}.blob"
+
+
+def _reduce_as(model: BaseModel, protocol):
+    # Pickle refuses __newobj__ for an object of another class, object.__new__ builds the same thing.
+    func, args, *rest = model.__reduce_ex__(protocol)
+    if func is copyreg.__newobj__:
+        func = object.__new__
+    return (func, args, *rest)
+
+
+class LazyCommitPair:
+    __slots__ = ("_records", "_index")
+
+    def __init__(self, records: 'LazyRecords', index: int):
+        self._records = records
+        self._index = index
+
+    def __getattr__(self, name: str):
+        if name in CP_META_FIELDS:
+            return self._records._meta[self._index][META_CP + CP_META_FIELDS.index(name)]
+        if name in BLOB_FIELDS[:4]:
+            return self._records._blob(self._index, name)
+        # Anything else (model_dump, model_dump_json, ...) goes through a real CommitPair
+        return getattr(self.materialize(), name)
+
+    def __setattr__(self, name: str, value: Any):
+        if name in self.__slots__:
+            return object.__setattr__(self, name, value)
+        raise AttributeError("commit pairs of lazy records are read-only")
+
+    def materialize(self) -> CommitPair:
+        return CommitPair.model_construct(**{f: getattr(self, f) for f in CommitPair.model_fields})
+
+    def __reduce_ex__(self, protocol):
+        return _reduce_as(self.materialize(), protocol)
+
+
+class LazyRecord:
+    __slots__ = ("_records", "_index")
+
+    def __init__(self, records: 'LazyRecords', index: int):
+        self._records = records
+        self._index = index
+
+    @property
+    def commit_pair(self) -> LazyCommitPair:
+        return LazyCommitPair(self._records, self._index)
+
+    def __getattr__(self, name: str):
+        overrides = self._records._overrides.get(self._index)
+        if overrides and name in overrides:
+            return overrides[name]
+        if name == "repo":
+            return self._records._meta[self._index][META_REPO]
+        if name == "attempts":
+            return self._records._meta[self._index][META_ATTEMPTS]
+        if name == "ocd_label":
+            return self._records._meta[self._index][META_OCD_LABEL]
+        if name == "gpt_response" and not self._records._meta[self._index][META_HAS_RESPONSE]:
+            return None
+        if name in PICKLED_FIELDS:
+            return self._records._blob(self._index, name)
+        return getattr(self.materialize(), name)
+
+    def __setattr__(self, name: str, value: Any):
+        if name in self.__slots__:
+            return object.__setattr__(self, name, value)
+        if name not in Record.model_fields or name == "commit_pair":
+            raise AttributeError(f"can not set {name} on a lazy record")
+        # Changes are kept in memory until the records are saved again.
+        self._records._overrides.setdefault(self._index, {})[name] = value
+
+    def materialize(self) -> Record:
+        return Record.model_construct(commit_pair=self.commit_pair.materialize(),
+                                      **{f: getattr(self, f) for f in Record.model_fields if f != "commit_pair"})
+
+    def __reduce_ex__(self, protocol):
+        # Pickling (partial saves, process pools) always produces a real Record.
+        return _reduce_as(self.materialize(), protocol)
+
+
+class LazyRecords:
+    def __init__(self, meta_path: str, blob_path: str):
+        with open(meta_path, 'rb') as fin:
+            data = pkl.load(fin)
+        self._meta: list[tuple] = data["meta"]
+        self._spans: array = data["spans"]
+        self._overrides: dict[int, dict[str, Any]] = {}
+        self.blob_path = blob_path
+        self._fin = open(blob_path, 'rb')
+        # mmap refuses empty files
+        self._mm = mmap.mmap(self._fin.fileno(), 0, access=mmap.ACCESS_READ) if data["size"] else b""
+
+    @classmethod
+    def open(cls, repo_name: str) -> 'LazyRecords':
+        return cls(*lazy_paths(repo_name))
+
+    @staticmethod
+    def build(records: list[Record], repo_name: str):
+        meta_path, blob_path = lazy_paths(repo_name)
+        lazy_dir = path.dirname(meta_path)
+        if not path.exists(lazy_dir):
+            mkdir(lazy_dir)
+
+        meta = []
+        # start/end of every blob field, equal texts point at the same bytes
+        spans = array('Q')
+        written: dict[bytes, tuple[int, int]] = {}
+        end = 0
+        with open(blob_path + ".tmp", 'wb') as fout:
+            for r in records:
+                cp = r.commit_pair
+                meta.append((r.repo, *[getattr(cp, f) for f in CP_META_FIELDS],
+                             r.gpt_response is not None, r.attempts, r.ocd_label))
+                for f in BLOB_FIELDS:
+                    if f in PICKLED_FIELDS:
+                        data = pkl.dumps(getattr(r, f), protocol=pkl.HIGHEST_PROTOCOL)
+                    else:
+                        data = getattr(cp, f).encode()
+                    key = blake2b(data, digest_size=16).digest()
+                    if key not in written:
+                        fout.write(data)
+                        written[key] = (end, end + len(data))
+                        end += len(data)
+                    spans.extend(written[key])
+        with open(meta_path + ".tmp", 'wb') as fout:
+            pkl.dump({"meta": meta, "spans": spans, "size": end}, fout, protocol=pkl.HIGHEST_PROTOCOL)
+        replace(blob_path + ".tmp", blob_path)
+        replace(meta_path + ".tmp", meta_path)
+
+    def _blob(self, index: int, field: str):
+        k = 2 * (index * len(BLOB_FIELDS) + BLOB_FIELDS.index(field))
+        data = self._mm[self._spans[k]:self._spans[k + 1]]
+        if field in PICKLED_FIELDS:
+            return pkl.loads(data)
+        return data.decode()
+
+    def has_response(self, index: int) -> bool:
+        overrides = self._overrides.get(index)
+        if overrides and "gpt_response" in overrides:
+            return overrides["gpt_response"] is not None
+        return self._meta[index][META_HAS_RESPONSE]
+
+    def __len__(self):
+        return len(self._meta)
+
+    def __getitem__(self, index: int | slice):
+        if isinstance(index, slice):
+            return [LazyRecord(self, i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("record index out of range")
+        return LazyRecord(self, index)
+
+    def __iter__(self) -> Iterator[LazyRecord]:
+        for i in range(len(self)):
+            yield LazyRecord(self, i)
+
+    def __reduce_ex__(self, protocol):
+        # Pickling the container (e.g. save_records) writes real records.
+        return (list, ([r.materialize() for r in self],))
+
+    def close(self):
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._fin.close()
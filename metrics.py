@@ -0,0 +1,174 @@
+import os
+import re
+import json
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+# Only the standard library, gen-out.py imports this module from the SZZ-2-CPs environment too.
+# Off unless METRICS=1 is set or enable() is called, every call is then a flag check.
+ENABLED = os.getenv("METRICS", "0") not in ("", "0")
+METRICS_DIR = os.getenv("METRICS_DIR", "data/out/metrics")
+PREFIX = "msr_"
+# upper bounds in seconds
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # the last count is for values above every bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other: dict):
+        for i, c in enumerate(other["counts"]):
+            self.counts[i] += c
+        self.sum += other["sum"]
+        self.count += other["count"]
+
+    def to_dict(self) -> dict:
+        return {"buckets": list(self.buckets), "counts": list(self.counts), "sum": self.sum, "count": self.count}
+
+
+_lock = threading.Lock()
+_counters: dict[str, float] = {}
+_histograms: dict[str, Histogram] = {}
+
+
+def enable(on=True):
+    global ENABLED
+    ENABLED = on
+
+
+def inc(name: str, value: float = 1):
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(name: str, value: float, buckets=LATENCY_BUCKETS):
+    if not ENABLED:
+        return
+    with _lock:
+        if name not in _histograms:
+            _histograms[name] = Histogram(buckets)
+        _histograms[name].observe(value)
+
+
+@contextmanager
+def timer(name: str):
+    # observes the seconds spent in the block, also when it raises
+    if not ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+def timed(name: str):
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def snapshot() -> dict:
+    with _lock:
+        return {"counters": dict(_counters), "histograms": {k: v.to_dict() for k, v in _histograms.items()}}
+
+
+def merge(other: dict):
+    # adds a snapshot of another process, e.g. a pool worker
+    with _lock:
+        for k, v in other["counters"].items():
+            _counters[k] = _counters.get(k, 0) + v
+        for k, v in other["histograms"].items():
+            if k not in _histograms:
+                _histograms[k] = Histogram(v["buckets"])
+            _histograms[k].merge(v)
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def _metric_name(name: str) -> str:
+    return PREFIX + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def prometheus_text(data: dict) -> str:
+    lines = []
+    for k, v in sorted(data["counters"].items()):
+        name = _metric_name(k)
+        lines += [f"# TYPE {name} counter", f"{name} {v:g}"]
+    for k, h in sorted(data["histograms"].items()):
+        name = _metric_name(k)
+        lines.append(f"# TYPE {name} histogram")
+        cumulative = 0
+        for le, c in zip([*h["buckets"], "+Inf"], h["counts"]):
+            cumulative += c
+            lines.append(f'{name}_bucket{{le="{le}"}} {cumulative}')
+        lines += [f"{name}_sum {h['sum']:g}", f"{name}_count {h['count']}"]
+    return "\n".join(lines) + "\n"
+
+
+def _write(file_path: str, text: str):
+    # replaced atomically, the textfile collector may read it at any time
+    with open(file_path + ".tmp", "w") as fout:
+        fout.write(text)
+    os.replace(file_path + ".tmp", file_path)
+
+
+def export(run_name: str, directory: str | None = None) -> dict | None:
+    # Writes <run_name>.json and <run_name>.prom, returns the snapshot. Nothing when disabled.
+    if not ENABLED:
+        return None
+    directory = directory or METRICS_DIR
+    os.makedirs(directory, exist_ok=True)
+    data = {"run": run_name, "time": time.time(), **snapshot()}
+    _write(os.path.join(directory, f"{run_name}.json"), json.dumps(data, indent=2))
+    _write(os.path.join(directory, f"{run_name}.prom"), prometheus_text(data))
+    return data
+
+
+def summary(data: dict | None = None) -> str:
+    # one line per metric, histograms as count, mean and an upper bound of the median
+    data = data or snapshot()
+    lines = [f"{k:<40} {v:>14g}" for k, v in sorted(data["counters"].items())]
+    for k, h in sorted(data["histograms"].items()):
+        mean = h["sum"] / h["count"] if h["count"] else 0
+        cumulative, median = 0, "+Inf"
+        for le, c in zip(h["buckets"], h["counts"]):
+            cumulative += c
+            if cumulative * 2 >= h["count"]:
+                median = le
+                break
+        lines.append(f"{k:<40} {h['count']:>14} mean {mean:.4f}s total {h['sum']:.2f}s p50 <= {median}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # python metrics.py data/out/metrics/<run>.json prints a summary of an exported run
+    import sys
+    for p in sys.argv[1:]:
+        with open(p, "r") as fin:
+            print(p)
+            print(summary(json.load(fin)))
@@ -0,0 +1,361 @@
+from enum import Enum
+from typing import TYPE_CHECKING, Callable, Literal
+from pydantic import BaseModel
+from datetime import datetime
+from dataclasses import dataclass
+import threading
+import queue
+import atexit
+import time
+
+if TYPE_CHECKING:
+    from openai.types.chat.chat_completion import ChatCompletion
+
+# a failed partial save is retried after this many seconds, doubling up to the maximum
+FLUSH_RETRY_SECONDS = 1.0
+MAX_FLUSH_RETRY_SECONDS = 60.0
+
+# Data models only, the storage helpers are in utils.py. Nothing here imports the OpenAI SDK,
+# so the analysis and cleaning modules load without it.
+
+RepoName = Literal[
+    'ambari',
+    'ant',
+    'archiva',
+    'aries',
+    'beam',
+    'cassandra',
+    'cocoon',
+    'cxf',
+    'directory-server',
+    'flink',
+    'fop-cs',
+    'geronimo',
+    'hadoop',
+    'ignite',
+    'isis',
+    'jclouds',
+    'jena',
+    'JMETER',
+    'karaf',
+    'lenya',
+    'logging-log4j2',
+    'maven',
+    'mesos',
+    'ofbizApp',
+    'out',
+    'poi',
+    'qpid',
+    'storm',
+    'synapse',
+    'tomcat',
+    'tomee',
+    'usergrid',
+    'wicket',
+    'gt',
+    'vgt'
+]
+
+StorageBackend = Literal["pkl", "sqlite", "zstd"]
+
+
+class CommitPair(BaseModel):
+    old_commit_hash: str
+    new_commit_hash: str
+    old_method_content: str
+    new_method_content: str
+    old_comment: str
+    new_comment: str
+    file_path: str
+    bug_introducing: bool
+    old_commit_date: datetime
+    new_commit_date: datetime
+    id: str
+
+
+class GptResponse(BaseModel):
+    created: int
+    response: str
+    finish_reason: str
+    usage: dict[str, int]
+    id: str
+    model: str
+
+    @classmethod
+    def from_ChatCompletion(cls, openai_res: 'ChatCompletion') -> 'GptResponse':
+        d = {
+            "id": openai_res.id,
+            "response": openai_res.choices[0].message.content,
+            "finish_reason": openai_res.choices[0].finish_reason,
+            "usage": openai_res.usage.model_dump(),
+            "model": openai_res.model,
+            "created": openai_res.created
+        }
+        return cls(**d)
+
+
+class Record(BaseModel):
+    repo: str
+    commit_pair: CommitPair
+
+    gpt_response: GptResponse | None = None
+    prompt: str | None | list = None
+    attempts: int = 0
+    ocd_label: int | None = None
+
+    class Filter:
+        # Iterates over the records to process and checkpoints the completed ones from a
+        # background thread, every partial_save records or partial_seconds seconds.
+        # In a sequential loop a record is completed when the next one is requested,
+        # concurrent producers pass auto_complete=False and call done() themselves.
+        # save writes a batch of completed records, save_records(partial=True) by default.
+        def __init__(self, data: list['Record'], filter: Literal['no_response'] | None = None, partial_save: int = 10, partial_reports: int = 0, report_clb: Callable | None = None, backend: StorageBackend = "pkl",
+                     partial_seconds: float = 60, queue_size: int = 1000, auto_complete=True,
+                     save: Callable[[list['Record']], None] | None = None):
+            self.data = data
+            self.backend = backend
+            self.save = save
+            if filter == 'no_response' and hasattr(data, "has_response"):
+                # Lazy records can answer this without loading the responses
+                self.filtered_indices = [i for i in range(
+                    len(data)) if not data.has_response(i)]
+            elif filter == 'no_response':
+                self.filtered_indices = [i for i, r in enumerate(
+                    data) if r.gpt_response is None]
+            else:
+                self.filtered_indices = range(len(data))
+
+            self.iter = iter(self.filtered_indices)
+            self.partial_save = partial_save
+            self.partial_seconds = partial_seconds
+            self.send_reports = partial_reports
+            self.count = 0
+            self.report_clb = report_clb
+            self.auto_complete = auto_complete
+            self.saved = 0
+            self._current: Record | None = None
+            self._closed = False
+            self._error: BaseException | None = None
+            self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+            # started by the first completed record, a filter that is only iterated or counted has none
+            self._writer: threading.Thread | None = None
+            self._writer_lock = threading.Lock()
+
+        def __iter__(self):
+            return self
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, exc_type, *args):
+            # the record of the last iteration is completed unless the block raised
+            self.close(completed=exc_type is None)
+
+        def __next__(self):
+            if self.auto_complete and self._current is not None:
+                self.done(self._current)
+                self._current = None
+            try:
+                i = next(self.iter)
+            except StopIteration:
+                # with done() the records may still be in flight, the caller closes
+                if self.auto_complete:
+                    self.close()
+                raise
+
+            if self.report_clb and self.send_reports > 0 and self.count % self.send_reports == 0:
+                self.report_clb(self.count, len(self.filtered_indices))
+
+            self.count += 1
+
+            record = self.data[i]
+            if self.auto_complete:
+                self._current = record
+            return record
+
+        def __len__(self):
+            return len(self.filtered_indices)
+
+        def done(self, record: 'Record'):
+            # Thread-safe. Blocks when the writer is queue_size records behind.
+            if self._error:
+                raise self._error
+            if self._closed:
+                raise ValueError("done() called on a closed filter")
+            self._start_writer()
+            self._queue.put(record)
+
+        def _start_writer(self):
+            with self._writer_lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write_loop, daemon=True)
+                    self._writer.start()
+                    # the writer is a daemon, make sure pending records are written on exit
+                    atexit.register(self.close)
+
+        def close(self, completed=False):
+            # Writes every completed record and stops the writer, then raises the last save error.
+            # The record of the current iteration is written only when completed, e.g. by __exit__
+            # after a loop left with break, an exception may have interrupted it. Safe to call twice.
+            if self._closed:
+                return
+            if completed and self.auto_complete and self._current is not None:
+                self._start_writer()
+                # not through done(), which raises when a save failed
+                self._queue.put(self._current)
+            self._current = None
+            self._closed = True
+            if self._writer is None:
+                return
+            self._queue.put(_STOP_WRITER)
+            self._writer.join()
+            atexit.unregister(self.close)
+            if self._error:
+                raise self._error
+
+        def _flush(self, buffer: list['Record']):
+            from utils import save_records
+            print("Saving partial result")
+            if self.save is not None:
+                self.save(buffer)
+            else:
+                save_records(buffer, partial=True, backend=self.backend)
+            self.saved += len(buffer)
+
+        def _write_loop(self):
+            buffer: list[Record] = []
+            deadline = 0.0
+            # after a failed save the next one waits until retry_at
+            retry_at = 0.0
+            retry_seconds = FLUSH_RETRY_SECONDS
+            while True:
+                timeout = None
+                if buffer:
+                    due = retry_at if len(buffer) >= self.partial_save else max(deadline, retry_at)
+                    timeout = max(0.0, due - time.monotonic())
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+                try:
+                    if item is _STOP_WRITER:
+                        if buffer:
+                            self._flush(buffer)
+                        return
+                    if item is not None:
+                        if not buffer:
+                            deadline = time.monotonic() + self.partial_seconds
+                        buffer.append(item)
+                    now = time.monotonic()
+                    if buffer and now >= retry_at and (len(buffer) >= self.partial_save or now >= deadline):
+                        self._flush(buffer)
+                        buffer = []
+                        self._error = None
+                        retry_seconds = FLUSH_RETRY_SECONDS
+                except BaseException as e:
+                    # reported to the producers, the records stay in the buffer for the next try
+                    self._error = e
+                    if item is _STOP_WRITER:
+                        return
+                    retry_at = time.monotonic() + retry_seconds
+                    retry_seconds = min(2 * retry_seconds, MAX_FLUSH_RETRY_SECONDS)
+
+
+# Tells the Filter writer thread to flush and stop.
+_STOP_WRITER = object()
+
+
+class RecordStatus(Enum):
+    PAST_OUTDATED = "past outdated"
+    OUTDATED = "outdated"
+    NORMAL = "normal"
+    UNCATEGORIZED = "uncategorized"
+
+
+@dataclass
+class RecordResult:
+    old2new: bool
+    new2new: bool
+
+
+# ParsedRecord.status_code is an index into this list
+STATUSES = list(RecordStatus)
+PAST_OUTDATED, OUTDATED, NORMAL, UNCATEGORIZED = range(len(STATUSES))
+
+
+def classify_status(comment_changed: bool, result: RecordResult) -> int:
+    if comment_changed and result.old2new is False and result.new2new is False:
+        return PAST_OUTDATED
+    elif result.old2new is True and result.new2new is False:
+        return OUTDATED
+    elif (result.old2new is True and result.new2new is True) or (result.old2new is False and result.new2new is True):
+        return NORMAL
+
+    return UNCATEGORIZED
+
+
+@dataclass
+class ParsedRecord:
+    record: Record
+    result: RecordResult
+    # computed once when parsing, the comments are not compared again
+    status_code: int | None = None
+
+    def __post_init__(self):
+        if self.status_code is None:
+            self.status_code = self._classify()
+
+    def __setstate__(self, state: dict):
+        # pickles from before status_code was stored
+        self.__dict__.update(state)
+        if self.__dict__.get("status_code") is None:
+            self.status_code = self._classify()
+
+    def _classify(self) -> int:
+        cp = self.record.commit_pair
+        return classify_status(cp.old_comment != cp.new_comment, self.result)
+
+    @property
+    def status(self) -> RecordStatus:
+        return STATUSES[self.status_code]
+
+
+@dataclass
+class StatusIndex:
+    # Positions of the parsed records of a repo by status and by new commit hash,
+    # each in order of appearance. Kept next to the cleaned records.
+    by_status: dict[int, list[int]]
+    by_commit: dict[str, list[int]]
+    # per position
+    status_codes: list[int]
+    bug_introducing: list[bool]
+
+    @classmethod
+    def build(cls, parsed_records: list[ParsedRecord]) -> 'StatusIndex':
+        index = cls({code: [] for code in range(len(STATUSES))}, {}, [], [])
+        for r in parsed_records:
+            index.add(r)
+        return index
+
+    def add(self, parsed_record: ParsedRecord):
+        position = len(self)
+        cp = parsed_record.record.commit_pair
+        self.by_status[parsed_record.status_code].append(position)
+        self.by_commit.setdefault(cp.new_commit_hash, []).append(position)
+        self.status_codes.append(parsed_record.status_code)
+        self.bug_introducing.append(cp.bug_introducing)
+
+    def __len__(self):
+        return len(self.status_codes)
+
+    def commit_dicts(self) -> tuple[dict[str, dict[RecordStatus, list[int]]], dict[str, dict[RecordStatus, list[int]]]]:
+        # bug introducing and non bug introducing commit -> status -> positions
+        bi_commit_dict, nbi_commit_dict = {}, {}
+        for commit, positions in self.by_commit.items():
+            for i in positions:
+                report = bi_commit_dict if self.bug_introducing[i] else nbi_commit_dict
+                report.setdefault(commit, {}).setdefault(STATUSES[self.status_codes[i]], []).append(i)
+        return bi_commit_dict, nbi_commit_dict
+
+
+GptMessage = list
@@ -0,0 +1,241 @@
+import re
+import json
+import zlib
+import argparse
+from dataclasses import dataclass
+from difflib import SequenceMatcher
+from os import path, makedirs
+import numpy as np
+import metrics
+from models import CommitPair, Record, RepoName
+from utils import DATA_PATH, OUTPUTS_DIR, load_gt_answers, load_records
+
+# Groups commit pairs whose comments and code changes are nearly the same, e.g. one method at
+# neighbouring commits of a window, so that one request answers the whole group. Records are
+# compared by MinHash signatures of their shingles, candidates are found with LSH bands.
+
+CLUSTERS_DIR = "clusters"
+# estimated Jaccard similarity a record needs to its cluster's representative, for the comments
+# and for the changed lines each, so that a long Javadoc does not hide an unrelated code change
+SIMILARITY = 0.9
+PARTS = ("comment", "diff")
+NUM_PERM = 128
+# tokens per shingle
+SHINGLE = 3
+# the bands are chosen so that a pair at SIMILARITY is missed with at most this probability
+MISS_PROBABILITY = 0.01
+SEED = 0
+# a prime above 2**32, a * h + b of 32 bit values stays below 2**64
+_PRIME = (1 << 32) + 15
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+
+def _shingles(tag: str, text: str) -> set[int]:
+    tokens = _TOKEN.findall(text)
+    grams = [tokens[i:i + SHINGLE] for i in range(max(1, len(tokens) - SHINGLE + 1))] if tokens else []
+    return {zlib.crc32(f"{tag}\0{' '.join(g)}".encode()) for g in grams}
+
+
+def changed_lines(old: str, new: str) -> tuple[list[str], list[str]]:
+    # removed and added lines, ignoring indentation
+    old_lines = [x.strip() for x in old.splitlines()]
+    new_lines = [x.strip() for x in new.splitlines()]
+    removed, added = [], []
+    for op, i1, i2, j1, j2 in SequenceMatcher(None, old_lines, new_lines, autojunk=False).get_opcodes():
+        if op != "equal":
+            removed += old_lines[i1:i2]
+            added += new_lines[j1:j2]
+    return removed, added
+
+
+def features(cp: CommitPair) -> tuple[set[int], set[int]]:
+    # shingles of both comments, and of the lines the commit removed and added
+    removed, added = changed_lines(cp.old_method_content, cp.new_method_content)
+    return (_shingles("old_comment", cp.old_comment) | _shingles("new_comment", cp.new_comment),
+            _shingles("removed", "\n".join(removed)) | _shingles("added", "\n".join(added)))
+
+
+def signatures(commit_pairs: list[CommitPair], num_perm: int = NUM_PERM, seed: int = SEED) -> tuple[np.ndarray, np.ndarray]:
+    # (records, 2, num_perm) MinHash signatures of the comment and of the diff, and a mask of the
+    # records that have any shingle. An empty part gets _PRIME everywhere, a value no hash takes,
+    # so it only matches another empty part.
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 32, num_perm, dtype=np.uint64)
+    b = rng.integers(0, 1 << 32, num_perm, dtype=np.uint64)
+    result = np.full((len(commit_pairs), len(PARTS), num_perm), _PRIME, dtype=np.uint64)
+    valid = np.zeros(len(commit_pairs), dtype=bool)
+    for i, cp in enumerate(commit_pairs):
+        for part, shingles in enumerate(features(cp)):
+            if not shingles:
+                continue
+            h = np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+            result[i, part] = ((np.outer(h, a) + b) % _PRIME).min(axis=0)
+            valid[i] = True
+    return result, valid
+
+
+def band_rows(similarity: float, num_perm: int = NUM_PERM) -> int:
+    # The most rows per band, i.e. the fewest candidates, that still find a pair at the similarity
+    # with probability 1 - MISS_PROBABILITY
+    best = 1
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows == 0 and 1 - (1 - similarity ** rows) ** (num_perm // rows) >= 1 - MISS_PROBABILITY:
+            best = rows
+    return best
+
+
+@dataclass
+class Clustering:
+    similarity: float
+    ids: list[str]
+    # per record, the position of its representative, itself for a representative
+    representative: list[int]
+    # per record, estimated similarity to its representative, the lower of the comment and diff ones
+    similarities: list[float]
+
+    def representatives(self) -> list[int]:
+        return [i for i, rep in enumerate(self.representative) if rep == i]
+
+    def clusters(self) -> dict[int, list[int]]:
+        # representative -> positions, the representative first
+        clusters: dict[int, list[int]] = {}
+        for i, rep in enumerate(self.representative):
+            clusters.setdefault(rep, []).append(i)
+        return clusters
+
+
+def cluster_records(records: list[Record], similarity: float = SIMILARITY, num_perm: int = NUM_PERM,
+                    seed: int = SEED) -> Clustering:
+    # Records are taken in order. A record joins the most similar representative at the similarity
+    # or above and becomes a new representative otherwise, so every member is close to the record
+    # that is sent for it, not only to another member. Pairs with and without a comment change
+    # are never grouped.
+    if not 0 < similarity <= 1:
+        raise ValueError("similarity must be in (0, 1]")
+    commit_pairs = [r.commit_pair for r in records]
+    sigs, valid = signatures(commit_pairs, num_perm, seed)
+    rows = band_rows(similarity, num_perm)
+    buckets: dict[tuple, list[int]] = {}
+    representative = list(range(len(records)))
+    similarities = [1.0] * len(records)
+    for i, cp in enumerate(commit_pairs):
+        if not valid[i]:
+            continue
+        changed = cp.old_comment != cp.new_comment
+        keys = [(part, band, changed, sigs[i, part, band * rows:(band + 1) * rows].tobytes())
+                for part in range(len(PARTS)) for band in range(num_perm // rows)]
+        candidates = sorted({c for k in keys for c in buckets.get(k, ())})
+        if candidates:
+            # the lower of the comment and diff similarities
+            estimated = (sigs[candidates] == sigs[i]).mean(axis=2).min(axis=1)
+            best = int(estimated.argmax())
+            if estimated[best] >= similarity:
+                representative[i] = candidates[best]
+                similarities[i] = float(estimated[best])
+                continue
+        for k in keys:
+            buckets.setdefault(k, []).append(i)
+    metrics.inc("near_duplicate_records", len(records))
+    metrics.inc("near_duplicate_skipped", len(records) - len(set(representative)))
+    return Clustering(similarity, [cp.id for cp in commit_pairs], representative, similarities)
+
+
+def propagate(records: list[Record], clustering: Clustering) -> int:
+    # Copies the response of every representative to the members without one, returns their count
+    count = 0
+    for i, rep in enumerate(clustering.representative):
+        if rep != i and records[i].gpt_response is None and records[rep].gpt_response is not None:
+            records[i].gpt_response = records[rep].gpt_response.model_copy()
+            count += 1
+    metrics.inc("near_duplicate_propagated", count)
+    return count
+
+
+def clustering_path(repo_name: str) -> str:
+    return path.join(DATA_PATH, OUTPUTS_DIR, CLUSTERS_DIR, f"{repo_name}.json")
+
+
+def save_clustering(clustering: Clustering, repo_name: RepoName) -> str:
+    # member id -> representative id, the answers of these members were not asked for
+    makedirs(path.join(DATA_PATH, OUTPUTS_DIR, CLUSTERS_DIR), exist_ok=True)
+    ids = clustering.ids
+    with open(clustering_path(repo_name), 'w') as fout:
+        json.dump({"similarity": clustering.similarity,
+                   "representative": {ids[i]: ids[rep] for i, rep in enumerate(clustering.representative) if rep != i}},
+                  fout, indent=2)
+    return clustering_path(repo_name)
+
+
+def cluster_stats(clustering: Clustering) -> dict:
+    sizes = [len(x) for x in clustering.clusters().values()]
+    members = [s for i, s in enumerate(clustering.similarities) if clustering.representative[i] != i]
+    return {"records": len(clustering.ids), "clusters": len(sizes), "singletons": sizes.count(1),
+            "largest": max(sizes, default=0), "saved": len(clustering.ids) - len(sizes),
+            "mean_similarity": sum(members) / len(members) if members else None}
+
+
+def agreement(records: list[Record], clustering: Clustering, gt: dict[str, bool]) -> dict:
+    # Members whose ground truth label equals their representative's, over the members where both
+    # are labelled. The same for the model's answers when both records were asked, a propagated
+    # response has the id of the representative's.
+    from cleaning import ParseError, parse_response
+    answers = {}
+    for i, r in enumerate(records):
+        if r.gpt_response is None:
+            continue
+        try:
+            answers[i] = parse_response(r.gpt_response.response)[0]
+        except ParseError:
+            continue
+    gt_pairs = gt_agree = answer_pairs = answer_agree = 0
+    for i, rep in enumerate(clustering.representative):
+        if rep == i:
+            continue
+        member_id, rep_id = clustering.ids[i], clustering.ids[rep]
+        if member_id in gt and rep_id in gt:
+            gt_pairs += 1
+            gt_agree += gt[member_id] == gt[rep_id]
+        if i in answers and rep in answers and records[i].gpt_response.id != records[rep].gpt_response.id:
+            answer_pairs += 1
+            answer_agree += answers[i] == answers[rep]
+    return {"gt_pairs": gt_pairs, "gt_agree": gt_agree, "answer_pairs": answer_pairs, "answer_agree": answer_agree}
+
+
+def _percent(part: int, total: int) -> str:
+    return f"{100 * part / total:.1f}" if total else "-"
+
+
+def print_stats(rows: list[tuple[float, dict, dict | None]]):
+    header = (f"| {'Similarity':^10} | {'Records':^8} | {'Clusters':^8} | {'Largest':^7} | {'Saved %':^7} | "
+              f"{'GT pairs':^8} | {'GT agree %':^10} | {'Answer pairs':^12} | {'Answer agree %':^14} |")
+    print(header)
+    print("-" * len(header))
+    for similarity, stats, agree in rows:
+        agree = agree or {"gt_pairs": 0, "gt_agree": 0, "answer_pairs": 0, "answer_agree": 0}
+        print(f"| {similarity:^10} | {stats['records']:^8} | {stats['clusters']:^8} | {stats['largest']:^7} | "
+              f"{_percent(stats['saved'], stats['records']):^7} | {agree['gt_pairs']:^8} | "
+              f"{_percent(agree['gt_agree'], agree['gt_pairs']):^10} | {agree['answer_pairs']:^12} | "
+              f"{_percent(agree['answer_agree'], agree['answer_pairs']):^14} |")
+
+
+if __name__ == "__main__":
+    # python near_duplicates.py vgt --similarity 0.95 0.9 0.8
+    parser = argparse.ArgumentParser(description="Clusters near-duplicate records and checks that the members of a "
+                                                 "cluster share the ground truth label and answer of its representative.")
+    parser.add_argument("repo")
+    parser.add_argument("--similarity", type=float, nargs="+", default=[SIMILARITY])
+    parser.add_argument("--backend", choices=["pkl", "sqlite", "zstd"], default="pkl")
+    parser.add_argument("--all-gt", action="store_true", help="use every ground truth label, not only the verified ones")
+    args = parser.parse_args()
+
+    records = load_records(args.repo, allow_partial=True, backend=args.backend)
+    try:
+        gt = load_gt_answers(vgt_only=not args.all_gt)
+    except FileNotFoundError:
+        print("no ground truth labels found, only the answers are compared")
+        gt = {}
+    rows = []
+    for similarity in args.similarity:
+        clustering = cluster_records(records, similarity)
+        rows.append((similarity, cluster_stats(clustering), agreement(records, clustering, gt)))
+    print_stats(rows)
@@ -0,0 +1,282 @@
+import re
+import json
+import argparse
+from hashlib import blake2b
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import partial
+from os import path, listdir, makedirs, replace
+from shutil import rmtree
+from typing import Callable
+import metrics
+from utils import (Record, RepoName, StorageBackend, DATA_PATH, INPUTS_DIR, OUTPUTS_DIR, RECORDS_DB,
+                   load_partial_segments, load_records, records_path, save_partial_segment, write_records)
+
+# gen-out → convert → infer → clean → analyze, every stage reads the outputs of the one before it
+STAGES = ["gen-out", "convert", "infer", "clean", "analyze"]
+SZZ_DIR = "SZZ-2-CPs"
+DAG_DIR = "dag"
+INFER_DIR = "infer"
+ANALYSIS_DIR = "analysis"
+# Source files of every stage, editing one reruns the stage and, if its outputs change, the ones after it.
+STAGE_CODE = {
+    "gen-out": [path.join(SZZ_DIR, "gen-out.py"), path.join(SZZ_DIR, "java_scanner.py")],
+    "convert": ["ingest.py", "string_pool.py", "utils.py", "models.py"],
+    "infer": ["gpt_api.py", "near_duplicates.py", "utils.py", "models.py"],
+    "clean": ["cleaning.py"],
+    "analyze": ["analytics.py"],
+}
+# Parameters that are part of the key of every stage
+STAGE_PARAMS = {
+    "gen-out": ["window"],
+    "convert": ["backend"],
+    "infer": ["backend", "model", "system_message", "similarity"],
+    "clean": ["backend"],
+    "analyze": ["windows"],
+}
+DEFAULT_PARAMS = {"window": 14, "backend": "pkl", "model": None, "system_message": None, "similarity": None,
+                  "windows": list(range(1, 15))}
+HASH_CHUNK = 1 << 20
+
+
+def file_digest(paths: list[str]) -> str:
+    h = blake2b(digest_size=16)
+    for p in sorted(paths):
+        h.update(p.encode())
+        with open(p, "rb") as fin:
+            while chunk := fin.read(HASH_CHUNK):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+def stage_key(stage: str, inputs_hash: str, params: dict) -> str:
+    code = file_digest([path.join(path.dirname(__file__), x) for x in STAGE_CODE[stage]])
+    key = json.dumps({"stage": stage, "code": code, "inputs": inputs_hash,
+                      "params": {k: params[k] for k in STAGE_PARAMS[stage]}}, sort_keys=True)
+    return blake2b(key.encode(), digest_size=16).hexdigest()
+
+
+@dataclass
+class RepoTask:
+    repo: RepoName
+    # None when the DAG starts from data/in/<repo>.json
+    szz_file: str | None
+    params: dict
+    # stage -> key of the current run, set by run_repo
+    keys: dict[str, str] = field(default_factory=dict)
+
+
+def run_gen_out(task: RepoTask, inputs: list[str]) -> list[str]:
+    from pipeline import load_gen_out
+    return [load_gen_out().run(task.szz_file, base=SZZ_DIR, window=task.params["window"])]
+
+
+def run_convert(task: RepoTask, inputs: list[str]) -> list[str]:
+    from ingest import ingest
+    backend = task.params["backend"]
+    ingest(task.repo, save_as=backend, keep_records=False, file_path=inputs[0])
+    return [path.join(DATA_PATH, OUTPUTS_DIR, RECORDS_DB) if backend == "sqlite" else records_path(task.repo, backend)]
+
+
+def infer_backend(backend: StorageBackend) -> StorageBackend:
+    # infer writes a file of its own, zstd stays zstd and the other backends become a pickle
+    return "zstd" if backend == "zstd" else "pkl"
+
+
+def infer_path(repo_name: RepoName, key: str, backend: StorageBackend) -> str:
+    suffix = "zrec" if infer_backend(backend) == "zstd" else "pkl"
+    return path.join(DATA_PATH, OUTPUTS_DIR, INFER_DIR, f"{repo_name}-{key}.{suffix}")
+
+
+def infer_partial_dir(repo_name: RepoName, key: str) -> str:
+    return path.join(DATA_PATH, OUTPUTS_DIR, INFER_DIR, f"{repo_name}-{key}.partial")
+
+
+def run_infer(task: RepoTask, inputs: list[str]) -> list[str]:
+    # Starts from convert's records, which are only read, and writes the answered ones to a file
+    # named after the stage key. Answers are checkpointed in a partial directory of the key, not
+    # in data/out/partial/<repo> of chat-gpt-api.py. Only an interrupted run with the same key
+    # resumes from it, the partial saves of other keys are removed and their responses cleared.
+    from gpt_api import answer_record, ask_gpt
+    backend = task.params["backend"]
+    key = task.keys["infer"]
+    infer_dir = path.join(DATA_PATH, OUTPUTS_DIR, INFER_DIR)
+    makedirs(infer_dir, exist_ok=True)
+    partial_dir = infer_partial_dir(task.repo, key)
+    for x in listdir(infer_dir):
+        if re.fullmatch(rf"{re.escape(task.repo)}-[0-9a-f]{{32}}\.partial", x) and path.join(infer_dir, x) != partial_dir:
+            rmtree(path.join(infer_dir, x))
+    answered = {r.commit_pair.id: r for r in load_partial_segments(partial_dir)}
+    records = load_records(task.repo, allow_partial=False, backend=backend)
+    for i, r in enumerate(records):
+        if r.commit_pair.id in answered:
+            records[i] = answered[r.commit_pair.id]
+        else:
+            r.gpt_response, r.prompt, r.attempts = None, None, 0
+
+    ask = partial(ask_gpt, model=task.params["model"], system_message=task.params["system_message"])
+    to_send = records
+    if task.params["similarity"] is not None:
+        # only one record per near-duplicate cluster is asked, the others get its answer
+        from near_duplicates import cluster_records, propagate, save_clustering
+        clustering = cluster_records(records, task.params["similarity"])
+        save_clustering(clustering, task.repo)
+        to_send = [records[i] for i in clustering.representatives()]
+    with Record.Filter(to_send, filter="no_response", partial_save=10,
+                       save=partial(save_partial_segment, partial_dir=partial_dir, name=task.repo)) as checkpoint:
+        for r in checkpoint:
+            if not answer_record(r, ask):
+                print(task.repo, r.commit_pair.id, "FAILED :(")
+    if task.params["similarity"] is not None:
+        propagate(records, clustering)
+
+    out_path = infer_path(task.repo, key, backend)
+    write_records(records, out_path + ".tmp", infer_backend(backend))
+    replace(out_path + ".tmp", out_path)
+    rmtree(partial_dir, ignore_errors=True)
+    return [out_path]
+
+
+def run_clean(task: RepoTask, inputs: list[str]) -> list[str]:
+    from cleaning import clean_repo, print_reports, schema_paths
+    report = clean_repo(task.repo, backend=infer_backend(task.params["backend"]), records_path=inputs[0])
+    print_reports([report])
+    return schema_paths(task.repo, report.schema)
+
+
+def run_analyze(task: RepoTask, inputs: list[str]) -> list[str]:
+    from analytics import STATUS_NAMES, WindowIndex, load_columns, status_table
+    from cleaning import cleaned_path
+    if cleaned_path(task.repo) not in inputs:
+        # clean found consistency answers, the status tables need old2new ones
+        print(f"{task.repo}: no cleaned old2new records, nothing to analyze")
+        return []
+    cols = load_columns(task.repo)
+    windows = task.params["windows"]
+    report = {"status": dict(zip(STATUS_NAMES, status_table(cols).tolist())),
+              "windows": windows,
+              # (windows, statuses, [BI, NBI])
+              "window_counts": WindowIndex.from_columns(cols).counts(windows).tolist()}
+    out_dir = path.join(DATA_PATH, OUTPUTS_DIR, ANALYSIS_DIR)
+    makedirs(out_dir, exist_ok=True)
+    out_path = path.join(out_dir, f"{task.repo}.json")
+    with open(out_path, "w") as fout:
+        json.dump(report, fout)
+    return [out_path]
+
+
+STAGE_FUNCS: dict[str, Callable[[RepoTask, list[str]], list[str]]] = {
+    "gen-out": run_gen_out, "convert": run_convert, "infer": run_infer, "clean": run_clean, "analyze": run_analyze}
+
+
+def manifest_path(repo_name: RepoName) -> str:
+    return path.join(DATA_PATH, OUTPUTS_DIR, DAG_DIR, f"{repo_name}.json")
+
+
+def load_manifest(repo_name: RepoName) -> dict:
+    if not path.exists(manifest_path(repo_name)):
+        return {}
+    with open(manifest_path(repo_name), "r") as fin:
+        return json.load(fin)
+
+
+def save_manifest(repo_name: RepoName, manifest: dict):
+    makedirs(path.dirname(manifest_path(repo_name)), exist_ok=True)
+    with open(manifest_path(repo_name) + ".tmp", "w") as fout:
+        json.dump(manifest, fout, indent=2)
+    replace(manifest_path(repo_name) + ".tmp", manifest_path(repo_name))
+
+
+def run_repo(task: RepoTask, until: str = STAGES[-1], force: tuple[str, ...] = ()) -> dict[str, str]:
+    # Runs the stages in order and skips every stage whose key (code, parameters and the hash of
+    # its inputs) matches the last run and whose outputs still exist. Returns stage -> ran/cached.
+    manifest = load_manifest(task.repo)
+    if task.szz_file is not None:
+        stages = STAGES[:STAGES.index(until) + 1]
+        inputs = [task.szz_file]
+    else:
+        stages = STAGES[1:STAGES.index(until) + 1]
+        inputs = [path.join(DATA_PATH, INPUTS_DIR, f"{task.repo}.json")]
+    inputs_hash = file_digest(inputs)
+
+    result = {}
+    for stage in stages:
+        key = stage_key(stage, inputs_hash, task.params)
+        task.keys[stage] = key
+        entry = manifest.get(stage)
+        if stage not in force and entry and entry["key"] == key and all(path.exists(x) for x in entry["outputs"]):
+            result[stage] = "cached"
+        else:
+            print(f"{task.repo}: running {stage}", flush=True)
+            with metrics.timer(f"stage_{stage}_seconds"):
+                outputs = STAGE_FUNCS[stage](task, inputs)
+            # the hash of the outputs is recorded now, stages after this one may modify the files
+            entry = {"key": key, "outputs": outputs, "outputs_hash": file_digest(outputs),
+                     "finished": str(datetime.now())}
+            manifest[stage] = entry
+            save_manifest(task.repo, manifest)
+            result[stage] = "ran"
+        inputs, inputs_hash = entry["outputs"], entry["outputs_hash"]
+    metrics.export(f"orchestrate-{task.repo}")
+    return result
+
+
+def repo_task(arg: str, params: dict) -> RepoTask:
+    # an SZZ output (SZZ-2-CPs/szz-in/<n>.json) starts from gen-out, a repo name from data/in/<repo>.json
+    if arg.endswith(".json"):
+        with open(arg, "r") as fin:
+            return RepoTask(json.load(fin)[0]["repo_name"], arg, params)
+    return RepoTask(arg, None, params)
+
+
+def resolve_params(params: dict) -> dict:
+    # The model and prompt default to the ones of gpt_api.py, they are part of the infer key.
+    if params["model"] is None or params["system_message"] is None:
+        import gpt_api
+        params = {**params, "model": params["model"] or gpt_api.MODEL,
+                  "system_message": params["system_message"] or gpt_api.IMPROVED_SYSTEM_MESSAGE}
+    return params
+
+
+def run_all(tasks: list[RepoTask], until: str = STAGES[-1], force: tuple[str, ...] = (),
+            max_workers: int | None = None) -> dict[str, dict[str, str]]:
+    # Repos are independent, each runs its stages in its own process.
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(run_repo, tasks, [until] * len(tasks), [force] * len(tasks))
+        return {t.repo: r for t, r in zip(tasks, results)}
+
+
+def print_results(results: dict[str, dict[str, str]]):
+    header = f"| {'Repo':^15} | " + " | ".join(f"{s:^8}" for s in STAGES) + " |"
+    print(header)
+    print("-" * len(header))
+    for repo, stages in results.items():
+        print(f"| {repo:^15} | " + " | ".join(f"{stages.get(s, ''):^8}" for s in STAGES) + " |")
+
+
+if __name__ == "__main__":
+    # python orchestrate.py SZZ-2-CPs/szz-in/3.json storm cxf --until clean
+    parser = argparse.ArgumentParser(description="Runs gen-out → convert → infer → clean → analyze per repo, "
+                                                 "skipping stages whose inputs, code and parameters did not change.")
+    parser.add_argument("repos", nargs="+", help="SZZ output files or repo names with data/in/<repo>.json")
+    parser.add_argument("--until", choices=STAGES, default=STAGES[-1])
+    parser.add_argument("--force", choices=STAGES, nargs="*", default=[])
+    parser.add_argument("--window", type=int, default=DEFAULT_PARAMS["window"])
+    parser.add_argument("--backend", choices=["pkl", "sqlite", "zstd"], default=DEFAULT_PARAMS["backend"])
+    parser.add_argument("--model", default=DEFAULT_PARAMS["model"])
+    parser.add_argument("--system-message-file", default=None)
+    parser.add_argument("--similarity", type=float, default=DEFAULT_PARAMS["similarity"],
+                        help="ask once per cluster of near-duplicate records at this similarity")
+    parser.add_argument("--windows", type=int, nargs="+", default=DEFAULT_PARAMS["windows"])
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    params = {**DEFAULT_PARAMS, "window": args.window, "backend": args.backend, "model": args.model,
+              "similarity": args.similarity, "windows": args.windows}
+    if args.system_message_file:
+        with open(args.system_message_file, "r") as fin:
+            params["system_message"] = fin.read()
+    if STAGES.index(args.until) >= STAGES.index("infer"):
+        params = resolve_params(params)
+    print_results(run_all([repo_task(x, params) for x in args.repos], args.until, tuple(args.force), args.workers))
@@ -0,0 +1,263 @@
+import sys
+import time
+import queue
+import logging
+import threading
+import importlib.util
+from dataclasses import dataclass, field, asdict
+from functools import partial
+from os import path
+from shutil import rmtree
+from typing import Callable, Iterable, Iterator
+import metrics
+from utils import (CommitPair, Record, RepoName, StorageBackend, DATA_PATH, OUTPUTS_DIR, load_partial_segments,
+                   save_partial_segment, save_records)
+
+SZZ_DIR = "SZZ-2-CPs"
+QUEUE_SIZE = 256
+REPORT_SECONDS = 30
+WINDOW = 14
+INFERENCE_WORKERS = 8
+PIPELINE_DIR = "pipeline"
+
+# end of stream, every worker of a stage passes it on to its siblings
+_DONE = object()
+
+
+@dataclass
+class StageMetrics:
+    name: str
+    workers: int
+    items_in: int = 0
+    items_out: int = 0
+    errors: int = 0
+    # seconds summed over the workers
+    busy: float = 0.0
+    # waiting on a full output queue: a later stage is slower
+    blocked: float = 0.0
+    # waiting on an empty input queue: an earlier stage is slower
+    starved: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, **values):
+        with self._lock:
+            for k, v in values.items():
+                setattr(self, k, getattr(self, k) + v)
+
+
+class Pipeline:
+    # Stages are connected by bounded queues. A stage that falls behind fills its input queue and
+    # the stages before it block on put, so memory stays bounded and the busy/blocked/starved
+    # times show which stage is the bottleneck.
+    def __init__(self, source: Iterable, queue_size: int = QUEUE_SIZE):
+        self.source = source
+        self.queue_size = queue_size
+        self.stages: list[tuple[StageMetrics, Callable[[object], Iterable]]] = []
+        self.source_metrics = StageMetrics("source", 1)
+        self.sink_metrics = StageMetrics("sink", 1)
+        self.started = None
+
+    def stage(self, name: str, fn: Callable[[object], Iterable], workers: int = 1) -> 'Pipeline':
+        # fn returns the outputs of one item, none to drop it
+        self.stages.append((StageMetrics(name, workers), fn))
+        return self
+
+    @property
+    def metrics(self) -> list[StageMetrics]:
+        return [self.source_metrics, *(m for m, _ in self.stages), self.sink_metrics]
+
+    def _put(self, q: queue.Queue, item) -> float:
+        start = time.perf_counter()
+        q.put(item)
+        return time.perf_counter() - start
+
+    def _feed(self, out: queue.Queue):
+        try:
+            for item in self.source:
+                self.source_metrics.add(items_out=1, blocked=self._put(out, item))
+        except Exception:
+            self.source_metrics.add(errors=1)
+            logging.exception("pipeline source failed")
+        out.put(_DONE)
+
+    def _work(self, fn: Callable, stage_metrics: StageMetrics, inq: queue.Queue, outq: queue.Queue, remaining: list[int]):
+        while True:
+            start = time.perf_counter()
+            item = inq.get()
+            stage_metrics.add(starved=time.perf_counter() - start)
+            if item is _DONE:
+                inq.put(_DONE)
+                with stage_metrics._lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last:
+                    outq.put(_DONE)
+                return
+
+            start = time.perf_counter()
+            try:
+                outputs = list(fn(item))
+                errors = 0
+            except Exception:
+                logging.exception(f"pipeline stage {stage_metrics.name} failed")
+                outputs, errors = [], 1
+            busy = time.perf_counter() - start
+            blocked = sum(self._put(outq, x) for x in outputs)
+            stage_metrics.add(items_in=1, items_out=len(outputs), errors=errors, busy=busy, blocked=blocked)
+
+    def run(self, sink: Callable[[object], None], report_seconds: float = REPORT_SECONDS) -> list[StageMetrics]:
+        # The sink runs in the calling thread.
+        queues = [queue.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = [threading.Thread(target=self._feed, args=(queues[0],), daemon=True)]
+        for i, (stage_metrics, fn) in enumerate(self.stages):
+            remaining = [stage_metrics.workers]
+            threads += [threading.Thread(target=self._work, args=(fn, stage_metrics, queues[i], queues[i + 1], remaining),
+                                         daemon=True) for _ in range(stage_metrics.workers)]
+        self.started = time.perf_counter()
+        for t in threads:
+            t.start()
+
+        last_report = time.perf_counter()
+        while True:
+            start = time.perf_counter()
+            try:
+                item = queues[-1].get(timeout=report_seconds)
+            except queue.Empty:
+                item = None
+            self.sink_metrics.add(starved=time.perf_counter() - start)
+            if item is _DONE:
+                break
+            if item is not None:
+                start = time.perf_counter()
+                sink(item)
+                self.sink_metrics.add(items_in=1, items_out=1, busy=time.perf_counter() - start)
+            if time.perf_counter() - last_report >= report_seconds:
+                self.print_metrics()
+                last_report = time.perf_counter()
+
+        for t in threads:
+            t.join()
+        self.print_metrics()
+        return self.metrics
+
+    def print_metrics(self):
+        elapsed = time.perf_counter() - self.started
+        header = (f"| {'Stage':^10} | {'Workers':^7} | {'In':^8} | {'Out':^8} | {'Errors':^6} | {'Out/s':^8} | "
+                  f"{'Busy %':^6} | {'Blocked %':^9} | {'Starved %':^9} |")
+        print(f"after {elapsed:.0f}s")
+        print(header)
+        print("-" * len(header))
+        for m in self.metrics:
+            # share of the workers' time
+            total = elapsed * m.workers / 100
+            print(f"| {m.name:^10} | {m.workers:^7} | {m.items_in:^8} | {m.items_out:^8} | {m.errors:^6} | "
+                  f"{m.items_out / elapsed:^8.2f} | {m.busy / total:^6.1f} | {m.blocked / total:^9.1f} | "
+                  f"{m.starved / total:^9.1f} |", flush=True)
+
+
+def load_gen_out():
+    # gen-out.py is a script, it is loaded by path because of the dash in its name
+    spec = importlib.util.spec_from_file_location("gen_out", path.join(path.dirname(__file__), SZZ_DIR, "gen-out.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def commit_tasks(gen_out, repo_path: str, targets: list[tuple[str, int]], window: int = WINDOW) -> Iterator[tuple]:
+    # (old commit, target commit, bug introducing), the same pairs gen-out.py compares
+    for target, bug_introducing in targets:
+        for commit in gen_out.get_commits_before(repo_path, target, window):
+            yield commit.hexsha, target, bug_introducing
+
+
+def to_record(pair, repo_name: RepoName) -> Record:
+    d = asdict(pair)
+    d["id"] = d.pop("_id")
+    return Record(repo=repo_name, commit_pair=CommitPair(**d))
+
+
+def _pair_key(cp: CommitPair) -> tuple:
+    # everything but the id, gen-out may number the pairs differently in another run
+    return tuple(cp.model_dump(exclude={"id"}).values())
+
+
+def pipeline_partial_dir(repo_name: RepoName) -> str:
+    # pickle segments for every backend, removed once a run saved its records
+    return path.join(DATA_PATH, OUTPUTS_DIR, PIPELINE_DIR, f"{repo_name}.partial")
+
+
+def partial_answers(repo_name: RepoName) -> dict[tuple, Record]:
+    # Answered records of an interrupted run by _pair_key, later segments win
+    return {_pair_key(r.commit_pair): r for r in load_partial_segments(pipeline_partial_dir(repo_name))
+            if r.gpt_response is not None}
+
+
+def run_repo(szz_file: str, window: int = WINDOW, inference_workers: int = INFERENCE_WORKERS, clean=True,
+             ask: Callable | None = None, backend: StorageBackend = "pkl",
+             report_seconds: float = REPORT_SECONDS) -> list[Record]:
+    # gen-out → convert → clean → inference for one repo, without the intermediate json files.
+    # The ids are given by gen-out's counter in the order the pairs are extracted, so extraction
+    # has a single worker. Answered records are saved in partial segments of the pipeline, for
+    # every backend, and a rerun after a crash reuses the answers of the records that did not change.
+    from gpt_api import answer_record, ask_gpt
+    ask = ask or ask_gpt
+    gen_out = load_gen_out()
+    repo_name, targets = gen_out.load_targets(szz_file, base=SZZ_DIR)
+    repo_path = path.join(SZZ_DIR, gen_out.REPO_BASE, repo_name)
+    gen_out.project_name = repo_name
+    gen_out._id = 0
+
+    answered = partial_answers(repo_name)
+    if answered:
+        print(f"{repo_name}: {len(answered)} answers of an interrupted run")
+
+    def infer(r: Record) -> list[Record]:
+        # records whose inference failed are kept without a response, like chat-gpt-api.py does
+        previous = answered.get(_pair_key(r.commit_pair))
+        if previous is not None:
+            r.gpt_response, r.prompt, r.attempts = previous.gpt_response, previous.prompt, previous.attempts
+        else:
+            answer_record(r, ask)
+        return [r]
+
+    records: list[Record] = []
+    # writes the records in the background, the final save below still has every record
+    partial_dir = pipeline_partial_dir(repo_name)
+    checkpoint = Record.Filter([], partial_save=10, auto_complete=False,
+                               save=partial(save_partial_segment, partial_dir=partial_dir, name=repo_name))
+
+    def sink(r: Record):
+        records.append(r)
+        if r.gpt_response is None or _pair_key(r.commit_pair) in answered:
+            return
+        try:
+            checkpoint.done(r)
+        except Exception:
+            logging.exception("partial save failed")
+    pipeline = (Pipeline(commit_tasks(gen_out, repo_path, targets, window))
+                .stage("extract", lambda task: gen_out.compare_commits(repo_path, *task)[0])
+                .stage("convert", lambda pair: [to_record(pair, repo_name)] if not clean or gen_out.is_clean(pair) else [])
+                .stage("infer", infer, workers=inference_workers))
+    try:
+        pipeline.run(sink, report_seconds=report_seconds)
+    finally:
+        try:
+            checkpoint.close()
+        except Exception:
+            logging.exception("partial save failed")
+    failed = sum(1 for r in records if not r.gpt_response)
+    print(f"{repo_name}: {len(records)} records, {failed} without a response")
+    save_records(records, repo_name=repo_name, backend=backend)
+    rmtree(partial_dir, ignore_errors=True)
+    for m in pipeline.metrics:
+        metrics.inc(f"pipeline_{m.name}_items", m.items_out)
+        metrics.inc(f"pipeline_{m.name}_busy_seconds", m.busy)
+        metrics.inc(f"pipeline_{m.name}_blocked_seconds", m.blocked)
+    metrics.export(f"pipeline-{repo_name}")
+    return records
+
+
+if __name__ == "__main__":
+    # python pipeline.py SZZ-2-CPs/szz-in/3.json
+    for szz_file in sys.argv[1:]:
+        run_repo(szz_file)
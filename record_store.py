@@ -0,0 +1,246 @@
+import sqlite3
+import json
+import pickle as pkl
+from os import path
+from typing import Iterable, Iterator
+from utils import Record, CommitPair, GptResponse, DATA_PATH, OUTPUTS_DIR, RECORDS_DB
+from string_pool import POOLED_FIELDS, content_key, pool_prompt
+
+# Columns that are kept next to the pickled record so that scripts can
+# filter rows without deserializing them.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    repo TEXT NOT NULL,
+    id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    bug_introducing INTEGER NOT NULL,
+    old_commit_hash TEXT NOT NULL,
+    new_commit_hash TEXT NOT NULL,
+    old_commit_date TEXT NOT NULL,
+    new_commit_date TEXT NOT NULL,
+    has_response INTEGER NOT NULL,
+    finish_reason TEXT,
+    data BLOB NOT NULL,
+    PRIMARY KEY (repo, id)
+);
+CREATE TABLE IF NOT EXISTS strings (
+    hash TEXT PRIMARY KEY,
+    text TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS records_position ON records (repo, position);
+CREATE INDEX IF NOT EXISTS records_id ON records (id);
+CREATE INDEX IF NOT EXISTS records_bug_introducing ON records (repo, bug_introducing);
+CREATE INDEX IF NOT EXISTS records_old_commit ON records (old_commit_hash);
+CREATE INDEX IF NOT EXISTS records_new_commit ON records (new_commit_hash);
+CREATE INDEX IF NOT EXISTS records_dates ON records (repo, old_commit_date, new_commit_date);
+CREATE INDEX IF NOT EXISTS records_finish_reason ON records (repo, has_response, finish_reason);
+"""
+
+COLUMNS = ("repo", "id", "position", "bug_introducing", "old_commit_hash", "new_commit_hash",
+           "old_commit_date", "new_commit_date", "has_response", "finish_reason", "data")
+
+
+def _pack(record: Record, strings: dict[str, str]) -> bytes:
+    # Method bodies, comments and prompt messages are replaced by their content hash,
+    # the texts go to the strings table once.
+    def add(text: str) -> str:
+        key = content_key(text)
+        strings[key] = text
+        return key
+
+    cp = record.commit_pair.model_dump()
+    for f in POOLED_FIELDS:
+        cp[f] = add(cp[f])
+    response = record.gpt_response
+    return pkl.dumps({"repo": record.repo, "commit_pair": cp,
+                      "gpt_response": response.model_dump() if response else None,
+                      "prompt": pool_prompt(record.prompt, add),
+                      "attempts": record.attempts, "ocd_label": record.ocd_label}, protocol=pkl.HIGHEST_PROTOCOL)
+
+
+def _pooled_keys(data: dict) -> list[str]:
+    keys = [data["commit_pair"][f] for f in POOLED_FIELDS]
+    prompt = data["prompt"]
+    if isinstance(prompt, str):
+        keys.append(prompt)
+    elif isinstance(prompt, list):
+        keys += [m["content"] for m in prompt if isinstance(m, dict) and isinstance(m.get("content"), str)]
+    return keys
+
+
+def _unpack(data: dict, strings: dict[str, str]) -> Record:
+    cp = data["commit_pair"]
+    for f in POOLED_FIELDS:
+        cp[f] = strings[cp[f]]
+    response = data["gpt_response"]
+    # Rows were validated when they were written
+    return Record.model_construct(repo=data["repo"], commit_pair=CommitPair.model_construct(**cp),
+                                  gpt_response=GptResponse.model_construct(**response) if response else None,
+                                  prompt=pool_prompt(data["prompt"], strings.__getitem__),
+                                  attempts=data["attempts"], ocd_label=data["ocd_label"])
+
+
+def _to_row(record: Record, position: int, strings: dict[str, str]) -> tuple:
+    cp = record.commit_pair
+    response = record.gpt_response
+    return (record.repo, cp.id, position, int(cp.bug_introducing), cp.old_commit_hash, cp.new_commit_hash,
+            cp.old_commit_date.isoformat(), cp.new_commit_date.isoformat(), int(response is not None),
+            response.finish_reason if response else None, _pack(record, strings))
+
+
+class RecordStore:
+    def __init__(self, db_path: str | None = None):
+        if db_path is None:
+            db_path = path.join(DATA_PATH, OUTPUTS_DIR, RECORDS_DB)
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def _insert(self, rows: list[tuple], strings: dict[str, str], replace=False):
+        verb = "INSERT OR REPLACE" if replace else "INSERT"
+        self.conn.executemany(f"{verb} INTO records VALUES ({', '.join('?' * len(COLUMNS))})", rows)
+        self.conn.executemany("INSERT OR IGNORE INTO strings VALUES (?, ?)", strings.items())
+
+    def write(self, records: list[Record], repo_name: str | None = None):
+        # Replaces every record of the repo, keeping the list order.
+        if not repo_name:
+            repo_name = records[0].repo
+        self.write_batches([records], repo_name)
+
+    def write_batches(self, batches: Iterable[list[Record]], repo_name: str) -> int:
+        # Same as write, for records that arrive in batches. Everything is one transaction.
+        count = 0
+        with self.conn:
+            self.conn.execute("DELETE FROM records WHERE repo = ?", (repo_name,))
+            for batch in batches:
+                strings = {}
+                rows = [_to_row(r, count + i, strings) for i, r in enumerate(batch)]
+                self._insert(rows, strings)
+                count += len(batch)
+        return count
+
+    def upsert(self, records: Iterable[Record]):
+        # Updates records in place. New records are appended after the last position of their repo.
+        strings = {}
+        rows = []
+        with self.conn:
+            for r in records:
+                cur = self.conn.execute("SELECT position FROM records WHERE repo = ? AND id = ?",
+                                        (r.repo, r.commit_pair.id)).fetchone()
+                if cur is None:
+                    cur = self.conn.execute("SELECT COALESCE(MAX(position) + 1, 0) FROM records WHERE repo = ?",
+                                            (r.repo,)).fetchone()
+                    # the next new record of this repo must see this one
+                    self.conn.execute(f"INSERT INTO records VALUES ({', '.join('?' * len(COLUMNS))})",
+                                      _to_row(r, cur[0], strings))
+                    continue
+                rows.append(_to_row(r, cur[0], strings))
+            self._insert(rows, strings, replace=True)
+
+    def prune_strings(self) -> int:
+        # Drops texts no record refers to anymore, e.g. after a repo was rewritten.
+        used = set()
+        for (data,) in self.conn.execute("SELECT data FROM records"):
+            used.update(_pooled_keys(pkl.loads(data)))
+        unused = [(k,) for (k,) in self.conn.execute("SELECT hash FROM strings") if k not in used]
+        with self.conn:
+            self.conn.executemany("DELETE FROM strings WHERE hash = ?", unused)
+        return len(unused)
+
+    def string_stats(self, repo: str | None = None) -> tuple[int, int]:
+        # (referenced texts, distinct texts) of the pooled fields
+        where, params = self._where(repo=repo)
+        refs, unique = 0, set()
+        for (data,) in self.conn.execute(f"SELECT data FROM records{where}", params):
+            keys = _pooled_keys(pkl.loads(data))
+            refs += len(keys)
+            unique.update(keys)
+        return refs, len(unique)
+
+    def _where(self, repo: str | None = None, ids: Iterable[str] | None = None, bug_introducing: bool | None = None,
+               has_response: bool | None = None, finish_reason: str | None = None, commit_hash: str | None = None,
+               old_commit_hash: str | None = None, new_commit_hash: str | None = None,
+               date_from: str | None = None, date_to: str | None = None) -> tuple[str, list]:
+        clauses, params = [], []
+        if repo is not None:
+            clauses.append("repo = ?")
+            params.append(repo)
+        if ids is not None:
+            # Passed as one json parameter so that large id lists don't hit the variable limit
+            clauses.append("id IN (SELECT value FROM json_each(?))")
+            params.append(json.dumps(list(ids)))
+        if bug_introducing is not None:
+            clauses.append("bug_introducing = ?")
+            params.append(int(bug_introducing))
+        if has_response is not None:
+            clauses.append("has_response = ?")
+            params.append(int(has_response))
+        if finish_reason is not None:
+            clauses.append("finish_reason = ?")
+            params.append(finish_reason)
+        if commit_hash is not None:
+            clauses.append("(old_commit_hash = ? OR new_commit_hash = ?)")
+            params.extend([commit_hash, commit_hash])
+        if old_commit_hash is not None:
+            clauses.append("old_commit_hash = ?")
+            params.append(old_commit_hash)
+        if new_commit_hash is not None:
+            clauses.append("new_commit_hash = ?")
+            params.append(new_commit_hash)
+        # Dates are compared on the new (target) commit date, in ISO format.
+        if date_from is not None:
+            clauses.append("new_commit_date >= ?")
+            params.append(date_from)
+        if date_to is not None:
+            clauses.append("new_commit_date < ?")
+            params.append(date_to)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def iter_query(self, limit: int | None = None, batch_size: int = 1000, **filters) -> Iterator[Record]:
+        where, params = self._where(**filters)
+        sql = f"SELECT data FROM records{where} ORDER BY repo, position"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        cur = self.conn.execute(sql, params)
+        strings: dict[str, str] = {}
+        while batch := cur.fetchmany(batch_size):
+            batch = [pkl.loads(data) for (data,) in batch]
+            missing = {k for d in batch for k in _pooled_keys(d)} - strings.keys()
+            if missing:
+                # texts are cached for the whole query so repeated bodies are shared
+                strings.update(self.conn.execute("SELECT hash, text FROM strings WHERE hash IN (SELECT value FROM json_each(?))",
+                                                 (json.dumps(list(missing)),)))
+            for d in batch:
+                yield _unpack(d, strings)
+
+    def query(self, limit: int | None = None, **filters) -> list[Record]:
+        return list(self.iter_query(limit=limit, **filters))
+
+    def select(self, columns: list[str], **filters) -> list[tuple]:
+        # Reads only metadata columns, e.g. select(["id", "bug_introducing"], repo="storm")
+        for c in columns:
+            if c not in COLUMNS:
+                raise ValueError(f"Unknown column {c}")
+        where, params = self._where(**filters)
+        return self.conn.execute(f"SELECT {', '.join(columns)} FROM records{where} ORDER BY repo, position",
+                                 params).fetchall()
+
+    def ids(self, **filters) -> list[str]:
+        return [x for (x,) in self.select(["id"], **filters)]
+
+    def count(self, **filters) -> int:
+        where, params = self._where(**filters)
+        return self.conn.execute(f"SELECT COUNT(*) FROM records{where}", params).fetchone()[0]
+
+    def repos(self) -> list[str]:
+        return [x for (x,) in self.conn.execute("SELECT DISTINCT repo FROM records ORDER BY repo")]
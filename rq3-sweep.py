@@ -0,0 +1,23 @@
+# %%
+from utils import *
+from analytics import WindowIndex, load_all, window_sweep, export_sweep_csv, STATUS_NAMES
+
+# RQ3: how the counts change with the size of the window before the target commit
+WINDOWS = list(range(1, 15))
+CSV_PATH = "data/out/rq3_window_sweep.csv"
+
+if __name__ == "__main__":
+    repo_names: list[RepoName] = ["archiva", "aries",
+                                  "cxf", "jena", "mesos", "storm", "karaf"]
+    indexes = [WindowIndex.from_columns(cols) for cols in load_all(repo_names)]
+    indexes.append(WindowIndex.merge(indexes))
+    sweep = window_sweep(indexes, WINDOWS)
+    export_sweep_csv(CSV_PATH, sweep, WINDOWS)
+
+    header = f"| {'Days':^6} | " + " | ".join(f"{name[:10] + ' BI':^14} | {name[:10] + ' NBI':^14}" for name in STATUS_NAMES[:3]) + " |"
+    print(header)
+    print("-" * len(header))
+    for w, row in zip(WINDOWS, sweep["all"]):
+        print(f"| {w:^6} | " + " | ".join(f"{row[s, 0]:^14} | {row[s, 1]:^14}" for s in range(3)) + " |")
+    print(f"Saved {CSV_PATH}")
+# %%
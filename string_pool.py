@@ -0,0 +1,106 @@
+import sys
+import pickle as pkl
+from hashlib import blake2b
+from dataclasses import dataclass
+from utils import Record, RepoName, load_records
+
+# CommitPair fields that are stored once per distinct text.
+POOLED_FIELDS = ("old_method_content", "new_method_content",
+                 "old_comment", "new_comment")
+
+
+def content_key(text: str) -> str:
+    # Must match content_key in SZZ-2-CPs/gen-out.py
+    return blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+@dataclass
+class PoolStats:
+    # sizes are in characters
+    refs: int
+    unique: int
+    raw_size: int
+    unique_size: int
+
+    @property
+    def dedup_ratio(self) -> float:
+        return self.refs / self.unique if self.unique else 1.0
+
+    @property
+    def saved_size(self) -> int:
+        return self.raw_size - self.unique_size
+
+
+class StringPool:
+    def __init__(self):
+        self.strings: dict[str, str] = {}
+        self._canonical: dict[str, str] = {}
+        self.refs = 0
+        self.raw_size = 0
+
+    def intern(self, text: str) -> str:
+        # Returns the pooled copy so that equal texts share one object in memory and in pickles.
+        self.refs += 1
+        self.raw_size += len(text)
+        return self._canonical.setdefault(text, text)
+
+    def add(self, text: str) -> str:
+        # Same as intern, returns the content hash to refer to the text.
+        text = self.intern(text)
+        key = content_key(text)
+        self.strings.setdefault(key, text)
+        return key
+
+    def get(self, key: str) -> str:
+        return self.strings[key]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.strings
+
+    def __len__(self):
+        return len(self._canonical)
+
+    def stats(self) -> PoolStats:
+        return PoolStats(self.refs, len(self._canonical), self.raw_size,
+                         sum(len(x) for x in self._canonical))
+
+
+def pool_prompt(prompt, add: callable):
+    # Prompts are lists of messages, the system message is the same for every record.
+    if isinstance(prompt, list):
+        return [{**m, "content": add(m["content"])} if isinstance(m, dict) and isinstance(m.get("content"), str) else m
+                for m in prompt]
+    if isinstance(prompt, str):
+        return add(prompt)
+    return prompt
+
+
+def intern_records(records: list[Record], pool: StringPool | None = None) -> StringPool:
+    if pool is None:
+        pool = StringPool()
+    for r in records:
+        cp = r.commit_pair
+        for f in POOLED_FIELDS:
+            setattr(cp, f, pool.intern(getattr(cp, f)))
+        r.prompt = pool_prompt(r.prompt, pool.intern)
+    return pool
+
+
+def dedup_report(repo_name: RepoName) -> PoolStats:
+    records = load_records(repo_name, allow_partial=False)
+    before = len(pkl.dumps(records, protocol=pkl.HIGHEST_PROTOCOL))
+    pool = intern_records(records)
+    after = len(pkl.dumps(records, protocol=pkl.HIGHEST_PROTOCOL))
+    stats = pool.stats()
+    print(f"| {repo_name:^20} | {stats.refs:^10} | {stats.unique:^10} | {stats.dedup_ratio:^10.2f} | "
+          f"{stats.saved_size / 2**20:^12.1f} | {before / 2**20:^12.1f} | {after / 2**20:^12.1f} |")
+    return stats
+
+
+if __name__ == "__main__":
+    header = (f"| {'Repo':^20} | {'Strings':^10} | {'Unique':^10} | {'Ratio':^10} | "
+              f"{'MemSaved MB':^12} | {'Pickle MB':^12} | {'Pooled MB':^12} |")
+    print(header)
+    print("-" * len(header))
+    for rn in sys.argv[1:]:
+        dedup_report(rn)
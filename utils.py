@@ -1,230 +1,162 @@
-from enum import Enum
-from os import path, rename, remove, mkdir, listdir
+from os import path, rename, remove, makedirs, listdir
 from shutil import rmtree
 import json
-from typing import Callable, Literal
-from openai.types.chat.chat_completion import ChatCompletion
+from typing import Literal
 import pickle as pkl
-import jsonlines
-from pydantic import BaseModel
 from datetime import datetime, timedelta
-from dataclasses import dataclass
-
-RepoName = Literal[
-    'ambari',
-    'ant',
-    'archiva',
-    'aries',
-    'beam',
-    'cassandra',
-    'cocoon',
-    'cxf',
-    'directory-server',
-    'flink',
-    'fop-cs',
-    'geronimo',
-    'hadoop',
-    'ignite',
-    'isis',
-    'jclouds',
-    'jena',
-    'JMETER',
-    'karaf',
-    'lenya',
-    'logging-log4j2',
-    'maven',
-    'mesos',
-    'ofbizApp',
-    'out',
-    'poi',
-    'qpid',
-    'storm',
-    'synapse',
-    'tomcat',
-    'tomee',
-    'usergrid',
-    'wicket',
-    'gt',
-    'vgt'
-]
+import metrics
+# the models are re-exported, scripts and old pickles refer to them as utils.<name>
+from models import (RepoName, StorageBackend, CommitPair, GptResponse, GptMessage, Record, RecordStatus,
+                    RecordResult, STATUSES, PAST_OUTDATED, OUTDATED, NORMAL, UNCATEGORIZED, classify_status,
+                    ParsedRecord, StatusIndex)
 
 DATA_PATH = "data/"
 INPUTS_DIR = "in"
 OUTPUTS_DIR = "out"
 PARTIAL_DIR = "partial"
+RECORDS_DB = "records.sqlite"
 
 
-class CommitPair(BaseModel):
-    old_commit_hash: str
-    new_commit_hash: str
-    old_method_content: str
-    new_method_content: str
-    old_comment: str
-    new_comment: str
-    file_path: str
-    bug_introducing: bool
-    old_commit_date: datetime
-    new_commit_date: datetime
-    id: str
-
-
-class GptResponse(BaseModel):
-    created: int
-    response: str
-    finish_reason: str
-    usage: dict[str, int]
-    id: str
-    model: str
-
-    @classmethod
-    def from_ChatCompletion(cls, openai_res: ChatCompletion) -> 'GptResponse':
-        d = {
-            "id": openai_res.id,
-            "response": openai_res.choices[0].message.content,
-            "finish_reason": openai_res.choices[0].finish_reason,
-            "usage": openai_res.usage.model_dump(),
-            "model": openai_res.model,
-            "created": openai_res.created
-        }
-        return cls(**d)
-
-
-class Record(BaseModel):
-    repo: str
-    commit_pair: CommitPair
-
-    gpt_response: GptResponse | None = None
-    prompt: str | None | list = None
-    attempts: int = 0
-    ocd_label: int | None = None
-
-    class Filter:
-        def __init__(self, data: list['Record'], filter: Literal['no_response'] | None = None, partial_save: int = 10, partial_reports: int = 0, report_clb: Callable | None = None):
-            self.data = data
-            if filter == 'no_response':
-                self.filtered_indices = [i for i, r in enumerate(
-                    data) if r.gpt_response is None]
-            else:
-                self.filtered_indices = range(len(data))
-
-            self.iter = iter(self.filtered_indices)
-            self.partial_save = partial_save
-            self.to_save = []
-            self.send_reports = partial_reports
-            self.count = 0
-            self.report_clb = report_clb
-
-        def __iter__(self):
-            return self
-
-        def __next__(self):
-            i = next(self.iter)
-
-            if len(self.to_save) >= self.partial_save:
-                print("Saving partial result")
-                save_records(self.to_save, partial=True)
-                self.to_save = []
-            else:
-                self.to_save.append(self.data[i])
-
-            if self.report_clb and self.count % self.send_reports == 0:
-                self.report_clb(self.count, len(self.filtered_indices))
-
-            self.count += 1
+def convert_commit_pair_2_records(cp_name: RepoName, auto_save=True,
+                                  save_as: Literal["pkl", "jsonl", "sqlite", "zstd"] = "pkl",
+                                  batch_size: int = 10000):
+    # Streams data/in/<cp_name>.json and validates it in batches, see ingest.py.
+    from ingest import ingest
+    return ingest(cp_name, auto_save=auto_save, save_as=save_as, batch_size=batch_size)
+
+
+def records_path(repo_name: RepoName, backend: StorageBackend) -> str:
+    if backend == "zstd":
+        from compressed_store import compressed_path
+        return compressed_path(repo_name)
+    return path.join(DATA_PATH, OUTPUTS_DIR, f"{repo_name}.pkl")
+
+
+def read_records(file_path: str, backend: StorageBackend) -> list[Record]:
+    if backend == "zstd":
+        from compressed_store import CompressedRecords
+        compressed = CompressedRecords(file_path)
+        records = list(compressed)
+        compressed.close()
+        return records
+    with open(file_path, 'rb') as fin:
+        return pkl.load(fin)
 
-            return self.data[i]
 
-        def __len__(self):
-            return len(self.filtered_indices)
+def write_records(records: list[Record], file_path: str, backend: StorageBackend):
+    if backend == "zstd":
+        from compressed_store import write_compressed
+        write_compressed(records, file_path)
+        return
+    with open(file_path, 'wb') as fout:
+        pkl.dump(records, fout)
 
 
-def convert_commit_pair_2_records(cp_name: RepoName, auto_save=True,
-                                  save_as: Literal["pkl", "jsonl"] = "pkl"):
-    with open(path.join(DATA_PATH, INPUTS_DIR, f"{cp_name}.json"), 'r') as fin:
-        # HOTFIX: json files have the field _id CommitPair expects id
-        tmp = json.load(fin)
-        for dp in tmp:
-            dp["id"] = dp["_id"]
-        cps = [CommitPair(**x) for x in tmp]
-
-    records = [Record(repo=cp_name, commit_pair=cp) for cp in cps]
-    if auto_save:
-        save_path = path.join(DATA_PATH, OUTPUTS_DIR,
-                              f"{cp_name}.{save_as}")
-        if save_as == "pkl":
-            save_records(records, repo_name=cp_name, invalidate_partial=False)
-        elif save_as == "jsonl":
-            json_res = [r.model_dump_json() for r in records]
-            with jsonlines.open(save_path, 'w') as writer:
-                writer.write_all(json_res)
-        else:
-            raise ValueError("save_as must be either pkl or jsonl.")
+def save_partial_segment(records: list[Record], partial_dir: str, name: str) -> str:
+    # <name>.pkl.<n> with the next free n, partial segments are small, they stay pickles for every backend
+    makedirs(partial_dir, exist_ok=True)
+    count = 0
+    while path.exists(path.join(partial_dir, f"{name}.pkl.{count}")):
+        count += 1
+    save_path = path.join(partial_dir, f"{name}.pkl.{count}")
+    with open(save_path, 'wb') as fout:
+        pkl.dump(records, fout)
+    return save_path
+
+
+def load_partial_segments(partial_dir: str) -> list[Record]:
+    # The records of every segment, later segments last so that they win over older ones
+    if not path.exists(partial_dir):
+        return []
+    segments = [x for x in listdir(partial_dir) if ".pkl." in x]
+    records = []
+    for x in sorted(segments, key=lambda x: int(x.rsplit(".", 1)[1])):
+        with open(path.join(partial_dir, x), 'rb') as fin:
+            records += pkl.load(fin)
     return records
 
 
-def load_records(repo_name: RepoName, auto_create=False, allow_partial=True):
-    records_path = path.join(DATA_PATH, OUTPUTS_DIR, f"{repo_name}.pkl")
+@metrics.timed("load_records_seconds")
+def load_records(repo_name: RepoName, auto_create=False, allow_partial=True, backend: StorageBackend = "pkl", lazy=False, **filters):
+    if lazy:
+        # Method bodies, comments, prompts and responses stay in a memory-mapped file.
+        from lazy_records import LazyRecords, lazy_paths
+        if filters:
+            raise ValueError("filters are not supported for lazy records.")
+        meta_path, _ = lazy_paths(repo_name)
+        sources = [path.join(DATA_PATH, OUTPUTS_DIR, RECORDS_DB) if backend == "sqlite" else records_path(repo_name, backend)]
+        if allow_partial and backend != "sqlite":
+            partial_dir = path.join(DATA_PATH, OUTPUTS_DIR, PARTIAL_DIR, repo_name)
+            sources += [path.join(partial_dir, x) for x in listdir(partial_dir)] if path.exists(partial_dir) else []
+        # The memory-mapped copy is rebuilt whenever its source changed.
+        if not path.exists(meta_path) or any(path.exists(x) and path.getmtime(x) > path.getmtime(meta_path) for x in sources):
+            LazyRecords.build(load_records(repo_name, auto_create=auto_create,
+                                           allow_partial=allow_partial, backend=backend), repo_name)
+        return LazyRecords.open(repo_name)
+
+    if backend == "sqlite":
+        # Partial saves are written in place, so there is nothing to merge.
+        from record_store import RecordStore
+        with RecordStore() as store:
+            if auto_create and store.count(repo=repo_name) == 0:
+                convert_commit_pair_2_records(repo_name, save_as="sqlite")
+            records = store.query(repo=repo_name, **filters)
+        if not records and not filters:
+            raise ValueError("Could not find records")
+        return records
+    elif backend not in ("pkl", "zstd"):
+        raise ValueError("backend must be either pkl, sqlite or zstd.")
+    elif filters:
+        raise ValueError("filters are only supported by the sqlite backend.")
+
+    file_path = records_path(repo_name, backend)
     if allow_partial and path.exists(path.join(DATA_PATH, OUTPUTS_DIR, PARTIAL_DIR, repo_name)):
         print("loading from partial data")
         print("getting blank data from out dir")
-        records_path = path.join(DATA_PATH, OUTPUTS_DIR, f"{repo_name}.pkl")
-        with open(records_path, 'rb') as fin:
-            records: list[Record] = pkl.load(fin)
+        records = read_records(file_path, backend)
 
         mapping: dict[str, int] = {}
         for index, r in enumerate(records):
             mapping[r.commit_pair.id] = index
 
         print("loaded blank dir")
-        base_path = path.join(DATA_PATH, OUTPUTS_DIR, PARTIAL_DIR, repo_name)
-        partial_segments = [x for x in listdir(base_path) if ".pkl." in x]
         # We must prioritize the later pkl files over old pkl files.
-        partial_segments = [int(x.split('.')[-1]) for x in partial_segments]
-        partial_segments.sort()
-        partial_segments = [f"{repo_name}.pkl.{x}" for x in partial_segments]
-
-        print("found partial segments", partial_segments)
-        for ps in partial_segments:
-            with open(path.join(base_path, ps), 'rb') as fin:
-                tmp_records: list[Record] = pkl.load(fin)
-            for r in tmp_records:
-                records[mapping[r.commit_pair.id]] = r
+        for r in load_partial_segments(path.join(DATA_PATH, OUTPUTS_DIR, PARTIAL_DIR, repo_name)):
+            records[mapping[r.commit_pair.id]] = r
         return records
 
-    if not path.exists(records_path) and auto_create:
-        records_path = path.join(DATA_PATH, OUTPUTS_DIR, f"{repo_name}.pkl")
-        convert_commit_pair_2_records(repo_name)
+    if not path.exists(file_path) and auto_create:
+        convert_commit_pair_2_records(repo_name, save_as=backend)
 
-    if not path.exists(records_path):
+    if not path.exists(file_path):
         raise ValueError("Could not find records")
 
-    with open(records_path, 'rb') as fin:
-        records: list[Record] = pkl.load(fin)
-
-    return records
+    return read_records(file_path, backend)
 
 
-def save_records(records: list[Record], repo_name: RepoName | None = None, partial=False, invalidate_partial=False):
+@metrics.timed("save_records_seconds")
+def save_records(records: list[Record], repo_name: RepoName | None = None, partial=False, invalidate_partial=False, backend: StorageBackend = "pkl"):
     if not repo_name:
         repo_name = records[0].repo
+
+    if backend == "sqlite":
+        from record_store import RecordStore
+        with RecordStore() as store:
+            if partial:
+                store.upsert(records)
+            else:
+                store.write(records, repo_name=repo_name)
+        return
+    elif backend not in ("pkl", "zstd"):
+        raise ValueError("backend must be either pkl, sqlite or zstd.")
     partial_dir = path.join(DATA_PATH, OUTPUTS_DIR,
                             PARTIAL_DIR, repo_name)
 
-    record_path = path.join(DATA_PATH, OUTPUTS_DIR, f"{repo_name}.pkl")
+    record_path = records_path(repo_name, backend)
 
     if partial:
-        save_path = partial_dir
-        if not path.exists(partial_dir):
-            mkdir(partial_dir)
-        count = 0
-        save_path = path.join(save_path, f"{repo_name}.pkl.0")
-        while path.exists(save_path):
-            count += 1
-            save_path = save_path.split(".pkl.")[0]
-            save_path += f".pkl.{count}"
-
+        save_partial_segment(records, partial_dir, repo_name)
     else:
-        save_path = record_path
         # Saving full/empty versions
         if path.exists(record_path):
             # backuping old data.
@@ -232,9 +164,7 @@ def save_records(records: list[Record], repo_name: RepoName | None = None, parti
             new_path = path.join(
                 directory, f"{str(datetime.now().date())}-{old_name}")
             rename(record_path, new_path)
-
-    with open(save_path, 'wb') as fout:
-        pkl.dump(records, fout)
+        write_records(records, record_path, backend)
 
     # Remove partial only if save was successfull
     if not partial and invalidate_partial:
@@ -242,36 +172,22 @@ def save_records(records: list[Record], repo_name: RepoName | None = None, parti
             rmtree(partial_dir)
 
 
-class RecordStatus(Enum):
-    PAST_OUTDATED = "past outdated"
-    OUTDATED = "outdated"
-    NORMAL = "normal"
-    UNCATEGORIZED = "uncategorized"
-
-
-@dataclass
-class RecordResult:
-    old2new: bool
-    new2new: bool
-
+def status_index_path(repo_name: str) -> str:
+    return path.join(DATA_PATH, OUTPUTS_DIR, "cleaned", f"{repo_name}.index.pkl")
 
-@dataclass
-class ParsedRecord:
-    record: Record
-    result: RecordResult
 
-    @property
-    def status(self) -> RecordStatus:
-        oc = self.record.commit_pair.old_comment
-        nc = self.record.commit_pair.new_comment
-        if oc != nc and self.result.old2new is False and self.result.new2new is False:
-            return RecordStatus.PAST_OUTDATED
-        elif self.result.old2new is True and self.result.new2new is False:
-            return RecordStatus.OUTDATED
-        elif (self.result.old2new is True and self.result.new2new is True) or (self.result.old2new is False and self.result.new2new is True):
-            return RecordStatus.NORMAL
-
-        return RecordStatus.UNCATEGORIZED
+def load_status_index(repo_name: str) -> StatusIndex:
+    # rebuilt from the cleaned records when missing or older than them
+    records_path = path.join(DATA_PATH, OUTPUTS_DIR, "cleaned", f"{repo_name}.pkl")
+    index_path = status_index_path(repo_name)
+    if path.exists(index_path) and path.getmtime(index_path) >= path.getmtime(records_path):
+        with open(index_path, "rb") as fin:
+            return pkl.load(fin)
+    with open(records_path, "rb") as fin:
+        index = StatusIndex.build(pkl.load(fin))
+    with open(index_path, "wb") as fout:
+        pkl.dump(index, fout)
+    return index
 
 
 def print_info(name: str, segment: list[ParsedRecord], separator: str = ""):
@@ -304,6 +220,3 @@ def load_gt_answers(vgt_only=True):
         # prefix = "vgt_" if vgt_only else "gt_"
         answers[d['id']] = bool(d['label'])
     return answers
-
-
-GptMessage = list